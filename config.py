@@ -16,13 +16,61 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
 #
 
-BASE="https://acme-staging.api.letsencrypt.org/directory"
+from os import path
+
+# ACME v2 directory, ACME v1 directories (e.g. acme-staging.api.letsencrypt.org)
+# are still supported
+BASE="https://acme-staging-v02.api.letsencrypt.org/directory"
+# terms agreed on ACME v1 registration, ACME v2 accounts must agree to the
+# terms named by the directory with the --terms option of register
 TERMS="https://letsencrypt.org/documents/LE-SA-v1.1.1-August-1-2016.pdf"
 WEBDIR="/tmp/acme"
 CHALLENGE_PREFIX=".well-known/acme-challenge/"
+# directory to keep cached data between runs, None disables caching
+CACHEDIR=path.expanduser("~/.cache/yalec")
+# number of seconds a cached ACME directory is used without revalidation
+DIRECTORY_TTL=3600
+# sign ACME v1 requests with the account url instead of the full JWK once the
+# account is known (ACME v2 always does), the server needs to support this
+KEY_ID_SIGNING=False
+# certificates expiring within this number of days are renewed by the renew
+# module using the given number of concurrent workers
+RENEW_DAYS=30
+RENEW_WORKERS=4
+# the daemon module spreads renewals over this number of seconds and scans the
+# certificate directory for changes in the given interval
+DAEMON_JITTER=3600
+DAEMON_RESCAN=300
+# rate limits of the ACME server to stay within during bulk renewals as pairs of
+# allowed events and window length in seconds, None disables rate limiting
+from letsencrypt.ratelimit import LIMITS as RATE_LIMITS
+# SQLite database keeping account urls, authorizations, certificates and the
+# renewal history between runs, None disables it (authorizations are cached
+# within CACHEDIR then)
+STATE_DB=path.expanduser("~/.cache/yalec/state.db")
+# directory keeping a journal of each issuance in progress, so an interrupted
+# run is resumed by the next one, None disables the journal
+JOURNALDIR=path.expanduser("~/.cache/yalec/journal")
+# file spans of all ACME operations are appended to as JSON lines in the
+# OpenTelemetry (OTLP) format, None disables tracing
+TRACE_FILE=None
+# metrics in the Prometheus text format are written to this file for the
+# textfile collector of the node exporter (must end with .prom) and served by
+# the daemon module on localhost at the given port under /metrics, None
+# disables either of them
+METRICS_FILE=None
+METRICS_PORT=None
+# log the latency breakdown (dns, connect, tls, server, transfer) per request
+LOG_TIMINGS=False
 
 from letsencrypt import http
 HttpProvider = http.HttpProviderCurl
+# use http.HttpProviderCurl2 to negotiate HTTP/2 with the ACME server
+# to record all ACME exchanges to a cassette or to replay them offline use:
+#   from letsencrypt import replay
+#   replay.HttpProviderRecord.useCassette("acme.cassette")
+#   HttpProvider = replay.HttpProviderRecord
+# or replay.HttpProviderReplay.useCassette("acme.cassette", preserveTiming = False)
 
 from letsencrypt import cert
 Certificate = cert.Certificate
@@ -21,9 +21,15 @@ from cStringIO import StringIO
 import json
 import re
 from urlparse import urlparse
-from time import sleep
+from functools import partial
+from time import time
 
 import logging
+from nonce import NoncePool
+from encoding import timestampFromRfc3339
+from poll import PollScheduler, retryAfter
+from timing import TimingCollector
+import tracing
 
 class LeException(Exception):
     """
@@ -38,6 +44,23 @@ class LeException(Exception):
         """
         self.msg = msg
         self.data = data
+
+class LeRateLimitException(LeException):
+    """
+    Exception raised, if the ACME server rejected a request because a rate
+    limit has been exceeded.
+    """
+    def __init__(self, msg, data = {}, retryAfter = None):
+        """
+        Constructor.
+        
+        @param msg: Message string of the exception.
+        @param data: Additional data. Optional.
+        @param retryAfter: Number of seconds to wait before retrying as told
+            by the server or None, if the server did not tell.
+        """
+        LeException.__init__(self, msg, data)
+        self.retryAfter = retryAfter
         
 class NewRegResponse(object):
     """
@@ -56,23 +79,33 @@ class NewRegResponse(object):
         self.success = success
         self.location = location
         self.status = status
-        self.status = structure
+        self.structure = structure
 
 class NewAuthzResponse(object):
     """
     Response object containing data received during a new-autz execution.
+    ACME v2 authorizations are handled by AuthzResponse.
+    
+    Without combinations, as for RFC 8555 authorizations, each challenge is
+    taken to be sufficient on its own.
     """
-    def __init__(self, status, structure):
+    def __init__(self, status, structure, location = ""):
         """
         Constructor.
         
         @param status: The HTTP status-code.
         @param structure: The response structure received during the request.
+        @param location: Location of the authorization.
         """
         self.status = status
         self.structure = structure
+        self.location = location
         self.challanges = structure["challenges"]
-        self.combinations = structure["combinations"]
+        self.combinations = structure.get("combinations") or [[x] for x in range(len(self.challanges))]
+        self.authzStatus = structure.get("status", "pending")
+        self.expires = None
+        if structure.has_key("expires"):
+            self.expires = timestampFromRfc3339(structure["expires"])
 
 class ChallengeResponse(object):
     """
@@ -108,8 +141,55 @@ class WaitAuthzResponse(object):
         self.error = None
         if not self.valid and structure.has_key("error"):
             self.error = structure["error"]
+        for challenge in structure.get("challenges", []):
+            if self.error is None and not self.valid and challenge.has_key("error"):
+                self.error = challenge["error"]
+
+class OrderResponse(object):
+    """
+    Response object containing the state of an ACME v2 order.
+    """
+    def __init__(self, status, structure, location):
+        """
+        Constructor.
+        
+        @param status: The HTTP status-code.
+        @param structure: The response structure received during the request.
+        @param location: Location of the order.
+        """
+        self.status = status
+        self.structure = structure
+        self.location = location
+        self.orderStatus = structure["status"]
+        self.authorizations = structure.get("authorizations", [])
+        self.finalize = structure.get("finalize")
+        self.certificate = structure.get("certificate")
+        self.error = structure.get("error")
+
+class AuthzResponse(object):
+    """
+    Response object containing an ACME v2 authorization.
+    """
+    def __init__(self, status, structure, location):
+        """
+        Constructor.
+        
+        @param status: The HTTP status-code.
+        @param structure: The response structure received during the request.
+        @param location: Location of the authorization.
+        """
+        self.status = status
+        self.structure = structure
+        self.location = location
+        self.identifier = structure["identifier"]
+        self.challanges = structure["challenges"]
+        self.authzStatus = structure["status"]
+        self.expires = None
+        if structure.has_key("expires"):
+            self.expires = timestampFromRfc3339(structure["expires"])
     
 # specification at https://ietf-wg-acme.github.io/acme/
+# ACME v2 as specified by RFC 8555
 # TODO: 6.4, 6.5
 # TODO: handle responses, raise exceptions on error
 class LeService(object):
@@ -118,6 +198,14 @@ class LeService(object):
     NEW_CERT    = u'new-cert'
     REVOKE_CERT = u'revoke-cert'
     DIR_MIN = [NEW_AUTHZ, NEW_REG, NEW_CERT, REVOKE_CERT]
+    NEW_NONCE   = u'newNonce'
+    NEW_ACCOUNT = u'newAccount'
+    NEW_ORDER   = u'newOrder'
+    REVOKE_CERT_V2 = u'revokeCert'
+    DIR_MIN_V2 = [NEW_NONCE, NEW_ACCOUNT, NEW_ORDER, REVOKE_CERT_V2]
+    # number of seconds to wait for authorizations and certificates
+    AUTHZ_DEADLINE = 90
+    CERT_DEADLINE = 90
 
     def __init__(self, baseUrl, HttpProvider, Authenticators, Certificate):
         """
@@ -129,10 +217,19 @@ class LeService(object):
         """
         self.__baseUrl = baseUrl
         self.__HttpProvider = HttpProvider
+        self.__httpPool = HttpProvider.createPool()
         self.__Authenticators = Authenticators
         self.__Certificate = Certificate
         self.__userKey = None
         self.__config = {}
+        self.__directory = None
+        self.__accountUrl = None
+        self.__keyIdSigning = False
+        self.__directoryCache = None
+        self.__authzCache = None
+        self.__stateStore = None
+        self.__observers = []
+        self.__nonces = NoncePool(self.__fetchNonces)
     
     def setUserKey(self, userKey):
         """
@@ -152,12 +249,138 @@ class LeService(object):
         """
         self.__userKey = userKey
     
+    def setAccountUrl(self, accountUrl):
+        """
+        Sets the url of the account belonging to the user-key, as returned by
+        newReg or newAccount in the location. This is done implicitly by
+        both methods.
+        
+        @param accountUrl: The account url or None, if unknown.
+        """
+        self.__accountUrl = accountUrl
+
+    def getAccountUrl(self):
+        """
+        Returns the url of the account belonging to the user-key.
+        
+        @return: The account url or None, if unknown.
+        """
+        return self.__accountUrl
+
+    def setKeyIdSigning(self, enabled):
+        """
+        Enables signing ACME v1 requests with the account url as key id
+        instead of embedding the JWK of the user-key, as soon as the account
+        url is known. This shrinks each signed request considerably, but the
+        server needs to support it. ACME v2 requests always use the key id.
+        
+        @param enabled: True to enable key id signing.
+        """
+        self.__keyIdSigning = enabled
+
+    def prefetchNonces(self, count):
+        """
+        Requests nonces from the ACME server in beforehand, so the given number
+        of signed requests can be performed without waiting for a nonce.
+        
+        @param count: The number of nonces needed.
+        """
+        self.__nonces.prefetch(count)
+
+    def close(self):
+        """
+        Closes all connections kept alive by the service. Observers providing
+        logSummary are asked to log their summary.
+        """
+        self.__event("logSummary")
+        if self.__httpPool is not None:
+            self.__httpPool.close()
+
+    def addObserver(self, observer):
+        """
+        Adds an observer that is notified after each HTTP request performed
+        by the service.
+        
+        The observer must provide a method requestDone(operation, url, status,
+        timings). The operation names the ACME step the request belongs to,
+        like "new-authz", "challenge", "poll" or "new-cert". The timings are a
+        dict as returned by the getTimings method of the HTTP provider.
+        
+        The observer may also provide the following methods, which are called
+        if present:
+            - signatureDone(): a request has been signed
+            - nonceDone(wasted): a nonce has been used, wasted is True, if
+              the server rejected it
+            - authzDone(status, polls, seconds): polling an authorization
+              finished with the given status after the given number of polls
+              and seconds since its challenges have been triggered
+            - certDone(seconds): a certificate has been received the given
+              number of seconds after the CSR has been sent
+            - errorDone(errorType): an operation failed, the type is the
+              ACME error type without namespace, like "rateLimited"
+            - logSummary(): the service is closed
+        
+        @param observer: The observer to be added.
+        """
+        self.__observers.append(observer)
+
+    def setDirectoryCache(self, cache):
+        """
+        Sets a cache used by updateDirectory to avoid fetching the directory
+        on each run.
+        
+        @param cache: A DirectoryCache instance or None to disable caching.
+        """
+        self.__directoryCache = cache
+
+    def setAuthzCache(self, cache):
+        """
+        Sets a cache of valid authorizations. Identifiers having a valid
+        authorization within the cache are skipped by multiAuthz.
+        
+        @param cache: An AuthzCache instance or None to disable caching.
+        """
+        self.__authzCache = cache
+
+    def setStateStore(self, store):
+        """
+        Sets a persistent store keeping the account urls of the user-keys and
+        the valid authorizations between runs. The store replaces the
+        authorization cache, so an account url once learned does not need to
+        be looked up again by the next run.
+        
+        @param store: A StateStore instance or None to disable the store.
+        """
+        self.__stateStore = store
+        self.__authzCache = store
+
+    def isV2(self):
+        """
+        Checks, if the server speaks ACME v2 as specified by RFC 8555. This
+        is derived from the directory, so updateDirectory must have been
+        called before.
+        
+        @return: True, if the directory is an ACME v2 directory.
+        """
+        return self.__directory is not None and self.NEW_ORDER in self.__directory
+
+    def getTermsOfService(self):
+        """
+        Returns the URL of the terms of service named by the directory.
+        
+        @return: The URL or None, if the server does not name any.
+        """
+        if self.__directory is None:
+            return None
+        return self.__directory.get("meta", {}).get("termsOfService")
+
     def setConfigEntry(self, name, value):
         """
         Sets a config-entry that is delivered to the authentifactors used.
         """
         self.__config[name] = value
         
+    @tracing.traced("acme.updateDirectory")
     def updateDirectory(self):
         """
         Updates the directory information.
@@ -170,22 +393,48 @@ class LeService(object):
         services to query, this method must be called everytime the base-url
         has been altered.
         
+        If a directory cache has been set, a cached directory is used without
+        any request as long as it is fresh. Otherwise it is revalidated by a
+        conditional request.
+        
         @raise Exception: This method raises an exception on any error.
         """
+        cache = self.__directoryCache
+        cached = None
+        if cache is not None:
+            cached = cache.load(self.__baseUrl)
+            if cached is not None and cache.isFresh(cached):
+                logging.debug("use cached directory for %s", self.__baseUrl)
+                self.__setDirectory(cached["directory"])
+                return
         logging.debug("request directory for %s", self.__baseUrl)
         self.__urlOk(self.__baseUrl)
+        header = []
+        if cached is not None and cached["etag"] is not None:
+            header.append("If-None-Match: %s" % (cached["etag"]))
+        if cached is not None and cached["lastModified"] is not None:
+            header.append("If-Modified-Since: %s" % (cached["lastModified"]))
         http = self.__newHttp(self.__baseUrl)
-        http.prepareGet()
-        resp = http.perform()
-        if resp <> 200:
+        http.prepareGet(header)
+        resp = self.__perform(http, "directory")
+        if resp == 304 and cached is not None:
+            logging.debug("cached directory still valid")
+            directory = cached["directory"]
+        elif resp == 200:
+            directory = json.load(http.getData())
+        else:
             raise LeException("invalid server response %d" % resp) 
-        data = http.getData()
-        self.__directory = json.load(data)
-        for e in self.DIR_MIN:
-            if not e in self.__directory:
-                raise LeException("%s not found in directory" % (e))
+        self.__setDirectory(directory)
         self.__keepNonce(http)
+        if cache is not None:
+            etag = http.getHeader("ETag")
+            lastModified = http.getHeader("Last-Modified")
+            if resp == 304:
+                etag = etag or [cached["etag"]]
+                lastModified = lastModified or [cached["lastModified"]]
+            cache.store(self.__baseUrl, directory, (etag or [None])[0], (lastModified or [None])[0])
     
+    @tracing.traced("acme.newReg")
     def newReg(self, contact, agreement):
         """
         Tries to perform a registration for a new user key.
@@ -195,23 +444,267 @@ class LeService(object):
             object retrieved and the location, where the registration as been
             placed.
         """
-        logging.info("perform new registration for contact: %s" % (", ".join(contact)))
+        logging.info("perform new registration for contact: %s", ", ".join(contact))
         postArr = {"resource" : "new-reg", "contact" : contact, "agreement" : agreement }
-        postData = self.__userKey.signJsonArray(postArr, self.__nonce)
-        http = self.__newHttp(self.__directory["new-reg"])
-        http.preparePost(postData, ["Nonce: %s" % (self.__nonce),])
-        resp = http.perform()
-        data = http.getData()
-        structure = json.load(data)
-        self.__keepNonce(http)
+        http, resp = self.__signedPostAll([(self.__directory["new-reg"], postArr, "new-reg")], useJwk = True)[0]
+        structure = json.load(http.getData())
         # TODO: add function to update/read registation (seet 6.3.)
         if resp not in [201, 409]:
             message = self.__errorFromStructure("%d: error during new-reg" % (resp), structure)
-            raise LeException(message, structure)
-        logging.info("registration was: %d - %s" % (resp, ("registered" if resp == 201 else "account exists")))
+            raise self.__error(message, structure, http)
+        logging.info("registration was: %d - %s", resp, ("registered" if resp == 201 else "account exists"))
+        location = self.__getLocation(http)
+        if len(location) > 0:
+            self.__storeAccountUrl(location)
+        return NewRegResponse(resp == 201, location, resp, structure)
+
+    @tracing.traced("acme.newAccount")
+    def newAccount(self, contact, termsAgreed = False, onlyReturnExisting = False):
+        """
+        Creates a new ACME v2 account for the user-key or looks up the
+        existing one. The account url is kept and used as key id for all
+        further requests.
+        
+        @param contact: List of contact URLs or None.
+        @param termsAgreed: True, if the terms of service are agreed. Optional.
+        @param onlyReturnExisting: If True, no account is created but the
+            existing account is looked up only.
+        @rtype: NewRegResponse
+        @return: Returns an object containing the registration result, the JSON
+            object retrieved and the location of the account.
+        @raise LeException: If the account could not be created.
+        """
+        if onlyReturnExisting:
+            payload = {"onlyReturnExisting" : True}
+        else:
+            logging.info("create account for contact: %s", ", ".join(contact or []))
+            payload = {"termsOfServiceAgreed" : termsAgreed}
+            if contact is not None:
+                payload["contact"] = contact
+        http, resp = self.__signedPostAll([(self.__directory[self.NEW_ACCOUNT], payload, "newAccount")], useJwk = True)[0]
+        structure = json.load(http.getData())
+        if resp not in [200, 201]:
+            message = self.__errorFromStructure("%d: error during newAccount" % (resp), structure)
+            raise self.__error(message, structure, http)
+        logging.info("account was: %d - %s", resp, ("registered" if resp == 201 else "account exists"))
         location = self.__getLocation(http)
+        self.__storeAccountUrl(location)
         return NewRegResponse(resp == 201, location, resp, structure)
 
+    @tracing.traced("acme.newOrder")
+    def newOrder(self, identifiers):
+        """
+        Creates a new ACME v2 order for the given identifiers.
+        
+        @param identifiers: The identifiers the certificate is ordered for.
+        @rtype: OrderResponse
+        @return: The order created.
+        @raise LeException: If the order could not be created.
+        """
+        logging.info("create order for %s", ", ".join([x["value"] for x in identifiers]))
+        payload = {"identifiers" : identifiers}
+        http, resp = self.__signedPost(self.__directory[self.NEW_ORDER], payload, "newOrder")
+        structure = json.load(http.getData())
+        if not resp == 201:
+            message = self.__errorFromStructure("%d: error during newOrder" % (resp), structure)
+            raise self.__error(message, structure, http)
+        return OrderResponse(resp, structure, self.__getLocation(http))
+
+    @tracing.traced("acme.fetchOrder")
+    def fetchOrder(self, url):
+        """
+        Fetches the current state of an ACME v2 order.
+        
+        @param url: The location of the order.
+        @rtype: OrderResponse
+        @return: The order.
+        @raise LeException: If the order could not be fetched.
+        """
+        http, resp = self.__signedPostAll([(url, None, "order")])[0]
+        structure = json.load(http.getData())
+        if not resp == 200:
+            message = self.__errorFromStructure("%d: error while fetching order" % (resp), structure)
+            raise self.__error(message, structure, http)
+        return OrderResponse(resp, structure, url)
+
+    @tracing.traced("acme.fetchAuthzs")
+    def fetchAuthzs(self, urls):
+        """
+        Fetches several ACME v2 authorizations concurrently.
+        
+        @param urls: The urls of the authorizations as named by the order.
+        @return: List of AuthzResponse objects in the order of the urls.
+        @raise LeException: If any authorization could not be fetched.
+        """
+        rc = []
+        for (http, resp), url in zip(self.__signedPostAll([(x, None, "authz") for x in urls]), urls):
+            structure = json.load(http.getData())
+            if not resp == 200:
+                message = self.__errorFromStructure("%d: error while fetching authorization" % (resp), structure)
+                raise self.__error(message, structure, http)
+            rc.append(AuthzResponse(resp, structure, url))
+        return rc
+
+    @tracing.traced("acme.authorizeOrder")
+    def authorizeOrder(self, authzs, journal = None):
+        """
+        Fulfills the pending ACME v2 authorizations given. For each
+        authorization the first challenge supported by the authenticators is
+        prepared, all challenges are answered together and the
+        authorizations are polled until they are done.
+        
+        The challenges prepared are cleaned up in any case. Challenges the
+        server already validates are prepared again, but not answered again.
+        
+        @param authzs: List of AuthzResponse objects.
+        @param journal: IssuanceJournal the steps are recorded to. Optional.
+        @raise LeException: If any authorization failed.
+        """
+        thumbprint = self.__userKey.getJwkThumbprint()
+        selected = []
+        for authz in authzs:
+            if authz.authzStatus == "valid":
+                logging.info("authorization already valid: %s", authz.location)
+                continue
+            challenges = [x for x in authz.challanges if self.__Authenticators.has_key(x["type"])]
+            if len(challenges) == 0:
+                raise LeException("no supported challenge found for %s" % (authz.identifier["value"]))
+            self.__checkToken(challenges[0]["token"])
+            selected.append((authz, challenges[0], ".".join([challenges[0]["token"], thumbprint])))
+
+        auths = []
+        try:
+            for authz, challenge, keyAuthorization in selected:
+                auths.append((challenge, self.__prepareJournaled(challenge, keyAuthorization, journal)))
+            respond = [x[1] for x in selected if x[1].get("status", "pending") == "pending" and not self.__isTriggered(journal, x[1]["url"])]
+            self.respondChallenges(respond)
+            for challenge in respond:
+                self.__record(journal, "challenge-triggered", uri = challenge["url"])
+            waitResps = self.waitAuthzsDone([x[0].location for x in selected])
+        finally:
+            for challenge, auth in auths:
+                self.cleanupChallenge(auth)
+                self.__record(journal, "challenge-cleaned", token = challenge["token"])
+
+        for waitResp in waitResps.values():
+            if not waitResp.valid:
+                message = self.__errorFromStructure("error during authentication", waitResp.error)
+                raise self.__authzError(message, waitResp.error)
+        for authz, challenge, keyAuthorization in selected:
+            self.__record(journal, "authz-valid", identifier = authz.identifier, location = authz.location)
+
+    @tracing.traced("acme.respondChallenges")
+    def respondChallenges(self, challenges):
+        """
+        Tells the ACME v2 server that the given challenges are ready to be
+        validated. The responses are sent concurrently.
+        
+        @param challenges: List of challenge structures as provided by the
+            server.
+        @raise LeException: Raises an exception on errors.
+        """
+        for http, resp in self.__signedPostAll([(x["url"], {}, "challenge") for x in challenges]):
+            if not resp == 200:
+                structure = json.load(http.getData())
+                message = self.__errorFromStructure("%d: error during responding challenge" % (resp), structure)
+                raise self.__error(message, structure, http)
+
+    @tracing.traced("acme.finalizeOrder")
+    def finalizeOrder(self, order, csr, journal = None):
+        """
+        Finalizes the ACME v2 order by sending the CSR and polls the order
+        until the certificate is issued. An order already finalized, e.g. by
+        an interrupted run, is polled only.
+        
+        @param order: The OrderResponse with all authorizations valid.
+        @param csr: The CSR to be signed.
+        @param journal: IssuanceJournal the steps are recorded to. Optional.
+        @rtype: OrderResponse
+        @return: The final state of the order.
+        @raise LeException: If the order became invalid or did not finish
+            in time.
+        """
+        if order.orderStatus in ["processing", "valid"]:
+            logging.info("order already finalized")
+            result = {"order" : order}
+        else:
+            logging.info("finalize order")
+            self.__record(journal, "cert-requested", location = order.location)
+            http, resp = self.__signedPost(order.finalize, {"csr" : csr.getJwsFormat()}, "finalize")
+            structure = json.load(http.getData())
+            if not resp == 200:
+                message = self.__errorFromStructure("%d: error during finalize" % (resp), structure)
+                if self.__errorType(structure) == "unauthorized":
+                    self.__evictAuthzs(csr, journal)
+                raise self.__error(message, structure, http)
+            result = {"order" : OrderResponse(resp, structure, order.location)}
+        if result["order"].orderStatus in ["processing", "ready"]:
+            logging.info("wait for certificate")
+            scheduler = PollScheduler(partial(self.__performAll, operation = "order-poll"))
+            scheduler.add(partial(self.__preparePostAsGet, order.location), partial(self.__checkOrder, result), self.CERT_DEADLINE)
+            scheduler.run()
+        order = result["order"]
+        if not order.orderStatus == "valid":
+            message = self.__errorFromStructure("order is %s" % (order.orderStatus), order.error)
+            raise LeException(message, order.error)
+        return order
+
+    @tracing.traced("acme.downloadCert")
+    def downloadCert(self, url):
+        """
+        Downloads an ACME v2 certificate chain. The first certificate of the
+        chain is the certificate issued.
+        
+        @param url: The certificate url of the order.
+        @return: The certificate.
+        @raise LeException: If the certificate could not be retrieved.
+        """
+        http, resp = self.__signedPostAll([(url, None, "fetch-cert")], ["Accept: application/pem-certificate-chain"])[0]
+        if not resp == 200:
+            raise LeException("%d: error while fetching certificate %s" % (resp, url))
+        logging.info("got certificate. create certificate object.")
+        cert = self.__Certificate()
+        cert.load(http.getData())
+        return cert
+
+    @tracing.traced("acme.orderCert")
+    def orderCert(self, identifiers, csr, journal = None):
+        """
+        Performs the full ACME v2 issuance for the given identifiers: creates
+        the order, fulfills all pending authorizations, finalizes the order
+        and downloads the certificate.
+        
+        If a journal is given, each step is recorded before the issuance goes
+        on. If the journal contains the steps of an interrupted run, the
+        issuance resumes from the last step: the certificate or the order
+        created before is reused and challenges left behind are cleaned up.
+        
+        @param identifiers: The identifiers to be contained in the
+            certificate.
+        @param csr: The CSR to be signed.
+        @param journal: IssuanceJournal the steps are recorded to. Optional.
+        @return: New certificate signed as a result of the order.
+        @raise LeException: Raises an exception on each error.
+        """
+        self.__traceIssuance(identifiers)
+        self.__beginJournal(journal, identifiers)
+        entry = journal.find("cert") if journal is not None else None
+        if entry is not None:
+            logging.info("download certificate issued before")
+            return self.downloadCert(entry["location"])
+        order = self.__resumeOrder(journal)
+        if order is None:
+            order = self.newOrder(identifiers)
+            self.__record(journal, "order", location = order.location)
+        if order.orderStatus == "pending":
+            self.authorizeOrder(self.fetchAuthzs(order.authorizations), journal)
+        started = time()
+        order = self.finalizeOrder(order, csr, journal)
+        self.__record(journal, "cert", location = order.certificate)
+        cert = self.downloadCert(order.certificate)
+        self.__event("certDone", time() - started)
+        return cert
+
     def simpleAuthz(self, identifier):
         """
         This method allows a simple way to perform a full authz for the given
@@ -221,26 +714,93 @@ class LeService(object):
         @param identifier: The identifier to perform the new-authz procedure.
         @raise Exception: A exception is raised on all errors.
         """
-        authz = self.newAuthz(identifier)
-        challenges = self.selectChallenges(authz.challanges, authz.combinations)
-        if len(challenges) == 0:
-            raise LeException("no valid combination of challenges found")
-        for challenge in challenges:
-            self.__checkToken(challenge["token"])
-            keyAuthorization = ".".join([challenge["token"], self.__userKey.getJwkThumbprint()])
-            auth = self.prepareChallenge(challenge, keyAuthorization)
-            triggerResp = self.triggerChallenge(challenge, keyAuthorization)
-            waitResp = self.waitAuthzDone(triggerResp.uri)
-            # TODO: cleanup skipped on errors
-            self.cleanupChallenge(auth)
+        self.multiAuthz([identifier,])
 
+    @tracing.traced("acme.multiAuthz")
+    def multiAuthz(self, identifiers, journal = None):
+        """
+        Performs a full authz for several identifiers at once.
+        
+        Instead of validating one identifier after another, each step is
+        carried out for all identifiers together: all authorizations are
+        requested, all challenges are prepared and triggered, and the results
+        are polled together. So the whole procedure takes about as long as the
+        validation of a single identifier.
+        
+        The challenges prepared are cleaned up in any case.
+        
+        If an authorization cache has been set, identifiers with a cached
+        valid authorization are skipped and new authorizations are stored
+        within the cache. As the expiry of the pending authorization is
+        stored, the cached expiry is a lower bound of the real one.
+        
+        If a journal is given, each step is recorded before the procedure
+        goes on. Authorizations created by an interrupted run are reused,
+        challenges already triggered are not triggered again and challenges
+        left behind are cleaned up.
+        
+        @param identifiers: The identifiers to perform the new-authz procedure.
+        @param journal: IssuanceJournal the steps are recorded to. Optional.
+        @raise Exception: A exception is raised on all errors.
+        """
+        thumbprint = self.__userKey.getJwkThumbprint()
+        self.__traceIssuance(identifiers)
+        self.__beginJournal(journal, identifiers)
+        cache = self.__authzCache
+        if cache is not None:
+            cached = [x for x in identifiers if cache.get(thumbprint, self.__baseUrl, x) is not None]
+            for identifier in cached:
+                logging.info("reuse cached authorization for %s", identifier["value"])
+            identifiers = [x for x in identifiers if x not in cached]
+        if journal is not None:
+            done = [x for x in identifiers if journal.find("authz-valid", identifier = x) is not None]
+            for identifier in done:
+                logging.info("authorization for %s became valid before", identifier["value"])
+            identifiers = [x for x in identifiers if x not in done]
+        if len(identifiers) == 0:
+            return
+        authzs = self.__resumeAuthzs(identifiers, journal)
+        selected = []
+        for authz in authzs:
+            if authz.authzStatus == "valid":
+                logging.info("authorization already valid: %s", authz.location)
+                continue
+            challenges = self.selectChallenges(authz.challanges, authz.combinations)
+            if len(challenges) == 0:
+                raise LeException("no valid combination of challenges found")
+            for challenge in challenges:
+                self.__checkToken(challenge["token"])
+                selected.append((challenge, ".".join([challenge["token"], thumbprint])))
+
+        auths = []
+        try:
+            for challenge, keyAuthorization in selected:
+                auths.append((challenge, self.__prepareJournaled(challenge, keyAuthorization, journal)))
+            triggered = [x[0]["uri"] for x in selected if self.__isTriggered(journal, x[0]["uri"])]
+            triggerResps = self.triggerChallenges([x for x in selected if x[0]["uri"] not in triggered])
+            for triggerResp in triggerResps:
+                self.__record(journal, "challenge-triggered", uri = triggerResp.uri)
+            waitResps = self.waitAuthzsDone([x.uri for x in triggerResps] + triggered)
+        finally:
+            for challenge, auth in auths:
+                self.cleanupChallenge(auth)
+                self.__record(journal, "challenge-cleaned", token = challenge["token"])
+
+        for waitResp in waitResps.values():
             if waitResp.authzStatus == "invalid":
                 message = self.__errorFromStructure("error during authentication", waitResp.error)
-                raise LeException(message, waitResp.error)
+                raise self.__authzError(message, waitResp.error)
 
             if not waitResp.valid:
                 message = self.__errorFromStructure("unknown error during authentication", waitResp.error)
-                raise LeException(message, waitResp.error)
+                raise self.__authzError(message, waitResp.error)
+
+        for identifier, authz in zip(identifiers, authzs):
+            self.__record(journal, "authz-valid", identifier = identifier, location = authz.location)
+        if cache is not None:
+            for identifier, authz in zip(identifiers, authzs):
+                if authz.expires is not None and len(authz.location) > 0:
+                    cache.put(thumbprint, self.__baseUrl, identifier, authz.location, authz.expires)
         
     def newAuthz(self, identifier):
         """
@@ -254,18 +814,27 @@ class LeService(object):
         @rtype: NewAuthzResponse
         @raise Exception: Raises an exception on every error.
         """
-        postArr = {"resource" : "new-authz", "identifier" : identifier}
-        postData = self.__userKey.signJsonArray(postArr, self.__nonce)
-        http = self.__newHttp(self.__directory["new-authz"])
-        http.preparePost(postData, ["Nonce: %s" % (self.__nonce),])
-        resp = http.perform()
-        data = http.getData()
-        structure = json.load(data)
-        self.__keepNonce(http)
-        if not resp == 201:
-            message = self.__errorFromStructure("%d: error during new-authz" % (resp), structure)
-            raise LeException(message, structure)
-        return NewAuthzResponse(resp, structure)
+        return self.newAuthzs([identifier,])[0]
+
+    @tracing.traced("acme.newAuthzs")
+    def newAuthzs(self, identifiers):
+        """
+        Performs the new-authz calls for several identifiers concurrently.
+        
+        @param identifiers: The identifiers to request the challenges for.
+        @return: List of NewAuthzResponse objects in the order of the
+            identifiers.
+        @raise Exception: Raises an exception on every error.
+        """
+        requests = [(self.__directory["new-authz"], {"resource" : "new-authz", "identifier" : x}, "new-authz") for x in identifiers]
+        rc = []
+        for http, resp in self.__signedPostAll(requests):
+            structure = json.load(http.getData())
+            if not resp == 201:
+                message = self.__errorFromStructure("%d: error during new-authz" % (resp), structure)
+                raise self.__error(message, structure, http)
+            rc.append(NewAuthzResponse(resp, structure, self.__getLocation(http)))
+        return rc
 
     def selectChallenges(self, challenges, combinations):
         """
@@ -282,16 +851,16 @@ class LeService(object):
         """
         for combination in combinations:
             auth = []
-            logging.debug("check combination: %s" % (", ".join(str(x) for x in combination)))
+            logging.debug("check combination: %s", combination)
             found = True
             for entry in combination:
                 auth.append(challenges[entry])
                 chllType = challenges[entry]["type"]
                 if not self.__Authenticators.has_key(chllType):
-                    logging.debug("no autenticator for %s" % (chllType))
+                    logging.debug("no autenticator for %s", chllType)
                     found = False
                     break
-                logging.debug("authenticator for %s found" % (chllType))
+                logging.debug("authenticator for %s found", chllType)
             if found:
                 return auth
         return []
@@ -331,18 +900,31 @@ class LeService(object):
         @rtype: ChallengeResponse
         @raise Exception: Raises an exception on errors.
         """
-        postArr = {"resource" : "challenge", "type" : challenge["type"], "keyAuthorization" : keyAuthorization }
-        postData = self.__userKey.signJsonArray(postArr, self.__nonce)
-        http = self.__newHttp(challenge["uri"])
-        http.preparePost(postData, ["Nonce: %s" % (self.__nonce),])
-        resp = http.perform()
-        data = http.getData()
-        structure = json.load(data)
-        self.__keepNonce(http)
-        if resp not in [200, 202]:
-            message = self.__errorFromStructure("%d: error during triggering challenge" % (resp), structure)
-            raise LeException(message, structure)
-        return ChallengeResponse(resp, structure)
+        return self.triggerChallenges([(challenge, keyAuthorization),])[0]
+
+    @tracing.traced("acme.triggerChallenges")
+    def triggerChallenges(self, challenges):
+        """
+        Triggers several challenges concurrently.
+        
+        @param challenges: List of pairs of challenge structure and key
+            authorization as expected by triggerChallenge.
+        @return: List of ChallengeResponse objects in the order of the
+            challenges.
+        @raise Exception: Raises an exception on errors.
+        """
+        requests = []
+        for challenge, keyAuthorization in challenges:
+            postArr = {"resource" : "challenge", "type" : challenge["type"], "keyAuthorization" : keyAuthorization }
+            requests.append((challenge["uri"], postArr, "challenge"))
+        rc = []
+        for http, resp in self.__signedPostAll(requests):
+            structure = json.load(http.getData())
+            if resp not in [200, 202]:
+                message = self.__errorFromStructure("%d: error during triggering challenge" % (resp), structure)
+                raise self.__error(message, structure, http)
+            rc.append(ChallengeResponse(resp, structure))
+        return rc
         
     def cleanupChallenge(self, auth):
         """
@@ -361,18 +943,41 @@ class LeService(object):
         
         @param uri: The uri to tech for authentication done.
         """
-        for I in range(5):
-            http = self.__newHttp(uri)
-            http.prepareGet(["Nonce: %s" % (self.__nonce),])
-            resp = http.perform()
-            data = http.getData()
-            structure = json.load(data)
-            if not structure["status"] == "pending":
-                break
-            sleep(self.__getRetryAfter(http, 1))
-        return WaitAuthzResponse(resp, structure)
+        return self.waitAuthzsDone([uri,])[uri]
+
+    @tracing.traced("acme.waitAuthzsDone")
+    def waitAuthzsDone(self, uris):
+        """
+        Keep polling for several authorization results until all are done.
+        
+        All authorizations still pending are polled concurrently, so the time
+        spent waiting is bound by the slowest authorization. Authorizations
+        still pending after AUTHZ_DEADLINE seconds are returned as pending.
+        
+        For ACME v2 the polls are signed POST-as-GET requests.
+        
+        @param uris: List of uris to check for authentication done.
+        @return: Dict mapping each uri to its WaitAuthzResponse.
+        @raise Exception: Raises an exception on transport errors.
+        """
+        results = {}
+        prepare = self.__prepareGet
+        if self.isV2():
+            prepare = self.__preparePostAsGet
+            self.__nonces.prefetch(len(uris))
+        started = time()
+        polls = dict((x, 0) for x in uris)
+        scheduler = PollScheduler(partial(self.__performAll, operation = "poll"))
+        for uri in uris:
+            scheduler.add(partial(prepare, uri), partial(self.__checkAuthz, results, uri, polls, started), self.AUTHZ_DEADLINE, 1)
+        scheduler.run()
+        for uri in uris:
+            if uri not in results or results[uri].authzStatus == "pending":
+                self.__event("authzDone", "pending", polls[uri], time() - started)
+        return results
 
-    def newCert(self, csr):
+    @tracing.traced("acme.newCert")
+    def newCert(self, csr, journal = None):
         """
         Issues a new certificate base on a CSR given.
         
@@ -380,38 +985,46 @@ class LeService(object):
         registration via a successful authentication for all targets as
         defined within the CSR.
         
+        If a journal is given, the location of the certificate is recorded.
+        If the journal already names a certificate issued by an interrupted
+        run, that certificate is fetched instead of requesting a new one.
+        
         @param csr: The CSR to be signed.
+        @param journal: IssuanceJournal the steps are recorded to. Optional.
         @return: New certificate signed as a result of the delivery of the CSR.
         @raise Exception: Raises an exception on each error.
         """
-        logging.info("request cert")
-        postArr = {"resource" : "new-cert", "csr": csr.getJwsFormat()}
-        postData = self.__userKey.signJsonArray(postArr, self.__nonce)
-        http = self.__newHttp(self.__directory["new-cert"])
-        http.preparePost(postData, ["Nonce: %s" % (self.__nonce),])
-        resp = http.perform()
-        data = http.getData()
-        self.__keepNonce(http)
-        if not resp == 201:
-            structure = None
-            try:
-                structure = json.load(data)
-            except:
-                pass
-            message = self.__errorFromStructure("%d: error during certificate request" % (resp), structure)
-            raise LeException(message, structure)
+        started = time()
+        entry = journal.find("cert") if journal is not None else None
+        if entry is not None:
+            logging.info("fetch certificate requested before")
+            location = entry["location"]
+        else:
+            logging.info("request cert")
+            self.__record(journal, "cert-requested")
+            postArr = {"resource" : "new-cert", "csr": csr.getJwsFormat()}
+            http, resp = self.__signedPost(self.__directory["new-cert"], postArr, "new-cert")
+            data = http.getData()
+            if not resp == 201:
+                structure = None
+                try:
+                    structure = json.load(data)
+                except:
+                    pass
+                message = self.__errorFromStructure("%d: error during certificate request" % (resp), structure)
+                if self.__errorType(structure) == "unauthorized":
+                    self.__evictAuthzs(csr, journal)
+                raise self.__error(message, structure, http)
+            location = self.__getLocation(http)
+            self.__record(journal, "cert", location = location)
         
         logging.info("wait for certificate")
-        location = self.__getLocation(http)
-        for I in range(4):
-            http = self.__newHttp(location)
-            http.prepareGet(["Nonce: %s" % (self.__nonce),])
-            resp = http.perform()
-            data = http.getData()
-            if not resp == 202:
-                break
-            timeout = int(http.getHeader("Retry-After"))
-            sleep(timeout)
+        result = {}
+        scheduler = PollScheduler(partial(self.__performAll, operation = "cert-poll"))
+        scheduler.add(partial(self.__prepareGet, location), partial(self.__checkCert, result), self.CERT_DEADLINE)
+        scheduler.run()
+        resp = result["resp"]
+        data = result["http"].getData()
 
         if not resp == 200:
             logging.info("could not retrieve certificate")
@@ -421,13 +1034,15 @@ class LeService(object):
             except:
                 pass
             message = self.__errorFromStructure("%d: error while waiting for certificate" % (resp), structure)
-            raise LeException(message, structure)
+            raise self.__error(message, structure, result["http"])
 
         logging.info("got certificate. create certificate object.")
         cert = self.__Certificate()
         cert.load(data, fmt = "DER")
+        self.__event("certDone", time() - started)
         return cert
     
+    @tracing.traced("acme.revokeCert")
     def revokeCert(self, cert):
         """
         Revokey the certificate provided.
@@ -436,19 +1051,19 @@ class LeService(object):
         @raise Exception: Raises an exception if revocation has failed.
         """
         logging.info("revoke cert")
-        postArr = {"resource" : "revoke-cert", "certificate": cert.getJwsFormat()}
-        postData = self.__userKey.signJsonArray(postArr, self.__nonce)
-        http = self.__newHttp(self.__directory["revoke-cert"])
-        http.preparePost(postData, ["Nonce: %s" % (self.__nonce),])
-        resp = http.perform()
+        if self.isV2():
+            payload = {"certificate": cert.getJwsFormat()}
+            http, resp = self.__signedPost(self.__directory[self.REVOKE_CERT_V2], payload, "revokeCert")
+        else:
+            postArr = {"resource" : "revoke-cert", "certificate": cert.getJwsFormat()}
+            http, resp = self.__signedPost(self.__directory["revoke-cert"], postArr, "revoke-cert")
         data = http.getData()
-        self.__keepNonce(http)
         if resp == 200:
             logging.info("revokation has been successful")
             return
         structure = json.load(data)
         message = self.__errorFromStructure("%d: error during revocation" % (resp), structure)
-        raise LeException(message, structure)
+        raise self.__error(message, structure, http)
         
     def createMailContact(self, mail):
         '''
@@ -466,6 +1081,20 @@ class LeService(object):
         '''
         return { "type" : "dns", "value" : domain }
         
+    def __setDirectory(self, directory):
+        """
+        Checks and sets the directory information. Both ACME v1 and ACME v2
+        directories are accepted.
+        
+        @param directory: The directory structure.
+        @raise Exception: If a mandatory entry is missing.
+        """
+        required = self.DIR_MIN_V2 if self.NEW_ORDER in directory else self.DIR_MIN
+        for e in required:
+            if not e in directory:
+                raise LeException("%s not found in directory" % (e))
+        self.__directory = directory
+
     def __keepNonce(self, http):
         '''
         Extracts the nonce from the header of the HTTP response and keeps it
@@ -475,10 +1104,312 @@ class LeService(object):
         '''
         nonce = http.getHeader("Replay-Nonce")
         if len(nonce) == 0:
+            logging.debug("server did not provide nonce")
+        else:
+            logging.debug("keep nonce: %s", nonce[0])
+            self.__nonces.put(nonce[0])
+
+    @tracing.traced("acme.newNonce")
+    def __fetchNonces(self, count):
+        """
+        Requests fresh nonces from the ACME server using cheap HEAD requests
+        on the directory or on the newNonce resource for ACME v2. The requests
+        are performed concurrently.
+        
+        @param count: The number of nonces to request.
+        @return: List of nonces received.
+        """
+        url = self.__baseUrl
+        if self.isV2():
+            url = self.__directory[self.NEW_NONCE]
+        https = []
+        for I in range(count):
+            http = self.__newHttp(url)
+            http.prepareHead()
+            https.append(http)
+        nonces = []
+        for http, resp in self.__performAll(https, "nonce"):
+            nonces += http.getHeader("Replay-Nonce")
+        if len(nonces) == 0:
             logging.warning("server did not provide nonce")
+        return nonces
+
+    def __signedPost(self, url, postArr, operation):
+        """
+        Signs the given post array with the user-key using a nonce of the pool
+        and posts it to the given URL.
+        
+        If the server rejects the nonce, the request is repeated once with a
+        fresh nonce.
+        
+        @param url: The url to post to.
+        @param postArr: The post array to be signed.
+        @param operation: Name of the ACME operation the request belongs to.
+        @return: Pair of the HTTP provider that performed the request and the
+            HTTP status-code.
+        """
+        return self.__signedPostAll([(url, postArr, operation),])[0]
+
+    def __signedPostAll(self, requests, moreHeader = [], useJwk = False):
+        """
+        Signs and posts several requests concurrently. Each request takes its
+        own nonce of the pool.
+        
+        Requests rejected because of an invalid nonce are repeated once with a
+        fresh nonce.
+        
+        @param requests: List of triples of url, post array and the name of
+            the ACME operation. For ACME v2 a post array None creates a
+            POST-as-GET request.
+        @param moreHeader: Additional headers for all requests. Optional.
+        @param useJwk: The requests are signed with the JWK instead of the
+            account url. Optional.
+        @return: List of pairs of HTTP provider and HTTP status-code in the
+            order of the requests.
+        @raise LeException: If a request failed on transport level.
+        """
+        if not useJwk and (self.isV2() or self.__keyIdSigning):
+            self.__ensureAccount()
+        results = [None] * len(requests)
+        pending = range(len(requests))
+        for attempt in range(2):
+            nonces = self.__nonces.take(len(pending))
+            if len(nonces) < len(pending):
+                raise LeException("server did not provide nonce")
+            https = {}
+            for index, nonce in zip(pending, nonces):
+                url, postArr, operation = requests[index]
+                http = self.__prepareSignedPost(url, postArr, nonce, moreHeader, useJwk)
+                https[http] = index
+            pending = []
+            for http, resp in self.__HttpProvider.performAll(https.keys()):
+                index = https[http]
+                self.__notify(requests[index][2], http, resp)
+                if resp == 0:
+                    self.__event("errorDone", "connection")
+                    raise LeException("request to %s failed: %s" % (http.getUrl(), http.getError()))
+                self.__keepNonce(http)
+                results[index] = (http, resp)
+                badNonce = self.__isBadNonce(http, resp)
+                self.__event("nonceDone", badNonce)
+                if attempt == 0 and badNonce:
+                    pending.append(index)
+            if len(pending) == 0:
+                break
+            logging.info("server rejected %d nonces, retry with fresh nonces", len(pending))
+        return results
+
+    def __prepareSignedPost(self, url, postArr, nonce, moreHeader = [], useJwk = False):
+        """
+        Creates a HTTP provider prepared for posting the signed post array.
+        
+        @param url: The url to post to.
+        @param postArr: The post array to be signed.
+        @param nonce: The nonce to be used for the signature.
+        @param moreHeader: Additional headers. Optional.
+        @param useJwk: Sign the request with the JWK instead of the account
+            url. Optional.
+        @return: The prepared HTTP provider.
+        """
+        http = self.__newHttp(url)
+        kid = None if useJwk else self.__accountUrl
+        self.__event("signatureDone")
+        if self.isV2():
+            postData = self.__userKey.signJws(postArr, nonce, url, kid)
+            http.preparePost(postData, moreHeader, "application/jose+json")
         else:
-            logging.debug("keep nonce: %s" % nonce[0])
-            self.__nonce = nonce[0]
+            if not self.__keyIdSigning:
+                kid = None
+            postData = self.__userKey.signJsonArray(postArr, nonce, kid)
+            http.preparePost(postData, ["Nonce: %s" % (nonce),] + moreHeader)
+        return http
+
+    def __preparePostAsGet(self, url):
+        """
+        Creates a HTTP provider prepared for an ACME v2 POST-as-GET request on
+        the given URL.
+        
+        @param url: The url to request.
+        @return: The prepared HTTP provider.
+        @raise LeException: If no nonce is available.
+        """
+        nonce = self.__nonces.get()
+        if nonce is None:
+            raise LeException("server did not provide nonce")
+        return self.__prepareSignedPost(url, None, nonce)
+
+    def __traceIssuance(self, identifiers):
+        """
+        Names the domains and the account within the active span, so all
+        spans of the issuance carry them.
+        
+        @param identifiers: The identifiers of the issuance.
+        """
+        span = tracing.current()
+        span.setAttribute("acme.domains", [x["value"] for x in identifiers])
+        if self.__accountUrl is not None:
+            span.setAttribute("acme.account.url", self.__accountUrl)
+
+    def __record(self, journal, step, **data):
+        """
+        Records an issuance step, if a journal is given.
+        
+        @param journal: The IssuanceJournal or None.
+        @param step: The name of the step.
+        @param data: The data of the step.
+        """
+        if journal is not None:
+            journal.record(step, **data)
+
+    def __isTriggered(self, journal, uri):
+        """
+        Checks, if a challenge has been triggered by an earlier run.
+        
+        @param journal: The IssuanceJournal or None.
+        @param uri: The uri of the challenge.
+        @return: True, if the journal records the challenge as triggered.
+        """
+        return journal is not None and journal.find("challenge-triggered", uri = uri) is not None
+
+    def __beginJournal(self, journal, identifiers):
+        """
+        Prepares a journal for an issuance. Challenges left behind by an
+        interrupted run are cleaned up. If the journal belongs to another
+        account or other identifiers, its records are discarded.
+        
+        @param journal: The IssuanceJournal or None.
+        @param identifiers: The identifiers of the issuance.
+        """
+        if journal is None:
+            return
+        for entry in journal.orphanedChallenges():
+            try:
+                self.__Authenticators[entry["type"]]().remove({"type" : entry["type"], "token" : entry["token"]}, self.__config)
+            except Exception as e:
+                logging.warning("cannot clean up challenge %s: %s", entry["token"], e)
+            journal.record("challenge-cleaned", token = entry["token"])
+        begin = {"base" : self.__baseUrl, "thumbprint" : self.__userKey.getJwkThumbprint(),
+                 "identifiers" : sorted([x["value"] for x in identifiers])}
+        entry = journal.find("begin")
+        if entry is not None and any(entry.get(k) != v for k, v in begin.items()):
+            logging.info("journal belongs to another issuance, start over")
+            journal.reset()
+            entry = None
+        if entry is None:
+            journal.record("begin", **begin)
+
+    def __prepareJournaled(self, challenge, keyAuthorization, journal):
+        """
+        Prepares a challenge after recording it, so it can be cleaned up by
+        the next run, if this run is interrupted.
+        
+        @param challenge: The challenge to be prepared.
+        @param keyAuthorization: The key authorization of the challenge.
+        @param journal: The IssuanceJournal or None.
+        @return: The authenticator to be cleaned up.
+        """
+        self.__record(journal, "challenge-prepared", type = challenge["type"], token = challenge["token"])
+        return self.prepareChallenge(challenge, keyAuthorization)
+
+    def __resumeAuthzs(self, identifiers, journal):
+        """
+        Returns the authorizations of the given identifiers. Pending or valid
+        authorizations recorded within the journal are fetched and reused,
+        new authorizations are requested for all others and recorded.
+        
+        @param identifiers: The identifiers.
+        @param journal: The IssuanceJournal or None.
+        @return: List of NewAuthzResponse objects in the order of the
+            identifiers.
+        """
+        authzs = [None] * len(identifiers)
+        requests = {}
+        for i, identifier in enumerate(identifiers):
+            entry = journal.find("authz", identifier = identifier) if journal is not None else None
+            if entry is not None:
+                requests[self.__prepareGet(entry["location"])] = (i, entry["location"])
+        for http, resp in self.__performAll(requests.keys(), "authz"):
+            i, location = requests[http]
+            if not resp == 200:
+                logging.info("%d: cannot fetch authorization %s, request new one", resp, location)
+                continue
+            authz = NewAuthzResponse(resp, json.load(http.getData()), location)
+            if authz.authzStatus in ["pending", "valid"]:
+                logging.info("reuse authorization %s", location)
+                authzs[i] = authz
+        missing = [i for i in range(len(identifiers)) if authzs[i] is None]
+        if len(missing) > 0:
+            for i, authz in zip(missing, self.newAuthzs([identifiers[x] for x in missing])):
+                self.__record(journal, "authz", identifier = identifiers[i], location = authz.location)
+                authzs[i] = authz
+        return authzs
+
+    def __resumeOrder(self, journal):
+        """
+        Returns the ACME v2 order recorded within the journal, if it can
+        still be used.
+        
+        @param journal: The IssuanceJournal or None.
+        @return: The OrderResponse or None, if a new order is needed.
+        """
+        entry = journal.find("order") if journal is not None else None
+        if entry is None:
+            return None
+        try:
+            order = self.fetchOrder(entry["location"])
+        except LeException as e:
+            logging.info("cannot resume order %s: %s", entry["location"], e.msg)
+            return None
+        if order.orderStatus == "invalid":
+            logging.info("order %s became invalid, create new one", order.location)
+            return None
+        logging.info("resume order %s (%s)", order.location, order.orderStatus)
+        return order
+
+    def __ensureAccount(self):
+        """
+        Looks up the account url of the user-key, if it is not known yet.
+        The account url is needed as key id for ACME v2 requests. The state
+        store is asked first, the server only for ACME v2.
+        
+        @raise LeException: If no account exists for the user-key.
+        """
+        if self.__accountUrl is None and self.__stateStore is not None:
+            self.__accountUrl = self.__stateStore.getAccount(self.__userKey.getJwkThumbprint(), self.__baseUrl)
+        if self.__accountUrl is None and self.isV2():
+            logging.debug("look up account url")
+            self.newAccount(None, onlyReturnExisting = True)
+
+    def __storeAccountUrl(self, location):
+        """
+        Sets the account url of the user-key and keeps it within the state
+        store, if any.
+        
+        @param location: The account url.
+        """
+        self.__accountUrl = location
+        if self.__stateStore is not None:
+            self.__stateStore.putAccount(self.__userKey.getJwkThumbprint(), self.__baseUrl, location)
+
+    def __isBadNonce(self, http, resp):
+        """
+        Checks, if the server rejected the request because of an invalid
+        nonce. The data stream of the provider is reset afterwards.
+        
+        @param http: The http object that carried out the request.
+        @param resp: The HTTP status-code.
+        @return: True, if the server answered with a badNonce error.
+        """
+        if not resp == 400:
+            return False
+        data = http.getData()
+        try:
+            structure = json.load(data)
+        except ValueError:
+            return False
+        finally:
+            data.seek(0)
+        return isinstance(structure, dict) and structure.get("type", "").endswith(":badNonce")
 
     def __getLocation(self, http):
         """
@@ -510,22 +1441,160 @@ class LeService(object):
             if not m:
                 continue
             rc.append((m.group(1), m.group(2)))
-        logging.debug("extracted links from header: ", rc)
+        logging.debug("extracted links from header: %s", rc)
         return rc
 
-    def __getRetryAfter(self, http, default = -1):
+    def __prepareGet(self, url):
+        """
+        Creates a HTTP provider prepared for a GET request on the given URL.
+        
+        @param url: The url to request.
+        @return: The prepared HTTP provider.
+        """
+        http = self.__newHttp(url)
+        http.prepareGet()
+        return http
+
+    def __checkAuthz(self, results, uri, polls, started, http, resp):
+        """
+        Checks the result of an authorization poll.
+        
+        @param results: Dict the WaitAuthzResponse is stored to by uri.
+        @param uri: The uri polled.
+        @param polls: Dict counting the polls by uri.
+        @param started: Unix timestamp polling has been started.
+        @param http: The http object that carried out the request.
+        @param resp: The HTTP status-code.
+        @return: True, if the authorization is not pending anymore.
+        @raise LeException: On transport errors.
+        """
+        if resp == 0:
+            self.__event("errorDone", "connection")
+            raise LeException("polling %s failed: %s" % (uri, http.getError()))
+        polls[uri] += 1
+        self.__keepNonce(http)
+        badNonce = self.__isBadNonce(http, resp)
+        if self.isV2():
+            self.__event("nonceDone", badNonce)
+        if badNonce:
+            return False
+        structure = json.load(http.getData())
+        results[uri] = WaitAuthzResponse(resp, structure)
+        if structure["status"] == "pending":
+            return False
+        self.__event("authzDone", structure["status"], polls[uri], time() - started)
+        return True
+
+    def __checkCert(self, result, http, resp):
+        """
+        Checks the result of a certificate poll.
+        
+        @param result: Dict the provider and status-code are stored to.
+        @param http: The http object that carried out the request.
+        @param resp: The HTTP status-code.
+        @return: True, if the certificate is not processed anymore.
+        @raise LeException: On transport errors.
+        """
+        if resp == 0:
+            raise LeException("polling %s failed: %s" % (http.getUrl(), http.getError()))
+        self.__keepNonce(http)
+        result["http"] = http
+        result["resp"] = resp
+        return resp != 202
+
+    def __checkOrder(self, result, http, resp):
+        """
+        Checks the result of an ACME v2 order poll.
+        
+        @param result: Dict the OrderResponse is stored to.
+        @param http: The http object that carried out the request.
+        @param resp: The HTTP status-code.
+        @return: True, if the order is not processed anymore.
+        @raise LeException: On transport errors.
+        """
+        if resp == 0:
+            raise LeException("polling %s failed: %s" % (http.getUrl(), http.getError()))
+        self.__keepNonce(http)
+        badNonce = self.__isBadNonce(http, resp)
+        self.__event("nonceDone", badNonce)
+        if badNonce:
+            return False
+        structure = json.load(http.getData())
+        if not resp == 200:
+            message = self.__errorFromStructure("%d: error while polling order" % (resp), structure)
+            raise self.__error(message, structure, http)
+        result["order"] = OrderResponse(resp, structure, result["order"].location)
+        return result["order"].orderStatus not in ["processing", "ready"]
+
+    def __evictAuthzs(self, csr, journal):
+        """
+        Drops the cached authorizations of the names of a CSR at this ACME
+        service and the steps journaled for its issuance, after the server
+        refused the certificate as unauthorized, e.g. because it deactivated
+        an authorization. So the next run validates the names again instead
+        of failing the same way until the cached authorizations expire.
+        
+        @param csr: The CSR refused.
+        @param journal: IssuanceJournal of the issuance or None.
+        """
+        names = csr.getDnsNames()
+        logging.warning("server refused authorizations, drop them for %s", ", ".join(names))
+        if self.__authzCache is not None:
+            thumbprint = self.__userKey.getJwkThumbprint()
+            for name in names:
+                self.__authzCache.remove(thumbprint, self.__baseUrl, self.createDnsAuth(name))
+        if journal is not None:
+            journal.reset()
+
+    def __error(self, message, structure, http):
+        """
+        Creates the exception for an error response of the ACME server. Rate
+        limit errors create a LeRateLimitException carrying the time to wait
+        as told by the Retry-After header.
+        
+        @param message: The message of the exception.
+        @param structure: The JSON structure provided by the ACME server.
+        @param http: The http object that carried out the request.
+        @return: The exception to be raised.
+        """
+        self.__event("errorDone", self.__errorType(structure))
+        if isinstance(structure, dict) and structure.get("type", "").endswith(":rateLimited"):
+            return LeRateLimitException(message, structure, retryAfter(http))
+        return LeException(message, structure)
+
+    def __authzError(self, message, structure):
+        """
+        Creates the exception for a failed authorization.
+        
+        @param message: The message of the exception.
+        @param structure: The error structure of the authorization or None.
+        @return: The exception to be raised.
+        """
+        self.__event("errorDone", self.__errorType(structure))
+        return LeException(message, structure)
+
+    def __errorType(self, structure):
         """
-        Extracts the retry-after header and returns the value as int.
+        Returns the ACME error type of an error structure without namespace.
         
-        @param http The http object to extract the data from.
-        @param default The default value, if header is absent.
-        @return: Value of the retry-after header or the default value, if
-            absent.
+        @param structure: The JSON structure provided by the ACME server.
+        @return: The error type, e.g. "rateLimited" or "unknown".
         """
-        retry = http.getHeader("Retry-After")
-        if len(retry) == 0:
-            return default
-        return int(retry[0])
+        if not isinstance(structure, dict) or len(structure.get("type", "")) == 0:
+            return "unknown"
+        return structure["type"].split(":")[-1]
+
+    def __event(self, name, *args):
+        """
+        Calls the given method of all observers providing it.
+        
+        @param name: The name of the method, e.g. "certDone".
+        @param args: The arguments passed.
+        """
+        for observer in self.__observers:
+            callback = getattr(observer, name, None)
+            if callback is not None:
+                callback(*args)
 
     def __errorFromStructure(self, prefix, structure):
         """
@@ -552,6 +1621,54 @@ class LeService(object):
         if not site.hostname == base.hostname:
             raise LeException("hostname mismatch: base=%s, url=%s" % (base.hostname, site.hostname))
     
+    def __perform(self, http, operation):
+        """
+        Performs a prepared request and notifies the observers.
+        
+        @param http: The prepared HTTP provider.
+        @param operation: Name of the ACME operation the request belongs to.
+        @return: The HTTP status-code.
+        """
+        resp = http.perform()
+        self.__notify(operation, http, resp)
+        return resp
+
+    def __performAll(self, https, operation):
+        """
+        Performs several prepared requests concurrently and notifies the
+        observers for each request finished.
+        
+        @param https: List of prepared HTTP providers.
+        @param operation: Name of the ACME operation the requests belong to.
+        @return: Generator yielding pairs of provider and response code.
+        """
+        for http, resp in self.__HttpProvider.performAll(https):
+            self.__notify(operation, http, resp)
+            yield http, resp
+
+    def __notify(self, operation, http, resp):
+        """
+        Notifies all observers about a finished request.
+        
+        @param operation: Name of the ACME operation the request belongs to.
+        @param http: The HTTP provider that performed the request.
+        @param resp: The HTTP status-code.
+        """
+        tracer = tracing.getTracer()
+        if len(self.__observers) == 0 and tracer is None:
+            return
+        timings = http.getTimings()
+        for observer in self.__observers:
+            observer.requestDone(operation, http.getUrl(), resp, timings)
+        if tracer is not None:
+            attributes = {"acme.operation" : operation, "http.url" : http.getUrl(), "http.status_code" : resp or 0}
+            if self.__accountUrl is not None:
+                attributes["acme.account.url"] = self.__accountUrl
+            for phase, value in TimingCollector.breakdown(timings).items():
+                attributes["http.%s" % (phase)] = value
+            end = time()
+            tracing.record("http %s" % (operation), end - timings.get("total", 0), end, attributes, tracing.KIND_CLIENT)
+
     def __newHttp(self, url):
         """
         Creates a new instance of the HTTP provider for the given URL.
@@ -560,7 +1677,7 @@ class LeService(object):
         @return: HTTP provider to access the URL.
         """
         self.__urlOk(url)
-        return self.__HttpProvider(url)
+        return self.__HttpProvider(url, self.__httpPool)
 
     def __checkToken(self, token):
         """
@@ -573,4 +1690,3 @@ class LeService(object):
         rex = re.compile("^[a-zA-Z0-9-_]*$")
         if rex.match(token) is None:
             raise LeException("ACME service provided invalid token")
-
@@ -0,0 +1,91 @@
+# yalec - Yet Another Let's Encrypt Client
+# Copyright (C) 2016 Falk Garbsch
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+from hashlib import sha256
+
+from ratelimit import registeredDomain
+
+class AccountPool(object):
+    """
+    Pool of LeService instances, each using its own registered account and
+    therefore its own nonces and connections. Jobs are sharded across the
+    accounts by a stable hash of the registered domain, so all certificates
+    of a domain are always requested by the same account, while the
+    per-account limits of the server apply to each shard separately.
+    """
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.__accounts = []
+
+    def add(self, label, le):
+        """
+        Adds an account to the pool. The accounts are ordered by their
+        labels, so the sharding only depends on the set of labels.
+
+        @param label: A stable and unique name of the account, e.g. the
+            absolute path of its key file.
+        @param le: The LeService using the account.
+        @raise Exception: If the label is used by another account.
+        """
+        if any(x[0] == label for x in self.__accounts):
+            raise Exception("account %s added twice" % (label))
+        self.__accounts.append((label, le))
+        self.__accounts.sort(key = lambda x: x[0])
+
+    def size(self):
+        """
+        Returns the number of accounts.
+
+        @return: Number of accounts.
+        """
+        return len(self.__accounts)
+
+    def getServices(self):
+        """
+        Returns all accounts.
+
+        @return: List of pairs of label and LeService.
+        """
+        return list(self.__accounts)
+
+    def select(self, names):
+        """
+        Selects the account responsible for a certificate. The shard is
+        chosen by the registered domain of the first name.
+
+        @param names: The DNS names of the certificate.
+        @return: Pair of label and LeService.
+        """
+        digest = sha256(registeredDomain(names[0])).hexdigest()
+        return self.__accounts[int(digest[:8], 16) % len(self.__accounts)]
+
+    def updateDirectory(self):
+        """
+        Updates the directory information of all accounts.
+        """
+        for label, le in self.__accounts:
+            le.updateDirectory()
+
+    def close(self):
+        """
+        Closes the connections of all accounts.
+        """
+        for label, le in self.__accounts:
+            le.close()
@@ -0,0 +1,218 @@
+# yalec - Yet Another Let's Encrypt Client
+# Copyright (C) 2016 Falk Garbsch
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+from calendar import timegm
+from time import strptime
+
+# DER tags used within certificates and CSRs
+UTC_TIME = 0x17
+GENERALIZED_TIME = 0x18
+CONTEXT_0 = 0xa0
+CONTEXT_3 = 0xa3
+DNS_NAME = 0x82
+
+# encoded object identifiers
+OID_COMMON_NAME = "\x55\x04\x03"
+OID_SUBJECT_ALT_NAME = "\x55\x1d\x11"
+OID_EXTENSION_REQUEST = "\x2a\x86\x48\x86\xf7\x0d\x01\x09\x0e"
+
+def readElement(data, offset = 0):
+    """
+    Reads the header of the DER element starting at the given offset.
+
+    @param data: The DER encoded data.
+    @param offset: The offset of the element.
+    @return: Triple of the tag, the offset of the content and the offset
+        behind the element.
+    @raise Exception: If the data is not valid DER.
+    """
+    if offset + 2 > len(data):
+        raise Exception("truncated DER element")
+    tag = ord(data[offset])
+    length = ord(data[offset + 1])
+    start = offset + 2
+    if length & 0x80:
+        count = length & 0x7f
+        if count == 0 or start + count > len(data):
+            raise Exception("invalid DER length")
+        length = 0
+        for c in data[start:start + count]:
+            length = (length << 8) | ord(c)
+        start += count
+    end = start + length
+    if end > len(data):
+        raise Exception("truncated DER element")
+    return tag, start, end
+
+def children(data, offset = 0, end = None):
+    """
+    Lists the elements contained between the given offsets.
+
+    @param data: The DER encoded data.
+    @param offset: The offset of the first element.
+    @param end: The offset behind the last element. Defaults to the end of
+        the data.
+    @return: List of triples as returned by readElement.
+    """
+    if end is None:
+        end = len(data)
+    rc = []
+    while offset < end:
+        element = readElement(data, offset)
+        rc.append(element)
+        offset = element[2]
+    return rc
+
+def content(data, element):
+    """
+    Returns the content of an element.
+
+    @param data: The DER encoded data.
+    @param element: Triple as returned by readElement.
+    @return: The content as string.
+    """
+    return data[element[1]:element[2]]
+
+def parseTime(value, tag):
+    """
+    Converts an UTCTime or GeneralizedTime to a unix timestamp.
+
+    @param value: The encoded time, e.g. "161231120000Z".
+    @param tag: UTC_TIME or GENERALIZED_TIME.
+    @return: Seconds since epoch as integer.
+    """
+    if tag == UTC_TIME:
+        year = int(value[:2])
+        value = ("19" if year >= 50 else "20") + value
+    return timegm(strptime(value[:14], "%Y%m%d%H%M%S"))
+
+def certificateNotAfter(der):
+    """
+    Returns the end of the validity of a x509 certificate.
+
+    @param der: The certificate in DER format.
+    @return: The notAfter date as unix timestamp.
+    @raise Exception: If the certificate cannot be parsed.
+    """
+    tbs = _tbsCertificate(der)
+    validity = tbs[_tbsIndex(tbs) + 3]
+    notAfter = children(der, validity[1], validity[2])[1]
+    return parseTime(content(der, notAfter), notAfter[0])
+
+def certificateDnsNames(der):
+    """
+    Returns the DNS names of a x509 certificate. These are the dNSName
+    entries of the subjectAltName extension or the common name of the
+    subject, if there is no such extension.
+
+    @param der: The certificate in DER format.
+    @return: List of DNS names.
+    @raise Exception: If the certificate cannot be parsed.
+    """
+    tbs = _tbsCertificate(der)
+    index = _tbsIndex(tbs)
+    names = []
+    for element in tbs[index + 6:]:
+        if element[0] == CONTEXT_3:
+            extensions = readElement(der, element[1])
+            names = _altNames(der, children(der, extensions[1], extensions[2]))
+    if len(names) == 0:
+        names = _commonNames(der, tbs[index + 4])
+    return names
+
+def csrDnsNames(der):
+    """
+    Returns the DNS names requested by a CSR. These are the dNSName entries
+    of the subjectAltName extension requested or the common name of the
+    subject, if there is no such extension.
+
+    @param der: The CSR in DER format.
+    @return: List of DNS names.
+    @raise Exception: If the CSR cannot be parsed.
+    """
+    request = readElement(der)
+    info = children(der, *readElement(der, request[1])[1:])
+    names = []
+    for element in info[3:]:
+        if element[0] != CONTEXT_0:
+            continue
+        for attribute in children(der, element[1], element[2]):
+            oid, values = children(der, attribute[1], attribute[2])[:2]
+            if content(der, oid) != OID_EXTENSION_REQUEST:
+                continue
+            extensions = readElement(der, values[1])
+            names = _altNames(der, children(der, extensions[1], extensions[2]))
+    if len(names) == 0:
+        names = _commonNames(der, info[1])
+    return names
+
+def _tbsCertificate(der):
+    """
+    Returns the elements of the tbsCertificate of a certificate.
+
+    @param der: The certificate in DER format.
+    @return: List of elements as returned by children.
+    """
+    certificate = readElement(der)
+    tbs = readElement(der, certificate[1])
+    return children(der, tbs[1], tbs[2])
+
+def _tbsIndex(tbs):
+    """
+    Returns the index of the serial number within the tbsCertificate, as the
+    version field is optional.
+
+    @param tbs: The elements of the tbsCertificate.
+    @return: The index of the serial number.
+    """
+    return 1 if tbs[0][0] == CONTEXT_0 else 0
+
+def _altNames(der, extensions):
+    """
+    Extracts the dNSName entries of the subjectAltName extension.
+
+    @param der: The DER encoded data.
+    @param extensions: The elements of a list of extensions.
+    @return: List of DNS names.
+    """
+    names = []
+    for extension in extensions:
+        fields = children(der, extension[1], extension[2])
+        if content(der, fields[0]) != OID_SUBJECT_ALT_NAME:
+            continue
+        value = readElement(der, fields[-1][1])
+        for name in children(der, value[1], value[2]):
+            if name[0] == DNS_NAME:
+                names.append(content(der, name))
+    return names
+
+def _commonNames(der, subject):
+    """
+    Extracts the common names of a distinguished name.
+
+    @param der: The DER encoded data.
+    @param subject: The element of the distinguished name.
+    @return: List of common names.
+    """
+    names = []
+    for rdn in children(der, subject[1], subject[2]):
+        for attribute in children(der, rdn[1], rdn[2]):
+            oid, value = children(der, attribute[1], attribute[2])[:2]
+            if content(der, oid) == OID_COMMON_NAME:
+                names.append(content(der, value))
+    return names
@@ -19,6 +19,7 @@
 from os import makedirs, path, remove
 from config import CHALLENGE_PREFIX
 from letsencrypt import LeException
+from letsencrypt.tracing import traced
 
 import logging
 
@@ -41,6 +42,7 @@ class HttpAuthenticator(object):
         """
         pass
 
+    @traced("challenge.prepare")
     def prepare(self, userKey, challenge, keyAuthorization, config = {}):
         """
         Creates the challenge file. It will also create the necessary directory
@@ -59,9 +61,14 @@ class HttpAuthenticator(object):
             raise LeException("WEBDIR not found in config")
         self.__chllDir = path.join(config["WEBDIR"], CHALLENGE_PREFIX)
         chllFile = path.join(self.__chllDir, challenge["token"])
-        logging.info("try to create authorization file %s" % (chllFile))
+        logging.info("try to create authorization file %s", chllFile)
         if not path.exists(self.__chllDir):
-            makedirs(self.__chllDir)
+            try:
+                makedirs(self.__chllDir)
+            except OSError:
+                # created concurrently by another authenticator
+                if not path.isdir(self.__chllDir):
+                    raise
         
         fp = open(chllFile, "w")
         fp.write(keyAuthorization)
@@ -69,6 +76,7 @@ class HttpAuthenticator(object):
         
         self.__chllFile = chllFile
     
+    @traced("challenge.cleanup")
     def cleanup(self):
         """
         Deletes the challenge file.
@@ -76,3 +84,20 @@ class HttpAuthenticator(object):
         logging.info("remove authorization file")
         if self.__chllFile is not None:
             remove(self.__chllFile)
+
+    @traced("challenge.remove")
+    def remove(self, challenge, config = {}):
+        """
+        Deletes the challenge file of a challenge prepared by an earlier run
+        that has not been cleaned up, e.g. because the run has been killed.
+        
+        @param challenge: The definition of the challenge as passed to
+            prepare. This structure has to contain the "token" index.
+        @param config: The config as passed to prepare.
+        """
+        if not config.has_key("WEBDIR"):
+            raise LeException("WEBDIR not found in config")
+        chllFile = path.join(config["WEBDIR"], CHALLENGE_PREFIX, challenge["token"])
+        if path.exists(chllFile):
+            logging.info("remove orphaned authorization file %s", chllFile)
+            remove(chllFile)
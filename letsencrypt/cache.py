@@ -0,0 +1,220 @@
+# yalec - Yet Another Let's Encrypt Client
+# Copyright (C) 2016 Falk Garbsch
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+from hashlib import sha256
+from os import makedirs, path, fdopen, rename, remove
+from tempfile import mkstemp
+from time import time
+from threading import Lock
+import json
+
+import logging
+
+def readJson(filename):
+    """
+    Reads a JSON structure from a cache file.
+    
+    @param filename: The file to read.
+    @return: The structure or None, if the file is missing or broken.
+    """
+    try:
+        fp = open(filename, "r")
+    except IOError:
+        return None
+    try:
+        return json.load(fp)
+    except ValueError:
+        logging.warning("ignore broken cache file %s", filename)
+        return None
+    finally:
+        fp.close()
+
+def writeJson(filename, structure):
+    """
+    Writes a JSON structure to a cache file. The file is replaced atomically,
+    so concurrent processes never read a partially written file.
+    
+    @param filename: The file to write.
+    @param structure: The structure to be written.
+    """
+    directory = path.dirname(filename)
+    if not path.exists(directory):
+        makedirs(directory, 0700)
+    fd, tmpName = mkstemp(dir = directory)
+    try:
+        fp = fdopen(fd, "w")
+        json.dump(structure, fp)
+        fp.close()
+        rename(tmpName, filename)
+    except:
+        remove(tmpName)
+        raise
+
+class DirectoryCache(object):
+    """
+    Persistent cache of ACME directories keyed by the base url. The cache is
+    stored in a directory that can be shared between processes.
+    
+    Entries younger than the ttl are used without asking the server. Older
+    entries are revalidated using the ETag and Last-Modified headers received
+    with the directory.
+    """
+    def __init__(self, cacheDir, ttl = 3600):
+        """
+        Constructor.
+        
+        @param cacheDir: The directory to store the cache files in.
+        @param ttl: Number of seconds a directory is used without revalidation.
+        """
+        self.__cacheDir = cacheDir
+        self.__ttl = ttl
+
+    def load(self, baseUrl):
+        """
+        Returns the cache entry for the given base url.
+        
+        @param baseUrl: The base url of the ACME service.
+        @return: Dict containing "directory", "fetched", "etag" and
+            "lastModified" or None, if the directory is not cached.
+        """
+        entry = readJson(self.__filename(baseUrl))
+        if entry is None or entry.get("url") != baseUrl:
+            return None
+        return entry
+
+    def isFresh(self, entry):
+        """
+        Checks, if a cache entry can be used without revalidation.
+        
+        @param entry: The entry as returned by load.
+        @return: True, if the entry is younger than the ttl.
+        """
+        return entry["fetched"] + self.__ttl > time()
+
+    def store(self, baseUrl, directory, etag = None, lastModified = None):
+        """
+        Stores a directory received from the server.
+        
+        @param baseUrl: The base url of the ACME service.
+        @param directory: The directory structure.
+        @param etag: The ETag header of the response, if any.
+        @param lastModified: The Last-Modified header of the response, if any.
+        """
+        entry = {"url" : baseUrl, "directory" : directory, "fetched" : time(), "etag" : etag, "lastModified" : lastModified}
+        try:
+            writeJson(self.__filename(baseUrl), entry)
+        except (IOError, OSError) as e:
+            logging.warning("cannot write directory cache: %s", e)
+
+    def __filename(self, baseUrl):
+        """
+        Returns the cache file of the given base url.
+        
+        @param baseUrl: The base url of the ACME service.
+        @return: Path of the cache file.
+        """
+        return path.join(self.__cacheDir, "directory-%s.json" % (sha256(baseUrl).hexdigest()[:32]))
+
+class AuthzCache(object):
+    """
+    Persistent cache of valid authorizations keyed by the JWK thumbprint of
+    the account key, the base url of the ACME service and the identifier. The cache is stored in a directory
+    that can be shared between processes.
+    
+    Authorizations are only returned, if they stay valid for at least the
+    given margin, so a certificate can still be requested in time.
+    """
+    def __init__(self, cacheDir, margin = 86400):
+        """
+        Constructor.
+        
+        @param cacheDir: The directory to store the cache file in.
+        @param margin: Number of seconds an authorization must stay valid to
+            be used.
+        """
+        self.__filename = path.join(cacheDir, "authz.json")
+        self.__margin = margin
+        self.__lock = Lock()
+
+    def get(self, thumbprint, base, identifier):
+        """
+        Returns the location of a cached authorization.
+        
+        @param thumbprint: JWK thumbprint of the account key.
+        @param base: The base url of the ACME service.
+        @param identifier: The identifier, e.g. as created by createDnsAuth.
+        @return: The location of the authorization or None, if there is no
+            authorization valid long enough.
+        """
+        entries = readJson(self.__filename) or {}
+        entry = entries.get(self.__key(thumbprint, base, identifier))
+        if entry is None or entry["expires"] - self.__margin < time():
+            return None
+        return entry["uri"]
+
+    def put(self, thumbprint, base, identifier, uri, expires):
+        """
+        Stores a valid authorization.
+        
+        @param thumbprint: JWK thumbprint of the account key.
+        @param base: The base url of the ACME service.
+        @param identifier: The identifier the authorization is valid for.
+        @param uri: Location of the authorization.
+        @param expires: Expiry of the authorization as unix timestamp.
+        """
+        self.__update(lambda entries: entries.__setitem__(self.__key(thumbprint, base, identifier), {"uri" : uri, "expires" : expires}))
+
+    def remove(self, thumbprint, base, identifier):
+        """
+        Removes a cached authorization, e.g. if the server did not accept it.
+        
+        @param thumbprint: JWK thumbprint of the account key.
+        @param base: The base url of the ACME service.
+        @param identifier: The identifier of the authorization.
+        """
+        self.__update(lambda entries: entries.pop(self.__key(thumbprint, base, identifier), None))
+
+    def __update(self, change):
+        """
+        Applies a change to the cache file and drops expired entries. Changes
+        of threads sharing the cache are serialized.
+        
+        @param change: Function receiving the dict of entries to be changed.
+        """
+        with self.__lock:
+            entries = readJson(self.__filename) or {}
+            change(entries)
+            now = time()
+            entries = dict((k, v) for k, v in entries.items() if v["expires"] > now)
+            try:
+                writeJson(self.__filename, entries)
+            except (IOError, OSError) as e:
+                logging.warning("cannot write authorization cache: %s", e)
+
+    def __key(self, thumbprint, base, identifier):
+        """
+        Returns the key of an authorization within the cache. The base url is
+        part of the key, as an authorization of one ACME service is unknown
+        to another one, e.g. staging and production.
+        
+        @param thumbprint: JWK thumbprint of the account key.
+        @param base: The base url of the ACME service.
+        @param identifier: The identifier of the authorization.
+        @return: The key as string.
+        """
+        return "%s:%s:%s:%s" % (thumbprint, base, identifier["type"], identifier["value"])
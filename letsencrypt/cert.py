@@ -21,6 +21,8 @@ import json
 import jws
 
 import encoding
+import asn1
+import tracing
 
 from Crypto.PublicKey import RSA
 
@@ -114,6 +116,15 @@ class CertificateSigningRequest(X509Base):
         self.__data = None
         self._setBeginEnd("-----BEGIN CERTIFICATE REQUEST-----", "-----END CERTIFICATE REQUEST-----")
 
+    def getDnsNames(self):
+        """
+        Returns the DNS names requested by the CSR.
+        
+        @return: List of DNS names.
+        @raise Exception: If the CSR cannot be parsed.
+        """
+        return asn1.csrDnsNames(self.getData())
+
 class Certificate(X509Base):
     """
     Object represents a x509 certificate.
@@ -125,6 +136,24 @@ class Certificate(X509Base):
         self.__data = None
         self._setBeginEnd("-----BEGIN CERTIFICATE-----", "-----END CERTIFICATE-----")
 
+    def getNotAfter(self):
+        """
+        Returns the end of the validity of the certificate.
+        
+        @return: The notAfter date as unix timestamp.
+        @raise Exception: If the certificate cannot be parsed.
+        """
+        return asn1.certificateNotAfter(self.getData())
+
+    def getDnsNames(self):
+        """
+        Returns the DNS names the certificate is valid for.
+        
+        @return: List of DNS names.
+        @raise Exception: If the certificate cannot be parsed.
+        """
+        return asn1.certificateDnsNames(self.getData())
+
 class RsaKeyPair(object):
     """
     Object representing a RSA keypair.
@@ -134,6 +163,8 @@ class RsaKeyPair(object):
         Constructor.
         """
         self.__key = None
+        self.__jwk = None
+        self.__thumbprint = None
     
     def load(self, fp):
         """
@@ -142,17 +173,22 @@ class RsaKeyPair(object):
         @param fp: Input stream providing the key data.
         """
         self.__key = RSA.importKey(fp)
+        self.__jwk = None
+        self.__thumbprint = None
     
     def getJwk(self):
         """
-        Returns the JWK structure representing the public-key.
+        Returns the JWK structure representing the public-key. The structure
+        is computed once per key, so it must not be modified.
         
         @return: JWK structure representing the key.
         """
-        pub = self.__key.publickey()
-        e = encoding.numberToBase64(pub.e)
-        n = encoding.numberToBase64(pub.n)
-        return { 'e' : e, 'kty' : 'RSA', 'n' : n }
+        if self.__jwk is None:
+            pub = self.__key.publickey()
+            e = encoding.numberToBase64(pub.e)
+            n = encoding.numberToBase64(pub.n)
+            self.__jwk = { 'e' : e, 'kty' : 'RSA', 'n' : n }
+        return self.__jwk
 
     def getJwkThumbprint(self):
         """
@@ -160,27 +196,64 @@ class RsaKeyPair(object):
         
         @return: JWK thumbprint of the key as string.
         """
-        condensed = json.dumps(self.getJwk(), sort_keys = True, separators=(',', ':'))
-        return encoding.dataToJwsBase64(sha256(condensed).digest())
+        if self.__thumbprint is None:
+            condensed = json.dumps(self.getJwk(), sort_keys = True, separators=(',', ':'))
+            self.__thumbprint = encoding.dataToJwsBase64(sha256(condensed).digest())
+        return self.__thumbprint
 
-    def signJsonArray(self, postArr, nonce = None):
+    def signJsonArray(self, postArr, nonce = None, kid = None):
         """
         Signs the given array of post data with this key. It additionally can
         add some nonce to the jwsHeader, if nonce parameter is different from
         None.
         
         The returned value is a urlsafe base64 encoded string, containing
-        the JWK header, the content and the JWS.
+        the JWK header, the content and the JWS. If a key id is given, the
+        header names the account url instead of embedding the JWK.
         
         @param postArr: The post array to be signed.
         @param nonce: An additional nonce to be added to the JWS header.
+        @param kid: The account url used as key id. Optional.
         @return: Base64 enconded JSON including JWS.
         """
-        jwsHeader = { 'typ' : 'JWT', 'alg': 'RS256', 'jwk' : self.getJwk() }
-        if nonce is not None:
-            jwsHeader['nonce'] = nonce
-        postList = [jws.utils.encode(jwsHeader),
-                    jws.utils.encode(postArr),
-                    jws.sign(jwsHeader, postArr, self.__key)]
-        postData = "%s.%s.%s" % tuple(postList)
-        return postData
+        with tracing.span("jws.sign", {"jws.alg" : "RS256", "jws.kid" : kid is not None}):
+            jwsHeader = { 'typ' : 'JWT', 'alg': 'RS256' }
+            if kid is not None:
+                jwsHeader['kid'] = kid
+            else:
+                jwsHeader['jwk'] = self.getJwk()
+            if nonce is not None:
+                jwsHeader['nonce'] = nonce
+            postList = [jws.utils.encode(jwsHeader),
+                        jws.utils.encode(postArr),
+                        jws.sign(jwsHeader, postArr, self.__key)]
+            postData = "%s.%s.%s" % tuple(postList)
+            return postData
+
+    def signJws(self, payload, nonce, url, kid = None):
+        """
+        Signs the given payload as needed by ACME v2 (RFC 8555). The result
+        is a JWS in flattened JSON serialization.
+        
+        The protected header either contains the key id (the account url) or
+        the JWK of this key, if no key id is given.
+        
+        @param payload: The payload to be signed. None creates an empty
+            payload, as used for POST-as-GET requests.
+        @param nonce: The nonce to be added to the protected header.
+        @param url: The url the request is sent to.
+        @param kid: The account url used as key id. Optional.
+        @return: JSON string of the JWS.
+        """
+        with tracing.span("jws.sign", {"jws.alg" : "RS256", "jws.kid" : kid is not None, "http.url" : url}):
+            protected = { 'alg': 'RS256', 'nonce' : nonce, 'url' : url }
+            if kid is not None:
+                protected['kid'] = kid
+            else:
+                protected['jwk'] = self.getJwk()
+            protectedEnc = jws.utils.encode(protected)
+            payloadEnc = "" if payload is None else jws.utils.encode(payload)
+            signer = jws.algos.route('RS256')['sign']
+            signature = signer("%s.%s" % (protectedEnc, payloadEnc), self.__key)
+            return json.dumps({ 'protected' : protectedEnc, 'payload' : payloadEnc,
+                                'signature' : jws.utils.to_base64(signature) })
@@ -19,16 +19,55 @@
 from base64 import b64encode, b64decode, urlsafe_b64encode
 from textwrap import wrap
 from binascii import unhexlify
+from calendar import timegm
+from time import strptime
 
-def consoleCleanBinary(data):
+# translation table mapping all characters that should not be presented on a
+# console to dots
+CONSOLE_TABLE = "".join([chr(i) if i < 127 and i > 31 else "." for i in range(256)])
+
+# default maximum number of characters shown for wire dumps
+DUMP_LIMIT = 4096
+
+def consoleCleanBinary(data, limit = None):
     """
     Walks over the data-buffer given and writes it to a new buffer replacing
     characters that should not be presented on a console by dots.
     
     @param data: The data to be replaced.
+    @param limit: Optional maximum number of characters to be returned. Longer
+        data is cut and the total length is appended.
     @return: Console safe string.
     """
-    return ''.join([i if ord(i) < 127 and ord(i) > 31 else '.' for i in data])
+    if isinstance(data, unicode):
+        data = data.encode("utf-8")
+    if limit is not None and len(data) > limit:
+        return "%s... (%d bytes)" % (data[:limit].translate(CONSOLE_TABLE), len(data))
+    return data.translate(CONSOLE_TABLE)
+
+class ConsoleClean(object):
+    """
+    Wraps a data-buffer that is cleaned by consoleCleanBinary only when it is
+    converted to a string. Passing it as argument to the logging functions
+    defers the work until a log record is actually emitted.
+    """
+    def __init__(self, data, limit = DUMP_LIMIT):
+        """
+        Constructor.
+        
+        @param data: The data to be cleaned.
+        @param limit: Maximum number of characters to be shown.
+        """
+        self.__data = data
+        self.__limit = limit
+
+    def __str__(self):
+        """
+        Returns the cleaned data.
+        
+        @return: Console safe string.
+        """
+        return consoleCleanBinary(self.__data, self.__limit)
     
 def toPem(data):
     """
@@ -78,6 +117,16 @@ def dataToJwsBase64(data):
     """
     return urlsafe_b64encode(data).replace("=", "")
 
+def timestampFromRfc3339(value):
+    """
+    Converts a RFC 3339 date as used by the ACME protocol to a unix timestamp.
+    Fractions of seconds are ignored and the date is expected to be in UTC.
+    
+    @param value: The date string, e.g. "2016-01-01T12:00:00.123Z".
+    @return: Seconds since epoch as integer.
+    """
+    return timegm(strptime(value[:19], "%Y-%m-%dT%H:%M:%S"))
+
 def numberToBase64(number):
     """
     Converts a number to a urlsafe base64-string.
@@ -16,28 +16,287 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
 #
 
-from pycurl import Curl
+from pycurl import Curl, CurlMulti, CurlShare, E_CALL_MULTI_PERFORM
+import pycurl
 from cStringIO import StringIO
+from threading import Lock
 
 import logging
-from encoding import consoleCleanBinary
+from encoding import ConsoleClean
+
+# CURLOPT_MAXAGE_CONN of libcurl 7.65, older pycurl versions lack the name
+MAXAGE_CONN = getattr(pycurl, "MAXAGE_CONN", 288)
+
+class CurlPool(object):
+    """
+    Keeps connections alive between requests, so connections to the same
+    host can be reused instead of performing a new TCP and TLS handshake for
+    each request.
+    
+    The requests are carried out by a CurlMultiEngine owned by the pool, so
+    connections are kept in the connection cache of its multi handle, no
+    matter if a request is performed alone or concurrently with others. The
+    cache is managed by libcurl: connections unused for more than maxIdle
+    seconds are closed through MAXAGE_CONN on each handle, and at most
+    maxPerHost connections are open to a single host through
+    M_MAX_HOST_CONNECTIONS on the multi handle. Transfers beyond that limit
+    are queued until a connection becomes free, acquire never blocks. With
+    HTTP/2 multiplexing the limit counts connections, not concurrent
+    requests. Setting maxPerHost to 0 disables keep-alive through
+    FORBID_REUSE and lifts the limit.
+    
+    All handles handed out by the pool share their DNS cache, TLS sessions and
+    cookies, so even new connections skip the DNS lookup and resume the TLS
+    session. Released handles are reset and handed out again.
+    """
+    def __init__(self, maxPerHost = 4, maxIdle = 60, multiplex = False):
+        """
+        Constructor.
+        
+        @param maxPerHost: Maximum number of connections open and kept alive
+            per host. 0 disables keep-alive and the limit.
+        @param maxIdle: Number of seconds an unused connection is kept alive.
+        @param multiplex: If True, requests to the same host are multiplexed
+            on a single HTTP/2 connection.
+        """
+        self.__maxPerHost = maxPerHost
+        self.__maxIdle = maxIdle
+        self.__free = []
+        self.__lock = Lock()
+        self.__engine = CurlMultiEngine(multiplex, maxPerHost)
+        self.__share = CurlShare()
+        self.__share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_DNS)
+        self.__share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_SSL_SESSION)
+        self.__share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_COOKIE)
+
+    def acquire(self, url):
+        """
+        Returns a curl handle for requesting the given URL. A released handle
+        is reused, if available. Otherwise a new handle is created.
+        
+        @param url: The url to be requested with the handle.
+        @return: A curl handle that has been reset to the options of the pool.
+        """
+        c = None
+        with self.__lock:
+            if len(self.__free) > 0:
+                c = self.__free.pop()
+                c.reset()
+        if c is None:
+            c = Curl()
+            # reset keeps the share, attaching it again fails
+            c.setopt(c.SHARE, self.__share)
+        if self.__maxPerHost == 0:
+            c.setopt(c.FORBID_REUSE, 1)
+        else:
+            c.setopt(MAXAGE_CONN, self.__maxIdle)
+        return c
+
+    def release(self, url, c):
+        """
+        Hands a curl handle back to the pool after the request has been
+        performed. The connection used stays in the cache of the engine.
+        
+        @param url: The url that has been requested with the handle.
+        @param c: The curl handle.
+        """
+        with self.__lock:
+            self.__free.append(c)
+
+    def getEngine(self):
+        """
+        Returns the engine performing the requests of the pool.
+        
+        @return: The CurlMultiEngine.
+        """
+        return self.__engine
+
+    def close(self):
+        """
+        Closes all connections, the handles and the shared caches.
+        """
+        self.__engine.close()
+        with self.__lock:
+            for c in self.__free:
+                c.close()
+            self.__free = []
+            self.__share.close()
+
+class CurlMultiEngine(object):
+    """
+    Performs requests of HttpProviderCurl instances concurrently using a
+    CurlMulti handle.
+    
+    The engine is meant to be long-lived: connections opened by the multi
+    handle are kept in its connection cache and reused by later requests, so
+    keep-alive and HTTP/2 multiplexing work across batches. Several threads
+    may perform batches at the same time. The thread holding the lock drives
+    all transfers and hands each finished one to the batch it belongs to.
+    """
+    def __init__(self, multiplex = False, maxHostConnections = 0):
+        """
+        Constructor.
+        
+        @param multiplex: If True, requests to the same host are multiplexed
+            on a single HTTP/2 connection.
+        @param maxHostConnections: Maximum number of connections open to a
+            single host, further transfers are queued. 0 disables the limit.
+        """
+        self.__multi = CurlMulti()
+        self.__lock = Lock()
+        self.__active = {}
+        self.__finished = {}
+        if multiplex:
+            self.__multi.setopt(pycurl.M_PIPELINING, getattr(pycurl, "PIPE_MULTIPLEX", 2))
+        if maxHostConnections > 0:
+            self.__multi.setopt(pycurl.M_MAX_HOST_CONNECTIONS, maxHostConnections)
+
+    def performAll(self, https, timeout = 0.1):
+        """
+        Performs the given prepared requests and yields them as they finish.
+        
+        Requests that failed on transport level are yielded with a response
+        code of 0. The error message can be retrieved by getError of the
+        provider. Requests not finished when the generator is closed are
+        aborted.
+        
+        @param https: List of prepared HttpProviderCurl instances.
+        @param timeout: Maximum number of seconds to wait for socket activity
+            in a single iteration. Other threads wait up to this time to
+            submit their requests.
+        @return: Generator yielding pairs of provider and response code.
+        """
+        handles = dict((http, http.getHandle()) for http in https)
+        waiting = set(https)
+        with self.__lock:
+            for http, c in handles.items():
+                self.__active[c] = http
+                self.__multi.add_handle(c)
+        try:
+            while len(waiting) > 0:
+                done = []
+                with self.__lock:
+                    self.__drive()
+                    for http in list(waiting):
+                        if http in self.__finished:
+                            done.append((http, self.__finished.pop(http)))
+                            waiting.discard(http)
+                    if len(done) == 0:
+                        self.__multi.select(timeout)
+                for rc in done:
+                    yield rc
+        finally:
+            with self.__lock:
+                for http in waiting:
+                    c = handles[http]
+                    if self.__active.pop(c, None) is not None:
+                        self.__multi.remove_handle(c)
+                        http.complete("aborted")
+                    self.__finished.pop(http, None)
+
+    def close(self):
+        """
+        Aborts all pending requests and frees the multi handle including the
+        connections kept alive.
+        """
+        with self.__lock:
+            for c, http in self.__active.items():
+                self.__multi.remove_handle(c)
+                http.complete("aborted")
+            self.__active = {}
+            self.__finished = {}
+            self.__multi.close()
+
+    def __drive(self):
+        """
+        Carries out the transfers as far as possible without blocking and
+        finishes the completed ones. The lock must be held by the caller.
+        """
+        m = self.__multi
+        ret = E_CALL_MULTI_PERFORM
+        while ret == E_CALL_MULTI_PERFORM:
+            ret, num = m.perform()
+        queued = 1
+        while queued > 0:
+            queued, ok, failed = m.info_read()
+            for c in ok:
+                self.__finish(c, None)
+            for c, errno, errmsg in failed:
+                self.__finish(c, errmsg)
+
+    def __finish(self, c, error):
+        """
+        Finishes a single request. The lock must be held by the caller.
+        
+        @param c: The curl handle of the request.
+        @param error: Error message on transport errors, else None.
+        """
+        self.__multi.remove_handle(c)
+        http = self.__active.pop(c)
+        self.__finished[http] = http.complete(error)
 
 class HttpProviderCurl(object):
     """
     Abstracts the HTTP interface to allow replacing the library used for
     connecting by something differend from pycurl.
     """
-    def __init__(self, url):
+    # HTTP version requested from libcurl, None for the libcurl default
+    HTTP_VERSION = None
+    # multiplex concurrent requests on a single connection
+    MULTIPLEX = False
+
+    def __init__(self, url, pool = None):
         """
         Constructs a new class.
         
         @param url: The url to access by the HttpProvider.
+        @param pool: Optional connection pool as created by createPool. If
+            omitted, a new connection is opened for each request.
         """
-        logging.debug("create HttpProviderCurl for %s" % (url))
+        logging.debug("create HttpProviderCurl for %s", url)
         self.__url = url
+        self.__pool = pool
+        self.__curl = None
         self.__response = 0
+        self.__error = None
+        self.__timings = {}
         self.__header = []
         self.__data = StringIO()
+
+    @classmethod
+    def createPool(cls):
+        """
+        Creates a connection pool that can be shared by all providers created
+        for a service.
+        
+        @return: A new connection pool.
+        """
+        return CurlPool(multiplex = cls.MULTIPLEX)
+
+    @classmethod
+    def performAll(cls, https):
+        """
+        Performs all given requests concurrently and yields them as they
+        finish. The requests are carried out by the engine of their pool, so
+        connections are reused across calls. All requests must use the same
+        pool.
+        
+        @param https: List of prepared HttpProviderCurl instances.
+        @return: Generator yielding pairs of provider and response code.
+        """
+        if len(https) == 0:
+            return
+        pool = https[0].__pool
+        if pool is not None:
+            for rc in pool.getEngine().performAll(https):
+                yield rc
+            return
+        engine = CurlMultiEngine(cls.MULTIPLEX)
+        try:
+            for rc in engine.performAll(https):
+                yield rc
+        finally:
+            engine.close()
     
     def prepareGet(self, moreHeader = []):
         """
@@ -51,23 +310,43 @@ class HttpProviderCurl(object):
         logging.debug("prepare GET")
         self.__data = StringIO()
         self.__response = 0
+        self.__error = None
+        self.__timings = {}
         self.__header = []
-        c = Curl()
+        self.__release()
+        c = Curl() if self.__pool is None else self.__pool.acquire(self.__url)
         c.setopt(c.CONNECTTIMEOUT, 10)
         c.setopt(c.TIMEOUT, 10)
         c.setopt(c.URL, self.__url)
         c.setopt(c.HTTPHEADER, moreHeader)
         c.setopt(c.WRITEDATA, self.__data)
         c.setopt(c.HEADERFUNCTION, self.__writeHeader)
+        if self.HTTP_VERSION is not None:
+            c.setopt(c.HTTP_VERSION, self.HTTP_VERSION)
+        if self.MULTIPLEX and hasattr(pycurl, "PIPEWAIT"):
+            c.setopt(pycurl.PIPEWAIT, 1)
         self.__curl = c
         return True
 
-    def preparePost(self, postData, moreHeader = []):
+    def prepareHead(self, moreHeader = []):
+        """
+        Prepares a HTTP HEAD request for the URL provided during
+        initialization. Only the headers of the response are received.
+        
+        @param moreHeader: An optional list of headers to be appended to the
+            HTTP requests headers.
+        """
+        self.prepareGet(moreHeader)
+        c = self.__curl
+        c.setopt(c.NOBODY, 1)
+        return True
+
+    def preparePost(self, postData, moreHeader = [], contentType = "application/json"):
         """
         Creates a HTTP POST request for the URL provided during initialization.
         
-        This method sets the Content-Type to "application/json", so this should
-        only be used when posting JSON data.
+        This method sets the Content-Type to "application/json" by default, so
+        this should only be used when posting JSON data.
         
         @param postData: The data to be delivered via POST request encoded as
           string.
@@ -75,13 +354,14 @@ class HttpProviderCurl(object):
             HTTP requests headers. This list must contain string values of the
             form <param>: <value> as they are directly injected into the HTTP
             header.
+        @param contentType: The Content-Type of the data. Optional.
         """
-        self.prepareGet(['Content-Type: application/json', 'Accept: application/json'] + moreHeader)
+        self.prepareGet(['Content-Type: %s' % (contentType), 'Accept: application/json'] + moreHeader)
         logging.debug("switch to POST")
         c = self.__curl
         c.setopt(c.POST, 1)
         c.setopt(c.POSTFIELDS, postData)
-        logging.debug("postData: %s" % (postData))
+        logging.debug("postData: %s", ConsoleClean(postData))
         return True
 
     def perform(self):
@@ -92,20 +372,99 @@ class HttpProviderCurl(object):
         preparePost before.
         
         This method will block until the request has finished and will fill the
-        response, header and data-fields.
+        response, header and data-fields. Requests using a pool are carried
+        out by its engine, so they share the connections of all requests.
         
         @return The HTTP-response code as integer.
+        @raise pycurl.error: If the request failed on transport level.
         """       
+        if self.__pool is not None:
+            for http, resp in self.__pool.getEngine().performAll([self]):
+                pass
+            if self.__error is not None:
+                raise pycurl.error(self.__error)
+            return self.__response
+        try:
+            self.__curl.perform()
+        except:
+            self.__release()
+            raise
+        return self.complete()
+
+    def complete(self, error = None):
+        """
+        Finishes a request that has been carried out on the curl handle. This
+        is called by perform and by a CurlMultiEngine performing the request.
+        
+        @param error: Error message, if the transfer failed.
+        @return The HTTP-response code as integer or 0 on transport errors.
+        """
+        if error is not None:
+            self.__release()
+            self.__error = error
+            self.__response = 0
+            logging.warning("%s: %s", error, self.__url)
+            return self.__response
         c = self.__curl
-        c.perform()
+        try:
+            resp = c.getinfo(c.RESPONSE_CODE)
+            self.__timings = {"dns" : c.getinfo(c.NAMELOOKUP_TIME),
+                              "connect" : c.getinfo(c.CONNECT_TIME),
+                              "tls" : c.getinfo(c.APPCONNECT_TIME),
+                              "ttfb" : c.getinfo(c.STARTTRANSFER_TIME),
+                              "total" : c.getinfo(c.TOTAL_TIME),
+                              "uploaded" : int(c.getinfo(c.SIZE_UPLOAD)),
+                              "downloaded" : int(c.getinfo(c.SIZE_DOWNLOAD))}
+        finally:
+            self.__release()
         self.__data.reset()
-        resp = c.getinfo(c.RESPONSE_CODE)
         self.__response = int(resp)
-        logging.info("%s: %s" % (resp, self.__url))
-        cleanData = consoleCleanBinary(self.__data.getvalue())
-        logging.debug("data: %s" % (cleanData))
+        logging.info("%s: %s", resp, self.__url)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("data: %s", ConsoleClean(self.__data.getvalue()))
         return self.__response
 
+    def getHandle(self):
+        """
+        Returns the curl handle of the prepared request. This allows to carry
+        out the request by a CurlMultiEngine.
+        
+        @return: The curl handle.
+        """
+        return self.__curl
+
+    def getUrl(self):
+        """
+        Returns the url accessed by the provider.
+        
+        @return: The url.
+        """
+        return self.__url
+
+    def getTimings(self):
+        """
+        Returns the timing information of the request performed.
+        
+        The dict contains the points in time in seconds, measured from the
+        start of the request, when the name lookup ("dns"), the TCP connect
+        ("connect") and the TLS handshake ("tls") were done, the first byte
+        has been received ("ttfb") and the request has finished ("total").
+        The number of bytes sent and received are found as "uploaded" and
+        "downloaded". The values of reused connections are 0 for the setup
+        steps.
+        
+        @return: Dict of timing values. Empty, if the request did not finish.
+        """
+        return dict(self.__timings)
+
+    def getError(self):
+        """
+        Returns the error message of a failed transfer.
+        
+        @return: The error message or None, if the transfer did not fail.
+        """
+        return self.__error
+
     def getHeader(self, key):
         """
         Returns all headers with the given name. This function will only return
@@ -121,6 +480,16 @@ class HttpProviderCurl(object):
                 rc.append(v)
         return rc
 
+    def getHeaders(self):
+        """
+        Returns all headers received as list of pairs of name and value. This
+        function will only return sane information after the query has been
+        performed.
+        
+        @return List of header fields.
+        """
+        return list(self.__header)
+
     def getContentType(self):
         """
         Returns the Content-Type after the request has been performed.
@@ -145,18 +514,40 @@ class HttpProviderCurl(object):
         """
         return self.__data
 
+    def __release(self):
+        """
+        Hands the current curl handle back to the connection pool, if any.
+        """
+        if self.__curl is None:
+            return
+        if self.__pool is not None:
+            self.__pool.release(self.__url, self.__curl)
+        self.__curl = None
+
     def __writeHeader(self, data):
         """
         Internally stores a line of header data to the header-buffer.
         
         @param data The line of header to be saved.
         """
-        if data.startswith("HTTP/1"):
-            logging.debug(data.strip())
-            data = "Response: %s" % (data)
         data = data.strip()
+        if data.startswith("HTTP/"):
+            logging.debug("%s", data)
+            data = "Response: " + data
         hdr = data.split(": ", 2)
         if not len(hdr) == 2:
             return
         self.__header.append((hdr[0], hdr[1]))
-        logging.debug("Header: %s=%s" % (hdr[0], hdr[1]))
+        logging.debug("Header: %s=%s", hdr[0], hdr[1])
+
+class HttpProviderCurl2(HttpProviderCurl):
+    """
+    HTTP provider negotiating HTTP/2 with the server. Requests performed
+    concurrently by performAll share a single multiplexed connection per host
+    instead of opening a socket each.
+    
+    This needs libcurl to be built with HTTP/2 support. If the server does not
+    support HTTP/2, HTTP/1.1 is used.
+    """
+    HTTP_VERSION = getattr(pycurl, "CURL_HTTP_VERSION_2TLS", getattr(pycurl, "CURL_HTTP_VERSION_2_0", None))
+    MULTIPLEX = True
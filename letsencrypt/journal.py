@@ -0,0 +1,174 @@
+# yalec - Yet Another Let's Encrypt Client
+# Copyright (C) 2016 Falk Garbsch
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+from hashlib import sha256
+from os import makedirs, path, remove, fsync, open as osOpen, close as osClose, O_RDONLY
+from time import time
+import json
+
+import logging
+
+def journalFile(directory, csr):
+    """
+    Returns the journal file of the issuance of a CSR. Each CSR gets its own
+    journal, so a run interrupted resumes with the next run for the same CSR.
+
+    @param directory: The directory keeping the journals.
+    @param csr: The CSR to be signed.
+    @return: Path of the journal file.
+    """
+    return path.join(directory, "%s.journal" % (sha256(csr.getJwsFormat()).hexdigest()[:32]))
+
+class IssuanceJournal(object):
+    """
+    Write-ahead journal of the steps of a single issuance. Each step is
+    appended as a line of JSON and forced to disk before the issuance goes
+    on, so a run killed at any point leaves a journal naming the
+    authorizations, challenges, orders and certificates created so far.
+
+    The steps recorded by the LeService are:
+        - begin: the account and identifiers of the issuance
+        - authz: an authorization has been created
+        - order: an ACME v2 order has been created
+        - challenge-prepared: a challenge file or similar has been set up
+        - challenge-triggered: the server has been told to validate
+        - challenge-cleaned: the challenge has been cleaned up
+        - authz-valid: an authorization has become valid
+        - cert-requested: the CSR has been sent
+        - cert: the location of the certificate issued
+
+    A journal is used by a single issuance at a time and is removed, once the
+    certificate has been stored.
+    """
+    def __init__(self, filename):
+        """
+        Constructor. Records of an earlier run are loaded.
+
+        @param filename: The journal file. It is created, if missing.
+        """
+        self.__filename = filename
+        self.__records = []
+        self.__fp = None
+        self.__torn = False
+        if path.exists(filename):
+            fp = open(filename, "r")
+            try:
+                for line in fp:
+                    self.__torn = not line.endswith("\n")
+                    try:
+                        self.__records.append(json.loads(line))
+                    except ValueError:
+                        # torn write of the last record
+                        logging.warning("ignore broken record in journal %s", filename)
+            finally:
+                fp.close()
+            if len(self.__records) > 0:
+                logging.info("resume issuance from journal %s", filename)
+
+    def record(self, step, **data):
+        """
+        Appends a step to the journal. The method returns after the record
+        has been written to disk.
+
+        @param step: The name of the step.
+        @param data: The data of the step.
+        """
+        entry = dict(data)
+        entry["step"] = step
+        entry["time"] = time()
+        fp = self.__open()
+        if self.__torn:
+            # terminate the torn record, so it does not swallow this one
+            fp.write("\n")
+            self.__torn = False
+        fp.write(json.dumps(entry) + "\n")
+        fp.flush()
+        fsync(fp.fileno())
+        self.__records.append(entry)
+
+    def find(self, step, **match):
+        """
+        Returns the latest record of a step matching the given data.
+
+        @param step: The name of the step.
+        @param match: Values the record must contain.
+        @return: Dict of the record or None, if there is no such record.
+        """
+        for entry in reversed(self.__records):
+            if entry["step"] == step and all(entry.get(k) == v for k, v in match.items()):
+                return entry
+        return None
+
+    def orphanedChallenges(self):
+        """
+        Returns the challenges prepared but never cleaned up, e.g. because
+        the run has been killed while the server validated them.
+
+        @return: List of records of the step challenge-prepared.
+        """
+        cleaned = set([x["token"] for x in self.__records if x["step"] == "challenge-cleaned"])
+        return [x for x in self.__records if x["step"] == "challenge-prepared" and x["token"] not in cleaned]
+
+    def reset(self):
+        """
+        Discards all records, e.g. if they belong to another issuance.
+        """
+        self.close()
+        self.__records = []
+        self.__torn = False
+        fp = open(self.__filename, "w")
+        fsync(fp.fileno())
+        fp.close()
+
+    def remove(self):
+        """
+        Removes the journal after the issuance has been finished.
+        """
+        self.close()
+        self.__records = []
+        if path.exists(self.__filename):
+            remove(self.__filename)
+
+    def close(self):
+        """
+        Closes the journal file.
+        """
+        if self.__fp is not None:
+            self.__fp.close()
+            self.__fp = None
+
+    def __open(self):
+        """
+        Opens the journal file for appending. If the file is created, the
+        directory entry is forced to disk, too.
+
+        @return: The file object.
+        """
+        if self.__fp is None:
+            directory = path.dirname(self.__filename)
+            if len(directory) > 0 and not path.exists(directory):
+                makedirs(directory, 0700)
+            created = not path.exists(self.__filename)
+            self.__fp = open(self.__filename, "a")
+            if created and len(directory) > 0:
+                fd = osOpen(directory, O_RDONLY)
+                try:
+                    fsync(fd)
+                finally:
+                    osClose(fd)
+        return self.__fp
@@ -0,0 +1,380 @@
+# yalec - Yet Another Let's Encrypt Client
+# Copyright (C) 2016 Falk Garbsch
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from os import makedirs, path, fdopen, chmod, rename, remove
+from tempfile import mkstemp
+from threading import Lock, Thread
+
+import logging
+from timing import TimingCollector
+
+# upper bounds of the latency buckets in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# upper bounds of the buckets counting polls
+POLL_BUCKETS = (1, 2, 3, 5, 10, 20, 50)
+
+def _escape(value):
+    """
+    Escapes a label value for the Prometheus text format.
+
+    @param value: The label value.
+    @return: The escaped value.
+    """
+    return unicode(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _number(value):
+    """
+    Formats a sample value for the Prometheus text format.
+
+    @param value: The value.
+    @return: The formatted value.
+    """
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+class Counter(object):
+    """
+    A counter of events, optionally split by labels.
+    """
+    TYPE = "counter"
+
+    def __init__(self, name, help, labelNames = ()):
+        """
+        Constructor.
+
+        @param name: The metric name.
+        @param help: The help text of the metric.
+        @param labelNames: Tuple of the label names.
+        """
+        self.name = name
+        self.help = help
+        self.labelNames = labelNames
+        self.__values = {}
+        self.__lock = Lock()
+
+    def inc(self, labels = (), amount = 1):
+        """
+        Increases the counter.
+
+        @param labels: Tuple of the label values in the order of the label
+            names.
+        @param amount: The amount to add.
+        """
+        with self.__lock:
+            self.__values[labels] = self.__values.get(labels, 0) + amount
+
+    def get(self, labels = ()):
+        """
+        Returns the value of the counter.
+
+        @param labels: Tuple of the label values.
+        @return: The value.
+        """
+        with self.__lock:
+            return self.__values.get(labels, 0)
+
+    def samples(self):
+        """
+        Returns the samples of the counter.
+
+        @return: List of triples of name suffix, dict of labels and value.
+        """
+        with self.__lock:
+            return [("", dict(zip(self.labelNames, k)), v) for k, v in sorted(self.__values.items())]
+
+class Histogram(object):
+    """
+    A histogram of observed values like latencies, optionally split by
+    labels. The buckets are cumulative as defined by Prometheus.
+    """
+    TYPE = "histogram"
+
+    def __init__(self, name, help, labelNames = (), buckets = LATENCY_BUCKETS):
+        """
+        Constructor.
+
+        @param name: The metric name.
+        @param help: The help text of the metric.
+        @param labelNames: Tuple of the label names.
+        @param buckets: Sorted upper bounds of the buckets.
+        """
+        self.name = name
+        self.help = help
+        self.labelNames = labelNames
+        self.buckets = buckets
+        self.__values = {}
+        self.__lock = Lock()
+
+    def observe(self, value, labels = ()):
+        """
+        Records an observed value.
+
+        @param value: The value.
+        @param labels: Tuple of the label values in the order of the label
+            names.
+        """
+        with self.__lock:
+            entry = self.__values.get(labels)
+            if entry is None:
+                entry = {"buckets" : [0] * len(self.buckets), "sum" : 0.0, "count" : 0}
+                self.__values[labels] = entry
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry["buckets"][i] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def samples(self):
+        """
+        Returns the samples of the histogram.
+
+        @return: List of triples of name suffix, dict of labels and value.
+        """
+        rc = []
+        with self.__lock:
+            for key, entry in sorted(self.__values.items()):
+                labels = dict(zip(self.labelNames, key))
+                for bound, count in zip(self.buckets, entry["buckets"]):
+                    rc.append(("_bucket", dict(labels, le = "%g" % (bound)), count))
+                rc.append(("_bucket", dict(labels, le = "+Inf"), entry["count"]))
+                rc.append(("_sum", labels, entry["sum"]))
+                rc.append(("_count", labels, entry["count"]))
+        return rc
+
+class Registry(object):
+    """
+    Set of metrics rendered together.
+    """
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.__metrics = []
+
+    def counter(self, name, help, labelNames = ()):
+        """
+        Creates and registers a Counter.
+
+        @return: The Counter.
+        """
+        return self.__add(Counter(name, help, labelNames))
+
+    def histogram(self, name, help, labelNames = (), buckets = LATENCY_BUCKETS):
+        """
+        Creates and registers a Histogram.
+
+        @return: The Histogram.
+        """
+        return self.__add(Histogram(name, help, labelNames, buckets))
+
+    def render(self):
+        """
+        Renders all metrics in the Prometheus text format.
+
+        @return: The text.
+        """
+        lines = []
+        for metric in self.__metrics:
+            lines.append("# HELP %s %s" % (metric.name, metric.help))
+            lines.append("# TYPE %s %s" % (metric.name, metric.TYPE))
+            for suffix, labels, value in metric.samples():
+                text = ",".join(["%s=\"%s\"" % (k, _escape(v)) for k, v in sorted(labels.items())])
+                if len(text) > 0:
+                    text = "{%s}" % (text)
+                lines.append("%s%s%s %s" % (metric.name, suffix, text, _number(value)))
+        return "\n".join(lines) + "\n"
+
+    def __add(self, metric):
+        """
+        Registers a metric.
+
+        @param metric: The metric.
+        @return: The metric.
+        """
+        self.__metrics.append(metric)
+        return metric
+
+class MetricsCollector(object):
+    """
+    Observer for the LeService maintaining the metrics of all requests,
+    signatures, nonces, authorizations, certificates and errors. A single
+    collector may observe several services.
+    """
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.registry = Registry()
+        self.requests = self.registry.counter("yalec_requests_total", "ACME requests by operation and HTTP status",
+                                              ("operation", "status"))
+        self.latency = self.registry.histogram("yalec_request_duration_seconds", "Duration of ACME requests",
+                                               ("operation",))
+        self.signatures = self.registry.counter("yalec_signatures_total", "JWS signatures computed")
+        self.nonces = self.registry.counter("yalec_nonces_total", "Nonces used, wasted if rejected by the server",
+                                            ("result",))
+        self.polls = self.registry.histogram("yalec_authz_polls", "Polls per authorization", ("status",), POLL_BUCKETS)
+        self.authzTime = self.registry.histogram("yalec_authz_duration_seconds",
+                                                 "Time from triggering the challenges until the authorization is done",
+                                                 ("status",))
+        self.certTime = self.registry.histogram("yalec_certificate_duration_seconds",
+                                                "Time from sending the CSR until the certificate is received")
+        self.errors = self.registry.counter("yalec_errors_total", "Failed ACME operations by error type", ("type",))
+
+    def requestDone(self, operation, url, status, timings):
+        """
+        Records a finished request.
+
+        @param operation: Name of the ACME operation.
+        @param url: The url requested.
+        @param status: The HTTP status-code.
+        @param timings: Dict of timings as returned by the HTTP provider.
+        """
+        self.requests.inc((operation, str(status)))
+        phases = TimingCollector.breakdown(timings)
+        if phases.has_key("total"):
+            self.latency.observe(phases["total"], (operation,))
+
+    def signatureDone(self):
+        """
+        Records a signature computed.
+        """
+        self.signatures.inc()
+
+    def nonceDone(self, wasted):
+        """
+        Records a nonce used.
+
+        @param wasted: True, if the server rejected the nonce.
+        """
+        self.nonces.inc(("wasted" if wasted else "used",))
+
+    def authzDone(self, status, polls, seconds):
+        """
+        Records an authorization polled until done.
+
+        @param status: The final status of the authorization.
+        @param polls: Number of polls.
+        @param seconds: Seconds since the challenges have been triggered.
+        """
+        self.polls.observe(polls, (status,))
+        self.authzTime.observe(seconds, (status,))
+
+    def certDone(self, seconds):
+        """
+        Records a certificate received.
+
+        @param seconds: Seconds since the CSR has been sent.
+        """
+        self.certTime.observe(seconds)
+
+    def errorDone(self, errorType):
+        """
+        Records a failed operation.
+
+        @param errorType: The ACME error type without namespace.
+        """
+        self.errors.inc((errorType,))
+
+    def render(self):
+        """
+        Renders all metrics in the Prometheus text format.
+
+        @return: The text.
+        """
+        return self.registry.render()
+
+def writeTextfile(filename, text):
+    """
+    Writes metrics for the textfile collector of the node exporter. The file
+    is replaced atomically, so the exporter never reads a partial file.
+
+    @param filename: The file to write, it must end with .prom.
+    @param text: The metrics in the Prometheus text format.
+    """
+    directory = path.dirname(filename) or "."
+    if not path.exists(directory):
+        makedirs(directory)
+    fd, tmpName = mkstemp(dir = directory, suffix = ".tmp")
+    try:
+        fp = fdopen(fd, "w")
+        fp.write(text.encode("utf-8"))
+        fp.close()
+        chmod(tmpName, 0644)
+        rename(tmpName, filename)
+    except:
+        remove(tmpName)
+        raise
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """
+    Request handler serving the metrics on /metrics.
+    """
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.collector.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug("metrics: " + format, *args)
+
+class MetricsServer(object):
+    """
+    HTTP endpoint serving the metrics of a collector to Prometheus within a
+    background thread.
+    """
+    def __init__(self, collector, port, address = "127.0.0.1"):
+        """
+        Constructor. The server starts listening immediately.
+
+        @param collector: The MetricsCollector to be served.
+        @param port: The TCP port.
+        @param address: The address to listen on. Defaults to localhost.
+        """
+        self.__server = HTTPServer((address, port), _MetricsHandler)
+        self.__server.collector = collector
+        self.__thread = Thread(target = self.__server.serve_forever)
+        self.__thread.setDaemon(True)
+
+    def start(self):
+        """
+        Starts serving requests.
+        """
+        self.__thread.start()
+
+    def getPort(self):
+        """
+        Returns the port the server listens on.
+
+        @return: The TCP port.
+        """
+        return self.__server.server_address[1]
+
+    def stop(self):
+        """
+        Stops serving requests.
+        """
+        self.__server.shutdown()
+        self.__server.server_close()
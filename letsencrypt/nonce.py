@@ -0,0 +1,114 @@
+# yalec - Yet Another Let's Encrypt Client
+# Copyright (C) 2016 Falk Garbsch
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+from collections import deque
+from threading import Lock
+
+import logging
+
+class NoncePool(object):
+    """
+    Keeps the anti-replay nonces received from the ACME server, so each signed
+    request can take its own nonce. This allows to sign and perform several
+    requests concurrently.
+    
+    If the pool runs empty, new nonces are requested by the fetch function
+    given to the constructor.
+    """
+    def __init__(self, fetch, maxSize = 32):
+        """
+        Constructor.
+        
+        @param fetch: Function receiving a number of nonces to request from the
+            server and returning a list of nonces.
+        @param maxSize: Maximum number of nonces kept from responses. Further
+            nonces are dropped, as the server may expire old nonces anyway.
+        """
+        self.__fetch = fetch
+        self.__maxSize = maxSize
+        self.__nonces = deque()
+        self.__lock = Lock()
+
+    def put(self, nonce):
+        """
+        Adds a nonce received from the server.
+        
+        @param nonce: The nonce.
+        """
+        with self.__lock:
+            if len(self.__nonces) >= self.__maxSize:
+                logging.debug("nonce pool full, drop nonce")
+                return
+            self.__nonces.append(nonce)
+
+    def get(self):
+        """
+        Takes a nonce from the pool. If the pool is empty, a new nonce is
+        fetched from the server.
+        
+        @return: The nonce or None, if the server did not provide any nonce.
+        """
+        nonces = self.take(1)
+        if len(nonces) == 0:
+            return None
+        return nonces[0]
+
+    def take(self, count):
+        """
+        Takes several nonces from the pool at once. All nonces missing in the
+        pool are fetched from the server with a single call of the fetch
+        function, so they are requested concurrently.
+        
+        @param count: The number of nonces needed.
+        @return: List of at most count nonces. It is shorter, if the server did
+            not provide enough nonces.
+        """
+        with self.__lock:
+            nonces = [self.__nonces.popleft() for I in range(min(count, len(self.__nonces)))]
+        missing = count - len(nonces)
+        if missing > 0:
+            logging.debug("fetch %d nonces", missing)
+            nonces += self.__fetch(missing)
+        for nonce in nonces[count:]:
+            self.put(nonce)
+        return nonces[:count]
+
+    def prefetch(self, count):
+        """
+        Requests nonces from the server until at least count nonces are
+        available. The nonces fetched are kept even if this exceeds the
+        maximum size of the pool, as they are requested for immediate use.
+        
+        @param count: The number of nonces needed.
+        """
+        missing = count - self.size()
+        if missing <= 0:
+            return
+        logging.debug("prefetch %d nonces", missing)
+        nonces = self.__fetch(missing)
+        with self.__lock:
+            self.__nonces.extend(nonces)
+
+    def size(self):
+        """
+        Returns the number of nonces available.
+        
+        @return: Number of nonces.
+        """
+        with self.__lock:
+            return len(self.__nonces)
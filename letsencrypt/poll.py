@@ -0,0 +1,159 @@
+# yalec - Yet Another Let's Encrypt Client
+# Copyright (C) 2016 Falk Garbsch
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+from email.utils import parsedate_tz, mktime_tz
+from heapq import heappush, heappop
+from itertools import count
+from random import uniform
+from time import time, sleep
+
+import logging
+import tracing
+
+def retryAfter(http):
+    """
+    Extracts the Retry-After header of a response. The header may either
+    contain a number of seconds or a HTTP date.
+    
+    @param http: The http object that carried out the request.
+    @return: Number of seconds to wait or None, if the header is absent or
+        cannot be parsed.
+    """
+    retry = http.getHeader("Retry-After")
+    if len(retry) == 0:
+        return None
+    value = retry[0].strip()
+    if value.isdigit():
+        return int(value)
+    date = parsedate_tz(value)
+    if date is None:
+        logging.debug("cannot parse Retry-After: %s", value)
+        return None
+    return max(0, mktime_tz(date) - time())
+
+class PollScheduler(object):
+    """
+    Schedules the polls of many pending resources on a single timer heap.
+    
+    Each poll consists of a function preparing a request and a function
+    checking the response. All polls that are due at the same time are
+    performed concurrently. Polls that are not done yet are rescheduled after
+    the time given by the Retry-After header of the response, but not before
+    the base delay. Without that header, a capped exponential backoff with
+    jitter is used. Each poll has a
+    deadline after which it is given up.
+    """
+    def __init__(self, performAll, base = 1.0, cap = 30.0):
+        """
+        Constructor.
+        
+        @param performAll: Function performing a list of prepared requests and
+            yielding pairs of provider and response code, like the performAll
+            method of the HTTP providers.
+        @param base: Delay in seconds after the first unsuccessful poll, if the
+            server did not send Retry-After. Also the minimum delay between
+            two polls.
+        @param cap: Maximum delay in seconds between two polls, if the server
+            did not send Retry-After.
+        """
+        self.__performAll = performAll
+        self.__base = base
+        self.__cap = cap
+        self.__heap = []
+        self.__sequence = count()
+
+    def add(self, prepare, check, deadline, delay = 0):
+        """
+        Adds a poll.
+        
+        @param prepare: Function returning a prepared request.
+        @param check: Function receiving the provider and the response code
+            after the request has been performed. It returns True, if the
+            resource is done and polling can be stopped.
+        @param deadline: Number of seconds from now after which the poll is
+            given up.
+        @param delay: Number of seconds before the first request.
+        """
+        now = time()
+        poll = {"prepare" : prepare, "check" : check, "deadline" : now + deadline, "attempts" : 0}
+        self.__schedule(now + delay, poll)
+
+    def pending(self):
+        """
+        Returns the number of polls not done yet.
+        
+        @return: Number of polls.
+        """
+        return len(self.__heap)
+
+    def run(self):
+        """
+        Performs all polls until they are done or their deadline passed.
+        
+        @return: Number of polls given up because of their deadline.
+        """
+        expired = 0
+        while len(self.__heap) > 0:
+            wait = self.__heap[0][0] - time()
+            if wait > 0:
+                sleep(wait)
+            now = time()
+            requests = {}
+            while len(self.__heap) > 0 and self.__heap[0][0] <= now:
+                poll = heappop(self.__heap)[2]
+                requests[poll["prepare"]()] = poll
+            with tracing.span("poll", {"poll.requests" : len(requests)}) as span:
+                done = 0
+                for http, resp in self.__performAll(requests.keys()):
+                    poll = requests[http]
+                    poll["attempts"] += 1
+                    if poll["check"](http, resp):
+                        done += 1
+                        continue
+                    now = time()
+                    if now >= poll["deadline"]:
+                        logging.warning("giving up polling %s after %d attempts", http.getUrl(), poll["attempts"])
+                        expired += 1
+                        continue
+                    self.__schedule(min(now + self.__delay(http, poll["attempts"]), poll["deadline"]), poll)
+                span.setAttribute("poll.done", done)
+        return expired
+
+    def __delay(self, http, attempts):
+        """
+        Calculates the delay before the next poll.
+        
+        @param http: The provider of the last poll.
+        @param attempts: Number of polls performed so far.
+        @return: Delay in seconds.
+        """
+        delay = retryAfter(http)
+        if delay is not None:
+            # Retry-After: 0 or a past date must not cause a busy loop
+            return max(self.__base, delay)
+        delay = min(self.__cap, self.__base * 2 ** (attempts - 1))
+        return uniform(delay / 2.0, delay)
+
+    def __schedule(self, due, poll):
+        """
+        Puts a poll on the timer heap.
+        
+        @param due: Point in time of the next request.
+        @param poll: The poll.
+        """
+        heappush(self.__heap, (due, next(self.__sequence), poll))
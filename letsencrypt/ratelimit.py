@@ -0,0 +1,428 @@
+# yalec - Yet Another Let's Encrypt Client
+# Copyright (C) 2016 Falk Garbsch
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+from contextlib import contextmanager
+from fcntl import flock, LOCK_EX, LOCK_UN
+from os import path, makedirs, stat
+from threading import Lock
+from time import time
+from uuid import uuid4
+
+import logging
+from cache import readJson, writeJson
+
+# rate limits of Let's Encrypt as pairs of the number of events allowed and
+# the length of the window in seconds
+LIMITS = {
+    "certificatesPerDomain" : (50, 7 * 86400),
+    "duplicateCertificate" : (5, 7 * 86400),
+    "failedValidation" : (5, 3600),
+    "newOrders" : (300, 3 * 3600),
+}
+
+# number of seconds to back off, if the server does not send Retry-After
+DEFAULT_BACKOFF = 3600
+
+# ACME error types of challenges that failed validation, counted by the
+# failedValidation limit
+FAILED_VALIDATION = ["caa", "connection", "dns", "incorrectResponse", "tls", "unauthorized"]
+
+def isFailedValidation(structure):
+    """
+    Checks, if an ACME error structure tells about a failed validation.
+
+    @param structure: The error structure provided by the ACME server.
+    @return: True, if the error counts for the failedValidation limit.
+    """
+    if not isinstance(structure, dict):
+        return False
+    return structure.get("type", "").split(":")[-1] in FAILED_VALIDATION
+
+def registeredDomain(name):
+    """
+    Returns the registered domain of a DNS name, the domain rate limits per
+    domain are counted for.
+
+    This naively takes the last two labels, as the public suffix list is not
+    available. For names below public suffixes like co.uk, the limits are
+    counted for the suffix, which is more conservative than the server.
+
+    @param name: The DNS name.
+    @return: The registered domain.
+    """
+    labels = name.lower().rstrip(".").split(".")
+    if labels[0] == "*":
+        labels = labels[1:]
+    return ".".join(labels[-2:])
+
+class RateLimitLedger(object):
+    """
+    Persistent ledger of the events counted by the rate limits of the ACME
+    server, like issued certificates or failed validations. The ledger also
+    keeps the times until which keys are blocked because the server rejected
+    requests. Events older than the longest window are dropped.
+
+    The file may be shared by several processes. Each update re-reads the
+    file and merges it while holding an exclusive lock on a lock file next to
+    it, so no process overwrites the events of another one. Each event is
+    stored as pair of its time and a unique id, so events recorded at the
+    same time are merged as distinct events.
+    """
+    def __init__(self, filename, maxAge = 7 * 86400):
+        """
+        Constructor.
+
+        @param filename: The file to store the ledger in. None keeps the
+            ledger in memory only.
+        @param maxAge: Number of seconds events are kept.
+        """
+        self.__filename = filename
+        self.__maxAge = maxAge
+        self.__lock = Lock()
+        self.__ledger = {"events" : {}, "blocked" : {}}
+        self.__seen = None
+
+    def record(self, kind, key, when = None):
+        """
+        Records an event.
+
+        @param kind: The rate limit the event counts for.
+        @param key: The key the event is counted for, e.g. the domain.
+        @param when: Unix timestamp of the event. Defaults to now.
+        """
+        with self.__update() as ledger:
+            ledger["events"].setdefault("%s:%s" % (kind, key), []).append([when or time(), uuid4().hex])
+
+    def events(self, kind, key, window):
+        """
+        Returns the events recorded within the given window.
+
+        @param kind: The rate limit the events count for.
+        @param key: The key the events are counted for.
+        @param window: Length of the window in seconds.
+        @return: Sorted list of unix timestamps of the events.
+        """
+        with self.__lock:
+            return self.__times(self.__load(), kind, key, time() - window)
+
+    def delay(self, keys, limits):
+        """
+        Returns the number of seconds to wait until none of the given keys
+        exceeds its rate limit.
+
+        @param keys: List of pairs of the rate limit and the key. The rate
+            limit "block" names keys blocked by the block method.
+        @param limits: Dict mapping the rate limits to pairs of the number of
+            events allowed and the length of the window in seconds.
+        @return: Number of seconds, 0 or less if no limit is exceeded.
+        """
+        with self.__lock:
+            return self.__delay(self.__load(), keys, limits)
+
+    def reserve(self, keys, limits, records):
+        """
+        Checks the rate limits like delay and records events, if no limit is
+        exceeded. Both is done while the ledger file is locked, so processes
+        sharing the ledger never exceed a limit together.
+
+        @param keys: List of pairs of the rate limit and the key to check.
+        @param limits: Dict mapping the rate limits to pairs of the number of
+            events allowed and the length of the window in seconds.
+        @param records: List of pairs of the rate limit and the key of the
+            events to be recorded.
+        @return: 0, if the events have been recorded, otherwise the number of
+            seconds to wait.
+        """
+        with self.__update() as ledger:
+            wait = self.__delay(ledger, keys, limits)
+            if wait > 0:
+                return wait
+            now = time()
+            for kind, key in records:
+                ledger["events"].setdefault("%s:%s" % (kind, key), []).append([now, uuid4().hex])
+            return 0
+
+    def block(self, key, until):
+        """
+        Blocks a key until the given time.
+
+        @param key: The key to be blocked.
+        @param until: Unix timestamp the key is blocked until.
+        """
+        with self.__update() as ledger:
+            ledger["blocked"][key] = max(until, ledger["blocked"].get(key, 0))
+
+    def blockedUntil(self, key):
+        """
+        Returns the time a key is blocked until.
+
+        @param key: The key.
+        @return: Unix timestamp or 0, if the key is not blocked.
+        """
+        with self.__lock:
+            return self.__load()["blocked"].get(key, 0)
+
+    def __delay(self, ledger, keys, limits):
+        """
+        Calculates the time to wait until none of the keys exceeds its rate
+        limit. The lock must be held by the caller.
+
+        @param ledger: The ledger.
+        @param keys: List of pairs of the rate limit and the key.
+        @param limits: Dict mapping the rate limits to pairs of the number of
+            events allowed and the length of the window in seconds.
+        @return: Number of seconds.
+        """
+        now = time()
+        notBefore = now
+        for kind, key in keys:
+            if kind == "block":
+                notBefore = max(notBefore, ledger["blocked"].get(key, 0))
+                continue
+            if kind not in limits:
+                continue
+            limit, window = limits[kind]
+            events = self.__times(ledger, kind, key, now - window)
+            if len(events) >= limit:
+                notBefore = max(notBefore, events[len(events) - limit] + window)
+        return notBefore - now
+
+    def __times(self, ledger, kind, key, since):
+        """
+        Returns the times of the events recorded after the given time. The
+        lock must be held by the caller.
+
+        @param ledger: The ledger.
+        @param kind: The rate limit the events count for.
+        @param key: The key the events are counted for.
+        @param since: Unix timestamp.
+        @return: Sorted list of unix timestamps.
+        """
+        return sorted([x[0] for x in ledger["events"].get("%s:%s" % (kind, key), []) if x[0] > since])
+
+    @contextmanager
+    def __update(self):
+        """
+        Context manager for changing the ledger. The file is locked and merged
+        before the change and written afterwards.
+
+        @return: The ledger to be changed.
+        """
+        with self.__lock:
+            if self.__filename is None:
+                yield self.__ledger
+                self.__store(self.__ledger)
+                return
+            directory = path.dirname(self.__filename)
+            if not path.exists(directory):
+                makedirs(directory, 0700)
+            fp = open(self.__filename + ".lock", "a")
+            try:
+                flock(fp, LOCK_EX)
+                ledger = self.__load(True)
+                yield ledger
+                self.__store(ledger)
+            finally:
+                flock(fp, LOCK_UN)
+                fp.close()
+
+    def __load(self, force = False):
+        """
+        Returns the ledger merged with the file, if the file changed since it
+        has been read or written last. The lock must be held by the caller.
+
+        @param force: Re-read the file even if it seems unchanged.
+        @return: Dict containing "events" and "blocked".
+        """
+        if self.__filename is None:
+            return self.__ledger
+        try:
+            # the file is replaced on each write, so a new inode tells about a
+            # change even within the resolution of the mtime
+            version = self.__version()
+        except OSError:
+            return self.__ledger
+        if not force and version == self.__seen:
+            return self.__ledger
+        self.__seen = version
+        stored = readJson(self.__filename) or {}
+        events = self.__ledger["events"]
+        for key, entries in stored.get("events", {}).items():
+            merged = dict((x[1], x[0]) for x in events.get(key, []))
+            for entry in entries:
+                if not isinstance(entry, list):
+                    # event written without id
+                    entry = [entry, repr(entry)]
+                merged[entry[1]] = entry[0]
+            events[key] = sorted([[when, eventId] for eventId, when in merged.items()])
+        blocked = self.__ledger["blocked"]
+        for key, until in stored.get("blocked", {}).items():
+            blocked[key] = max(until, blocked.get(key, 0))
+        return self.__ledger
+
+    def __version(self):
+        """
+        Returns the inode and modification time of the ledger file.
+
+        @return: Pair of inode and mtime.
+        @raise OSError: If the file does not exist.
+        """
+        info = stat(self.__filename)
+        return info.st_ino, info.st_mtime
+
+    def __store(self, ledger):
+        """
+        Drops outdated entries and writes the ledger. The lock must be held
+        by the caller.
+
+        @param ledger: The ledger.
+        """
+        now = time()
+        since = now - self.__maxAge
+        events = {}
+        for key, entries in ledger["events"].items():
+            entries = [x for x in entries if x[0] > since]
+            if len(entries) > 0:
+                events[key] = entries
+        ledger["events"] = events
+        ledger["blocked"] = dict((k, v) for k, v in ledger["blocked"].items() if v > now)
+        if self.__filename is None:
+            return
+        try:
+            writeJson(self.__filename, ledger)
+            self.__seen = self.__version()
+        except (IOError, OSError) as e:
+            logging.warning("cannot write rate limit ledger: %s", e)
+
+class RateLimitScheduler(object):
+    """
+    Decides, when issuance jobs may run without exceeding the rate limits of
+    the ACME server. Each job is described by the DNS names of the
+    certificate and the account requesting it.
+
+    The consumption of each limit is tracked within a RateLimitLedger. Jobs
+    that would exceed a limit are deferred until enough events left the
+    window. If the server still rejects a request, the keys concerned are
+    blocked for the time told by the server.
+    """
+    def __init__(self, ledger, limits = LIMITS):
+        """
+        Constructor.
+
+        @param ledger: The RateLimitLedger to be used.
+        @param limits: Dict mapping the rate limits to pairs of the number of
+            events allowed and the length of the window in seconds.
+        """
+        self.__ledger = ledger
+        self.__limits = limits
+
+    def delay(self, names, account):
+        """
+        Returns the number of seconds a job must wait to stay within the rate
+        limits.
+
+        @param names: The DNS names of the certificate.
+        @param account: The account requesting the certificate.
+        @return: Number of seconds, 0 if the job may run now.
+        """
+        return max(0, self.__ledger.delay(self.__keys(names, account), self.__limits))
+
+    def acquire(self, names, account):
+        """
+        Checks, if a job may run now and records its new order, if so.
+        Checking and recording is atomic, so concurrent workers and processes
+        sharing the ledger never exceed a limit together. The certificate is
+        counted by issued, once it has been received.
+
+        @param names: The DNS names of the certificate.
+        @param account: The account requesting the certificate.
+        @return: 0, if the job may run now, otherwise the number of seconds
+            to wait.
+        """
+        return self.__ledger.reserve(self.__keys(names, account), self.__limits, [("newOrders", account)])
+
+    def issued(self, names, account):
+        """
+        Records a certificate issued for the given names.
+
+        @param names: The DNS names of the certificate.
+        @param account: The account requesting the certificate.
+        """
+        for kind, key in self.__issuanceKeys(names):
+            self.__ledger.record(kind, key)
+
+    def failed(self, names, account):
+        """
+        Records a failed validation of the given names.
+
+        @param names: The DNS names of the certificate.
+        @param account: The account requesting the certificate.
+        """
+        for name in set(names):
+            self.__ledger.record("failedValidation", "%s:%s" % (account, name))
+
+    def backoff(self, names, account, retryAfter = None, detail = ""):
+        """
+        Blocks keys after the server rejected a request because of a rate
+        limit. If the error detail names registered domains of the job, only
+        these domains are blocked. Otherwise the limit is taken to concern the
+        whole account.
+
+        @param names: The DNS names of the certificate.
+        @param account: The account requesting the certificate.
+        @param retryAfter: Number of seconds to wait as told by the server or
+            None to use DEFAULT_BACKOFF.
+        @param detail: The error detail sent by the server. Optional.
+        @return: Unix timestamp the job may be retried.
+        """
+        if retryAfter is None:
+            retryAfter = DEFAULT_BACKOFF
+        until = time() + retryAfter
+        domains = [x for x in set([registeredDomain(x) for x in names]) if x in detail]
+        keys = ["domain:%s" % (x) for x in domains] or ["account:%s" % (account)]
+        logging.info("rate limited, block %s for %d seconds", ", ".join(keys), retryAfter)
+        for key in keys:
+            self.__ledger.block(key, until)
+        return until
+
+    def __keys(self, names, account):
+        """
+        Returns the keys of all rate limits and blocks a job is checked for.
+
+        @param names: The DNS names of the certificate.
+        @param account: The account requesting the certificate.
+        @return: List of pairs of the rate limit and the key.
+        """
+        domains = set([registeredDomain(x) for x in names])
+        keys = self.__issuanceKeys(names)
+        keys.append(("newOrders", account))
+        keys += [("failedValidation", "%s:%s" % (account, x)) for x in set(names)]
+        keys += [("block", "domain:%s" % (x)) for x in domains]
+        keys.append(("block", "account:%s" % (account)))
+        return keys
+
+    def __issuanceKeys(self, names):
+        """
+        Returns the keys of the rate limits counting issued certificates.
+
+        @param names: The DNS names of the certificate.
+        @return: List of pairs of the rate limit and the key.
+        """
+        keys = [("certificatesPerDomain", x) for x in set([registeredDomain(x) for x in names])]
+        keys.append(("duplicateCertificate", ",".join(sorted(set([x.lower() for x in names])))))
+        return keys
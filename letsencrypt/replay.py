@@ -0,0 +1,351 @@
+# yalec - Yet Another Let's Encrypt Client
+# Copyright (C) 2016 Falk Garbsch
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+from cStringIO import StringIO
+from base64 import b64encode, b64decode
+from collections import deque
+from threading import Lock
+from time import time, sleep
+import json
+
+import logging
+from http import HttpProviderCurl
+from letsencrypt import LeException
+
+class Cassette(object):
+    """
+    A file containing recorded HTTP exchanges. Each line of the file holds one
+    exchange encoded as JSON.
+    
+    During replay, exchanges are handed out per method and URL in the order
+    they have been recorded. The request body is not compared, as it contains
+    signatures and nonces that differ between runs.
+    """
+    def __init__(self, filename):
+        """
+        Constructor.
+        
+        @param filename: The file to record to or to replay from.
+        """
+        self.__filename = filename
+        self.__lock = Lock()
+        self.__entries = None
+
+    def record(self, entry):
+        """
+        Appends an exchange to the cassette file.
+        
+        @param entry: Dict describing the exchange.
+        """
+        line = json.dumps(entry, sort_keys = True)
+        with self.__lock:
+            fp = open(self.__filename, "a")
+            fp.write(line + "\n")
+            fp.close()
+
+    def next(self, method, url):
+        """
+        Returns the next recorded exchange for the given request.
+        
+        @param method: The HTTP method of the request.
+        @param url: The requested url.
+        @return: Dict describing the exchange.
+        @raise LeException: If no exchange is left for the request.
+        """
+        with self.__lock:
+            if self.__entries is None:
+                self.__load()
+            queue = self.__entries.get((method, url))
+            if not queue:
+                raise LeException("no recorded response for %s %s" % (method, url))
+            return queue.popleft()
+
+    def rewind(self):
+        """
+        Restarts the replay from the beginning of the cassette.
+        """
+        with self.__lock:
+            self.__entries = None
+
+    def __load(self):
+        """
+        Reads all exchanges of the cassette file. The lock must be held by the
+        caller.
+        """
+        self.__entries = {}
+        fp = open(self.__filename, "r")
+        for line in fp:
+            if len(line.strip()) == 0:
+                continue
+            entry = json.loads(line)
+            self.__entries.setdefault((entry["method"], entry["url"]), deque()).append(entry)
+        fp.close()
+
+class HttpProviderRecord(HttpProviderCurl):
+    """
+    HTTP provider performing real requests using pycurl and recording each
+    exchange to a cassette that can be replayed by HttpProviderReplay.
+    
+    The cassette must be set by useCassette before the first request.
+    """
+    cassette = None
+
+    def __init__(self, url, pool = None):
+        """
+        Constructs a new class.
+        
+        @param url: The url to access by the HttpProvider.
+        @param pool: Optional connection pool as created by createPool.
+        """
+        HttpProviderCurl.__init__(self, url, pool)
+        self.__url = url
+        self.__request = None
+
+    @classmethod
+    def useCassette(cls, filename):
+        """
+        Sets the file all exchanges are recorded to.
+        
+        @param filename: The cassette file.
+        """
+        cls.cassette = Cassette(filename)
+
+    def prepareGet(self, moreHeader = []):
+        """
+        Prepares a HTTP GET request. See HttpProviderCurl.prepareGet.
+        """
+        HttpProviderCurl.prepareGet(self, moreHeader)
+        self.__request = {"method" : "GET", "url" : self.__url, "headers" : list(moreHeader), "body" : None, "started" : time()}
+        return True
+
+    def prepareHead(self, moreHeader = []):
+        """
+        Prepares a HTTP HEAD request. See HttpProviderCurl.prepareHead.
+        """
+        HttpProviderCurl.prepareHead(self, moreHeader)
+        self.__request["method"] = "HEAD"
+        return True
+
+    def preparePost(self, postData, moreHeader = [], contentType = "application/json"):
+        """
+        Prepares a HTTP POST request. See HttpProviderCurl.preparePost.
+        """
+        HttpProviderCurl.preparePost(self, postData, moreHeader, contentType)
+        self.__request.update({"method" : "POST", "headers" : list(moreHeader), "body" : postData})
+        return True
+
+    def complete(self, error = None):
+        """
+        Finishes the request and records the exchange. Failed transfers are
+        not recorded.
+        """
+        resp = HttpProviderCurl.complete(self, error)
+        if error is None and self.__request is not None:
+            entry = dict(self.__request)
+            started = entry.pop("started")
+            entry["elapsed"] = self.getTimings().get("total", time() - started)
+            entry["status"] = resp
+            entry["responseHeaders"] = self.getHeaders()
+            entry["data"] = b64encode(self.getData().getvalue())
+            self.cassette.record(entry)
+        self.__request = None
+        return resp
+
+class HttpProviderReplay(object):
+    """
+    HTTP provider answering requests from a cassette recorded by
+    HttpProviderRecord without accessing the network.
+    
+    Replay-Nonce headers are rewritten to unique values, so the client never
+    sees the same nonce twice. If timing is preserved, each request takes as
+    long as it did during recording.
+    """
+    cassette = None
+    preserveTiming = False
+    __nonceLock = Lock()
+    __nonceCounter = 0
+
+    def __init__(self, url, pool = None):
+        """
+        Constructs a new class.
+        
+        @param url: The url to access by the HttpProvider.
+        @param pool: Ignored, as replay does not open any connections.
+        """
+        logging.debug("create HttpProviderReplay for %s", url)
+        self.__url = url
+        self.__method = None
+        self.__elapsed = None
+        self.__response = 0
+        self.__header = []
+        self.__data = StringIO()
+
+    @classmethod
+    def useCassette(cls, filename, preserveTiming = False):
+        """
+        Sets the file exchanges are replayed from.
+        
+        @param filename: The cassette file.
+        @param preserveTiming: If True, each request is delayed by the time it
+            took during recording.
+        """
+        cls.cassette = Cassette(filename)
+        cls.preserveTiming = preserveTiming
+
+    @staticmethod
+    def createPool():
+        """
+        Replay does not need any connections.
+        
+        @return: None
+        """
+        return None
+
+    @staticmethod
+    def performAll(https):
+        """
+        Performs all given requests one after another and yields them.
+        
+        @param https: List of prepared HttpProviderReplay instances.
+        @return: Generator yielding pairs of provider and response code.
+        """
+        for http in https:
+            yield http, http.perform()
+
+    def prepareGet(self, moreHeader = []):
+        """
+        Prepares a HTTP GET request for the URL provided during initialization.
+        
+        @param moreHeader: Ignored during replay.
+        """
+        self.__method = "GET"
+        return True
+
+    def prepareHead(self, moreHeader = []):
+        """
+        Prepares a HTTP HEAD request for the URL provided during
+        initialization.
+        
+        @param moreHeader: Ignored during replay.
+        """
+        self.__method = "HEAD"
+        return True
+
+    def preparePost(self, postData, moreHeader = [], contentType = "application/json"):
+        """
+        Prepares a HTTP POST request for the URL provided during
+        initialization.
+        
+        @param postData: Ignored during replay.
+        @param moreHeader: Ignored during replay.
+        @param contentType: Ignored during replay.
+        """
+        self.__method = "POST"
+        return True
+
+    def perform(self):
+        """
+        Looks up the recorded response of the request.
+        
+        @return The HTTP-response code as integer.
+        @raise LeException: If no response has been recorded for the request.
+        """
+        entry = self.cassette.next(self.__method, self.__url)
+        if self.preserveTiming:
+            sleep(entry["elapsed"])
+        self.__header = []
+        for k, v in entry["responseHeaders"]:
+            if k.lower() == "replay-nonce":
+                v = HttpProviderReplay.__nextNonce()
+            self.__header.append((k, v))
+        self.__data = StringIO(b64decode(entry["data"]))
+        self.__elapsed = entry["elapsed"]
+        self.__response = entry["status"]
+        logging.info("%s: %s (replay)", self.__response, self.__url)
+        return self.__response
+
+    def getUrl(self):
+        """
+        Returns the url accessed by the provider.
+        
+        @return: The url.
+        """
+        return self.__url
+
+    def getTimings(self):
+        """
+        Returns the total time recorded for the request.
+        
+        @return: Dict of timing values. Empty, if the request did not finish.
+        """
+        if self.__elapsed is None:
+            return {}
+        return {"total" : self.__elapsed}
+
+    def getError(self):
+        """
+        Replayed requests never fail on transport level.
+        
+        @return: None
+        """
+        return None
+
+    def getHeader(self, key):
+        """
+        Returns all headers with the given name.
+        
+        @param key: Name of the header. The key is handled case-insensitive.
+        @return List of header fields.
+        """
+        return [v for k, v in self.__header if k.lower() == key.lower()]
+
+    def getHeaders(self):
+        """
+        Returns all headers as list of pairs of name and value.
+        
+        @return List of header fields.
+        """
+        return list(self.__header)
+
+    def getContentType(self):
+        """
+        Returns the Content-Type of the response or an empty string.
+        """
+        h = self.getHeader("Content-Type")
+        if len(h) == 0:
+            return ""
+        return h[0]
+
+    def getData(self):
+        """
+        Returns the stream object containing the recorded response data.
+        
+        @return Data received.
+        """
+        return self.__data
+
+    @staticmethod
+    def __nextNonce():
+        """
+        Creates a new unique nonce.
+        
+        @return: The nonce as string.
+        """
+        with HttpProviderReplay.__nonceLock:
+            HttpProviderReplay.__nonceCounter += 1
+            return "replay-nonce-%d" % (HttpProviderReplay.__nonceCounter)
@@ -0,0 +1,288 @@
+# yalec - Yet Another Let's Encrypt Client
+# Copyright (C) 2016 Falk Garbsch
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+from os import makedirs, path
+from threading import Lock
+from time import time
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    thumbprint TEXT NOT NULL,
+    base TEXT NOT NULL,
+    location TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (thumbprint, base)
+);
+CREATE TABLE IF NOT EXISTS authzs (
+    thumbprint TEXT NOT NULL,
+    base TEXT NOT NULL,
+    type TEXT NOT NULL,
+    value TEXT NOT NULL,
+    uri TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (thumbprint, base, type, value)
+);
+CREATE INDEX IF NOT EXISTS authzs_expires ON authzs (expires);
+CREATE TABLE IF NOT EXISTS certificates (
+    file TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    notAfter REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS certificates_notafter ON certificates (notAfter);
+CREATE TABLE IF NOT EXISTS names (
+    file TEXT NOT NULL REFERENCES certificates (file) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    PRIMARY KEY (file, name)
+);
+CREATE INDEX IF NOT EXISTS names_name ON names (name);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    file TEXT NOT NULL,
+    account TEXT,
+    started REAL NOT NULL,
+    finished REAL,
+    status TEXT NOT NULL,
+    detail TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_file ON jobs (file, started);
+"""
+
+class StateStore(object):
+    """
+    Persistent state kept between runs within a SQLite database: the
+    accounts of the user-keys, valid authorizations, the certificates
+    managed and the history of issuance jobs.
+
+    The store provides the interface of the AuthzCache, so it can be used as
+    authorization cache of the LeService. It may be shared by threads and
+    processes.
+    """
+    def __init__(self, filename, margin = 86400):
+        """
+        Constructor.
+
+        @param filename: The database file. It is created, if missing.
+        @param margin: Number of seconds an authorization must stay valid to
+            be returned.
+        """
+        directory = path.dirname(filename)
+        if len(directory) > 0 and not path.exists(directory):
+            makedirs(directory, 0700)
+        self.__margin = margin
+        self.__lock = Lock()
+        self.__db = sqlite3.connect(filename, timeout = 30, check_same_thread = False)
+        self.__db.execute("PRAGMA journal_mode=WAL")
+        self.__db.execute("PRAGMA foreign_keys=ON")
+        columns = [x[1] for x in self.__db.execute("PRAGMA table_info(authzs)")]
+        if len(columns) > 0 and "base" not in columns:
+            # authorizations stored without the service they belong to
+            self.__db.execute("DROP TABLE authzs")
+        self.__db.executescript(SCHEMA)
+
+    def close(self):
+        """
+        Closes the database.
+        """
+        with self.__lock:
+            self.__db.close()
+
+    def getAccount(self, thumbprint, base):
+        """
+        Returns the account url of a user-key.
+
+        @param thumbprint: JWK thumbprint of the user-key.
+        @param base: The base url of the ACME service.
+        @return: The account url or None, if unknown.
+        """
+        row = self.__queryOne("SELECT location FROM accounts WHERE thumbprint = ? AND base = ?", (thumbprint, base))
+        return row[0] if row is not None else None
+
+    def putAccount(self, thumbprint, base, location):
+        """
+        Stores the account url of a user-key.
+
+        @param thumbprint: JWK thumbprint of the user-key.
+        @param base: The base url of the ACME service.
+        @param location: The account url.
+        """
+        self.__execute("INSERT OR REPLACE INTO accounts VALUES (?, ?, ?, ?)", (thumbprint, base, location, time()))
+
+    def get(self, thumbprint, base, identifier):
+        """
+        Returns the location of a valid authorization. See AuthzCache.get.
+
+        @param thumbprint: JWK thumbprint of the account key.
+        @param base: The base url of the ACME service.
+        @param identifier: The identifier, e.g. as created by createDnsAuth.
+        @return: The location of the authorization or None, if there is no
+            authorization valid long enough.
+        """
+        row = self.__queryOne("SELECT uri FROM authzs WHERE thumbprint = ? AND base = ? AND type = ? AND value = ? AND expires > ?",
+                              (thumbprint, base, identifier["type"], identifier["value"], time() + self.__margin))
+        return row[0] if row is not None else None
+
+    def put(self, thumbprint, base, identifier, uri, expires):
+        """
+        Stores a valid authorization. See AuthzCache.put.
+
+        @param thumbprint: JWK thumbprint of the account key.
+        @param base: The base url of the ACME service.
+        @param identifier: The identifier the authorization is valid for.
+        @param uri: Location of the authorization.
+        @param expires: Expiry of the authorization as unix timestamp.
+        """
+        with self.__lock:
+            with self.__db:
+                self.__db.execute("DELETE FROM authzs WHERE expires < ?", (time(),))
+                self.__db.execute("INSERT OR REPLACE INTO authzs VALUES (?, ?, ?, ?, ?, ?)",
+                                  (thumbprint, base, identifier["type"], identifier["value"], uri, expires))
+
+    def remove(self, thumbprint, base, identifier):
+        """
+        Removes an authorization. See AuthzCache.remove.
+
+        @param thumbprint: JWK thumbprint of the account key.
+        @param base: The base url of the ACME service.
+        @param identifier: The identifier of the authorization.
+        """
+        self.__execute("DELETE FROM authzs WHERE thumbprint = ? AND base = ? AND type = ? AND value = ?",
+                       (thumbprint, base, identifier["type"], identifier["value"]))
+
+    def getCertificate(self, filename):
+        """
+        Returns the data stored for a certificate file.
+
+        @param filename: The certificate file.
+        @return: Pair of the modification time of the file when it has been
+            stored and the notAfter date or None, if the file is unknown.
+        """
+        return self.__queryOne("SELECT mtime, notAfter FROM certificates WHERE file = ?", (filename,))
+
+    def putCertificate(self, filename, mtime, notAfter, names):
+        """
+        Stores a certificate file.
+
+        @param filename: The certificate file.
+        @param mtime: The modification time of the file.
+        @param notAfter: The end of the validity as unix timestamp.
+        @param names: The DNS names of the certificate.
+        """
+        with self.__lock:
+            with self.__db:
+                self.__db.execute("DELETE FROM certificates WHERE file = ?", (filename,))
+                self.__db.execute("INSERT INTO certificates VALUES (?, ?, ?)", (filename, mtime, notAfter))
+                self.__db.executemany("INSERT OR IGNORE INTO names VALUES (?, ?)", [(filename, x) for x in names])
+
+    def removeCertificate(self, filename):
+        """
+        Removes a certificate file.
+
+        @param filename: The certificate file.
+        """
+        self.__execute("DELETE FROM certificates WHERE file = ?", (filename,))
+
+    def expiring(self, before):
+        """
+        Lists the certificates expiring before the given time.
+
+        @param before: Unix timestamp.
+        @return: List of pairs of certificate file and notAfter date ordered
+            by the notAfter date.
+        """
+        return self.__query("SELECT file, notAfter FROM certificates WHERE notAfter < ? ORDER BY notAfter", (before,))
+
+    def findCertificates(self, name):
+        """
+        Lists the certificates containing the given DNS name.
+
+        @param name: The DNS name.
+        @return: List of pairs of certificate file and notAfter date.
+        """
+        return self.__query("SELECT c.file, c.notAfter FROM names n JOIN certificates c ON c.file = n.file WHERE n.name = ?",
+                            (name,))
+
+    def startJob(self, filename, account = None):
+        """
+        Records the start of an issuance job.
+
+        @param filename: The certificate file.
+        @param account: The account used. Optional.
+        @return: The id of the job.
+        """
+        with self.__lock:
+            with self.__db:
+                cursor = self.__db.execute("INSERT INTO jobs (file, account, started, status) VALUES (?, ?, ?, ?)",
+                                           (filename, account, time(), "running"))
+                return cursor.lastrowid
+
+    def finishJob(self, jobId, status, detail = None, account = None):
+        """
+        Records the end of an issuance job.
+
+        @param jobId: The id returned by startJob.
+        @param status: The result, e.g. "done", "failed" or "deferred".
+        @param detail: An error message. Optional.
+        @param account: The account used, if not known at the start. Optional.
+        """
+        self.__execute("UPDATE jobs SET finished = ?, status = ?, detail = ?, account = COALESCE(?, account) WHERE id = ?",
+                       (time(), status, detail, account, jobId))
+
+    def jobHistory(self, filename, limit = 10):
+        """
+        Lists the latest jobs of a certificate file.
+
+        @param filename: The certificate file.
+        @param limit: Maximum number of jobs returned.
+        @return: List of tuples of start, end, status and detail, latest first.
+        """
+        return self.__query("SELECT started, finished, status, detail FROM jobs WHERE file = ? ORDER BY started DESC LIMIT ?",
+                            (filename, limit))
+
+    def __execute(self, sql, args):
+        """
+        Executes a statement within a transaction.
+
+        @param sql: The statement.
+        @param args: The arguments of the statement.
+        """
+        with self.__lock:
+            with self.__db:
+                self.__db.execute(sql, args)
+
+    def __query(self, sql, args):
+        """
+        Executes a query.
+
+        @param sql: The query.
+        @param args: The arguments of the query.
+        @return: List of rows.
+        """
+        with self.__lock:
+            return self.__db.execute(sql, args).fetchall()
+
+    def __queryOne(self, sql, args):
+        """
+        Executes a query returning a single row.
+
+        @param sql: The query.
+        @param args: The arguments of the query.
+        @return: The row or None.
+        """
+        with self.__lock:
+            return self.__db.execute(sql, args).fetchone()
@@ -0,0 +1,27 @@
+import unittest
+
+import config
+from letsencrypt.accounts import AccountPool
+
+class TestAccountPool(unittest.TestCase):
+    def create(self, labels):
+        pool = AccountPool()
+        for label in labels:
+            pool.add(label, object())
+        return pool
+
+    def test_order_by_label(self):
+        labels = ["/b/user.key", "/a/user.key", "/c/user.key"]
+        first = self.create(labels)
+        second = self.create(reversed(labels))
+        self.assertEqual([x[0] for x in first.getServices()], sorted(labels))
+        for name in ["example.com", "www.example.org", "a.b.example.net"]:
+            self.assertEqual(first.select([name])[0], second.select([name])[0])
+
+    def test_duplicate_label(self):
+        pool = self.create(["/a/user.key"])
+        self.assertRaises(Exception, pool.add, "/a/user.key", object())
+        self.assertEqual(pool.size(), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+from base64 import b64decode
+from calendar import timegm
+
+import config
+from letsencrypt import asn1
+
+CERT_UTC = """\
+-----BEGIN CERTIFICATE-----
+MIIB0TCCATqgAwIBAgIBATANBgkqhkiG9w0BAQsFADAYMRYwFAYDVQQDDA1hLmV4
+YW1wbGUuY29tMB4XDTI0MDEwMTAwMDAwMFoXDTMwMDYwMTEyMDAwMFowGDEWMBQG
+A1UEAwwNYS5leGFtcGxlLmNvbTCBnzANBgkqhkiG9w0BAQEFAAOBjQAwgYkCgYEA
+81PAFM1u9q/G27Yav7MJjiH9Y1BVtuAHusyJHzhRSHwS2mIAMJjwBYLxa3OtmInh
+kj02mTdF8HFcsVdInIwaJFEw3f2xvbzmmRUYShwB4xF89DBSQp0POqPDTUVZtolH
+18w43yl1rDeLKuvMWzH9GZANN2h6tDXVDsmS9k37vMMCAwEAAaMrMCkwJwYDVR0R
+BCAwHoINYS5leGFtcGxlLmNvbYINYi5leGFtcGxlLmNvbTANBgkqhkiG9w0BAQsF
+AAOBgQBKCRWUFjqCv9DnMyqIfluKBGGZWV2/UuB/HmNYicI+m+iH4vT76DDDQtMM
+Asb9wzjGEsxrPLLEqDf9TzKJsYD79mXqz0kFiZrK5eU9g2NNWq5wPA2Y7748Q6u9
+7beM0AaFfy6kg/RSwz1iw1FmPokqALfVrUw857icfczftP/bsQ==
+-----END CERTIFICATE-----
+"""
+
+CERT_GENERALIZED = """\
+-----BEGIN CERTIFICATE-----
+MIIBqDCCARGgAwIBAgIBATANBgkqhkiG9w0BAQsFADAYMRYwFAYDVQQDDA1jLmV4
+YW1wbGUuY29tMCIYDzIwMjQwMTAxMDAwMDAwWhgPMjA1MTAxMDEwMDAwMDBaMBgx
+FjAUBgNVBAMMDWMuZXhhbXBsZS5jb20wgZ8wDQYJKoZIhvcNAQEBBQADgY0AMIGJ
+AoGBAPNTwBTNbvavxtu2Gr+zCY4h/WNQVbbgB7rMiR84UUh8EtpiADCY8AWC8Wtz
+rZiJ4ZI9Npk3RfBxXLFXSJyMGiRRMN39sb285pkVGEocAeMRfPQwUkKdDzqjw01F
+WbaJR9fMON8pdaw3iyrrzFsx/RmQDTdoerQ11Q7JkvZN+7zDAgMBAAEwDQYJKoZI
+hvcNAQELBQADgYEA0+WTBY2ih71TcbCksSQks5uagckV6kw87bacw+DN/oMOfl+5
+4FEC6IzSfrCQ18VzT7MdlP6Xs7NxXSabxR2RlE27RmHgJxn1wAmHeMSwJw61V7oV
+daYUt6BQ41Z+948A/9KoQgTswAGSZZEyhjjWUly42ejQZ/klthHv7q2WmbU=
+-----END CERTIFICATE-----
+"""
+
+CSR_SAN = """\
+-----BEGIN CERTIFICATE REQUEST-----
+MIIBmDCCAQECAQAwGDEWMBQGA1UEAwwNYS5leGFtcGxlLmNvbTCBnzANBgkqhkiG
+9w0BAQEFAAOBjQAwgYkCgYEA81PAFM1u9q/G27Yav7MJjiH9Y1BVtuAHusyJHzhR
+SHwS2mIAMJjwBYLxa3OtmInhkj02mTdF8HFcsVdInIwaJFEw3f2xvbzmmRUYShwB
+4xF89DBSQp0POqPDTUVZtolH18w43yl1rDeLKuvMWzH9GZANN2h6tDXVDsmS9k37
+vMMCAwEAAaBAMD4GCSqGSIb3DQEJDjExMC8wLQYDVR0RBCYwJIINYS5leGFtcGxl
+LmNvbYINYi5leGFtcGxlLmNvbYcEfwAAATANBgkqhkiG9w0BAQsFAAOBgQBmErUj
+WYjZv669kDLfuu/zNslCxoVgGnD6PPrqd/k+DYJNng7rNR3ZFg6ZJX6qRwUg0IcS
+b5vrPDFBc8PUTlh0zS0Qv2QQ63WQRExmdozVGd5AeYS4L5z4juZ+9xIW/hHDalF+
+QYGw1IczbrWgBfSJNmNf/4819jKvJjtNLzsgrg==
+-----END CERTIFICATE REQUEST-----
+"""
+
+CSR_CN = """\
+-----BEGIN CERTIFICATE REQUEST-----
+MIIBVzCBwQIBADAYMRYwFAYDVQQDDA1kLmV4YW1wbGUuY29tMIGfMA0GCSqGSIb3
+DQEBAQUAA4GNADCBiQKBgQDzU8AUzW72r8bbthq/swmOIf1jUFW24Ae6zIkfOFFI
+fBLaYgAwmPAFgvFrc62YieGSPTaZN0XwcVyxV0icjBokUTDd/bG9vOaZFRhKHAHj
+EXz0MFJCnQ86o8NNRVm2iUfXzDjfKXWsN4sq68xbMf0ZkA03aHq0NdUOyZL2Tfu8
+wwIDAQABoAAwDQYJKoZIhvcNAQELBQADgYEA0rsspdnyyrt10qFbqtw5neCC+KSP
+j20m8oS3xLRwXV3vPKdyGe4Eh4KZ0Ce7iqGV+7hVdW1h2ogKbY65Fz+PQYDfQ4ST
+ZAUX8UhDKv1fCVYTwjyl7B8TfJXjuvub3bY9zHeT4+PKBPHneV62At1HuB8XZCrR
+pVwl2U8JtXaJoEY=
+-----END CERTIFICATE REQUEST-----
+"""
+
+def der(pem):
+    return b64decode("".join(pem.strip().splitlines()[1:-1]))
+
+class TestAsn1(unittest.TestCase):
+    def test_utc_time(self):
+        self.assertEqual(asn1.parseTime("300601120000Z", asn1.UTC_TIME), timegm((2030, 6, 1, 12, 0, 0)))
+        self.assertEqual(asn1.parseTime("991231235959Z", asn1.UTC_TIME), timegm((1999, 12, 31, 23, 59, 59)))
+        self.assertEqual(asn1.parseTime("500101000000Z", asn1.UTC_TIME), timegm((1950, 1, 1, 0, 0, 0)))
+
+    def test_generalized_time(self):
+        self.assertEqual(asn1.parseTime("20510101000000Z", asn1.GENERALIZED_TIME), timegm((2051, 1, 1, 0, 0, 0)))
+
+    def test_short_length(self):
+        self.assertEqual(asn1.readElement("\x04\x03abcd"), (0x04, 2, 5))
+
+    def test_long_length(self):
+        data = "\x30\x81\x80" + "x" * 0x80
+        self.assertEqual(asn1.readElement(data), (0x30, 3, 0x83))
+        data = "\x30\x82\x01\x00" + "x" * 0x100
+        self.assertEqual(asn1.readElement(data), (0x30, 4, 0x104))
+
+    def test_invalid_length(self):
+        self.assertRaises(Exception, asn1.readElement, "\x04")
+        self.assertRaises(Exception, asn1.readElement, "\x04\x05abc")
+        self.assertRaises(Exception, asn1.readElement, "\x30\x80")
+        self.assertRaises(Exception, asn1.readElement, "\x30\x82\x01")
+
+    def test_certificate_utc_time(self):
+        self.assertEqual(asn1.certificateNotAfter(der(CERT_UTC)), timegm((2030, 6, 1, 12, 0, 0)))
+
+    def test_certificate_generalized_time(self):
+        self.assertEqual(asn1.certificateNotAfter(der(CERT_GENERALIZED)), timegm((2051, 1, 1, 0, 0, 0)))
+
+    def test_certificate_alt_names(self):
+        self.assertEqual(asn1.certificateDnsNames(der(CERT_UTC)), ["a.example.com", "b.example.com"])
+
+    def test_certificate_common_name(self):
+        self.assertEqual(asn1.certificateDnsNames(der(CERT_GENERALIZED)), ["c.example.com"])
+
+    def test_csr_alt_names(self):
+        # the IP address entry is skipped
+        self.assertEqual(asn1.csrDnsNames(der(CSR_SAN)), ["a.example.com", "b.example.com"])
+
+    def test_csr_common_name(self):
+        self.assertEqual(asn1.csrDnsNames(der(CSR_CN)), ["d.example.com"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import imp
+import unittest
+from os import path
+from threading import Thread
+from time import sleep
+
+import config
+import pycurl
+from letsencrypt.http import HttpProviderCurl, CurlPool
+
+ACMESERVER = path.join(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))), "tools", "acmeserver.py")
+acmeserver = imp.load_source("acmeserver", ACMESERVER)
+
+class CountingServer(acmeserver.AcmeServer):
+    """
+    Stand-in server counting the TCP connections accepted.
+    """
+    def __init__(self, address, options):
+        acmeserver.AcmeServer.__init__(self, address, options)
+        self.connections = 0
+
+    def process_request(self, request, clientAddress):
+        self.connections += 1
+        acmeserver.AcmeServer.process_request(self, request, clientAddress)
+
+class TestCurlPool(unittest.TestCase):
+    def setUp(self):
+        self.server = CountingServer(("127.0.0.1", 0), acmeserver.parseOptions([]))
+        self.thread = Thread(target = self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        self.url = "http://127.0.0.1:%d/directory" % (self.server.server_address[1])
+        self.pool = HttpProviderCurl.createPool()
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get(self):
+        http = HttpProviderCurl(self.url, self.pool)
+        http.prepareGet()
+        return http.perform()
+
+    def getAll(self, count):
+        https = []
+        for I in range(count):
+            http = HttpProviderCurl(self.url, self.pool)
+            http.prepareGet()
+            https.append(http)
+        return sorted([resp for http, resp in HttpProviderCurl.performAll(https)])
+
+    def test_reused_handle(self):
+        # a handle reused from the pool must not attach the share again
+        self.assertEqual(self.get(), 200)
+        self.assertEqual(self.get(), 200)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_keep_alive_across_batches(self):
+        self.assertEqual(self.getAll(4), [200] * 4)
+        connections = self.server.connections
+        self.assertTrue(connections <= 4)
+        self.assertEqual(self.getAll(4), [200] * 4)
+        self.assertEqual(self.get(), 200)
+        self.assertEqual(self.server.connections, connections)
+
+    def test_transport_error(self):
+        http = HttpProviderCurl("http://127.0.0.1:1/", self.pool)
+        http.prepareGet()
+        self.assertEqual(list(HttpProviderCurl.performAll([http])), [(http, 0)])
+        self.assertTrue(http.getError() is not None)
+        http.prepareGet()
+        self.assertRaises(pycurl.error, http.perform)
+        self.assertEqual(self.get(), 200)
+
+    def test_connections_per_host(self):
+        self.pool.close()
+        self.pool = CurlPool(maxPerHost = 2)
+        self.server.state.options["latency"] = 50
+        self.assertEqual(self.getAll(8), [200] * 8)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_idle_expiry(self):
+        self.pool.close()
+        self.pool = CurlPool(maxIdle = 1)
+        self.assertEqual(self.get(), 200)
+        self.assertEqual(self.get(), 200)
+        self.assertEqual(self.server.connections, 1)
+        sleep(2)
+        self.assertEqual(self.get(), 200)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_no_keep_alive(self):
+        self.pool.close()
+        self.pool = CurlPool(maxPerHost = 0)
+        for I in range(3):
+            self.assertEqual(self.get(), 200)
+        self.assertEqual(self.server.connections, 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import shutil
+import tempfile
+import unittest
+from os import path
+
+import config
+from letsencrypt.journal import IssuanceJournal
+
+class TestIssuanceJournal(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = path.join(self.directory, "journals", "a.journal")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_append_and_resume(self):
+        journal = IssuanceJournal(self.filename)
+        journal.record("begin", account = "acct/1")
+        journal.record("authz", location = "authz/1")
+        journal.record("authz", location = "authz/2")
+        journal.close()
+        journal = IssuanceJournal(self.filename)
+        self.assertEqual(journal.find("begin")["account"], "acct/1")
+        self.assertEqual(journal.find("authz")["location"], "authz/2")
+        self.assertEqual(journal.find("authz", location = "authz/1")["location"], "authz/1")
+        self.assertTrue(journal.find("cert") is None)
+        journal.close()
+
+    def test_truncated_last_line(self):
+        journal = IssuanceJournal(self.filename)
+        journal.record("begin", account = "acct/1")
+        journal.record("order", location = "order/1")
+        journal.close()
+        data = open(self.filename).read()
+        open(self.filename, "w").write(data[:-10])
+        journal = IssuanceJournal(self.filename)
+        self.assertEqual(journal.find("begin")["account"], "acct/1")
+        self.assertTrue(journal.find("order") is None)
+        journal.record("order", location = "order/2")
+        journal.close()
+        lines = open(self.filename).read().splitlines()
+        self.assertEqual(len(lines), 3)
+        journal = IssuanceJournal(self.filename)
+        self.assertEqual(journal.find("order")["location"], "order/2")
+        journal.close()
+
+    def test_orphaned_challenges(self):
+        journal = IssuanceJournal(self.filename)
+        journal.record("challenge-prepared", token = "a")
+        journal.record("challenge-prepared", token = "b")
+        journal.record("challenge-cleaned", token = "a")
+        self.assertEqual([x["token"] for x in journal.orphanedChallenges()], ["b"])
+        journal.close()
+
+    def test_reset_and_remove(self):
+        journal = IssuanceJournal(self.filename)
+        journal.record("begin", account = "acct/1")
+        journal.reset()
+        self.assertTrue(journal.find("begin") is None)
+        self.assertTrue(IssuanceJournal(self.filename).find("begin") is None)
+        journal.record("begin", account = "acct/2")
+        journal.remove()
+        self.assertFalse(path.exists(self.filename))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+
+import config
+from letsencrypt.nonce import NoncePool
+
+class TestNoncePool(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.pool = NoncePool(self.fetch, maxSize = 4)
+
+    def fetch(self, count):
+        self.calls.append(count)
+        return ["n%d-%d" % (len(self.calls), I) for I in range(count)]
+
+    def test_take_fetches_missing_at_once(self):
+        self.pool.put("a")
+        nonces = self.pool.take(10)
+        self.assertEqual(len(nonces), 10)
+        self.assertEqual(nonces[0], "a")
+        self.assertEqual(self.calls, [9])
+        self.assertEqual(self.pool.size(), 0)
+
+    def test_prefetch_not_capped(self):
+        self.pool.prefetch(10)
+        self.assertEqual(self.pool.size(), 10)
+        self.assertEqual(len(self.pool.take(10)), 10)
+        self.assertEqual(self.calls, [10])
+
+    def test_put_capped(self):
+        for I in range(6):
+            self.pool.put(I)
+        self.assertEqual(self.pool.size(), 4)
+        self.assertEqual(self.pool.get(), 0)
+
+    def test_server_without_nonce(self):
+        pool = NoncePool(lambda count: [])
+        self.assertEqual(pool.take(3), [])
+        self.assertTrue(pool.get() is None)
+
+if __name__ == '__main__':
+    unittest.main()
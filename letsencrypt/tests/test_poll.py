@@ -0,0 +1,111 @@
+import unittest
+from email.utils import formatdate
+from time import time
+
+import config
+from letsencrypt import poll
+from letsencrypt.poll import PollScheduler, retryAfter
+
+class FakeHttp(object):
+    def __init__(self, url, retry = None):
+        self.url = url
+        self.retry = retry
+
+    def getHeader(self, name):
+        if name == "Retry-After" and self.retry is not None:
+            return [self.retry]
+        return []
+
+    def getUrl(self):
+        return self.url
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+class TestRetryAfter(unittest.TestCase):
+    def test_seconds(self):
+        self.assertEqual(retryAfter(FakeHttp("a", "120")), 120)
+        self.assertEqual(retryAfter(FakeHttp("a", " 7 ")), 7)
+
+    def test_http_date(self):
+        delay = retryAfter(FakeHttp("a", formatdate(time() + 60, usegmt = True)))
+        self.assertTrue(55 <= delay <= 60)
+
+    def test_http_date_past(self):
+        self.assertEqual(retryAfter(FakeHttp("a", formatdate(time() - 60, usegmt = True))), 0)
+
+    def test_missing_or_broken(self):
+        self.assertTrue(retryAfter(FakeHttp("a")) is None)
+        self.assertTrue(retryAfter(FakeHttp("a", "soon")) is None)
+
+class TestPollScheduler(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.saved = poll.time, poll.sleep
+        poll.time, poll.sleep = self.clock.time, self.clock.sleep
+        self.batches = []
+
+    def tearDown(self):
+        poll.time, poll.sleep = self.saved
+
+    def performAll(self, https):
+        self.batches.append(sorted([x.getUrl() for x in https]))
+        return [(x, 200) for x in https]
+
+    def test_polls_due_together(self):
+        scheduler = PollScheduler(self.performAll)
+        for url in ["a", "b", "c"]:
+            scheduler.add(lambda url = url: FakeHttp(url), lambda http, resp: True, 60)
+        self.assertEqual(scheduler.run(), 0)
+        self.assertEqual(self.batches, [["a", "b", "c"]])
+        self.assertEqual(scheduler.pending(), 0)
+
+    def test_retry_after_used(self):
+        scheduler = PollScheduler(self.performAll)
+        checks = []
+        scheduler.add(lambda: FakeHttp("a", "5"), lambda http, resp: checks.append(resp) or len(checks) == 3, 60)
+        self.assertEqual(scheduler.run(), 0)
+        self.assertEqual(len(self.batches), 3)
+        self.assertEqual(self.clock.sleeps, [5.0, 5.0])
+
+    def test_retry_after_minimum(self):
+        scheduler = PollScheduler(self.performAll, base = 2.0)
+        scheduler.add(lambda: FakeHttp("a", "0"), lambda http, resp: len(self.batches) == 3, 60)
+        self.assertEqual(scheduler.run(), 0)
+        self.assertEqual(self.clock.sleeps, [2.0, 2.0])
+
+    def test_backoff_cap_and_jitter(self):
+        scheduler = PollScheduler(self.performAll, base = 1.0, cap = 4.0)
+        scheduler.add(lambda: FakeHttp("a"), lambda http, resp: len(self.batches) == 6, 600)
+        self.assertEqual(scheduler.run(), 0)
+        self.assertEqual(len(self.clock.sleeps), 5)
+        for attempt, delay in enumerate(self.clock.sleeps):
+            expected = min(4.0, 2 ** attempt)
+            self.assertTrue(expected / 2.0 <= delay <= expected, (attempt, delay))
+
+    def test_deadline(self):
+        scheduler = PollScheduler(self.performAll, base = 1.0, cap = 4.0)
+        scheduler.add(lambda: FakeHttp("a"), lambda http, resp: False, 10)
+        scheduler.add(lambda: FakeHttp("b"), lambda http, resp: True, 10)
+        self.assertEqual(scheduler.run(), 1)
+        self.assertEqual(scheduler.pending(), 0)
+        self.assertTrue(self.clock.now >= 1010.0)
+        self.assertTrue(self.clock.now <= 1010.0 + 1e-6)
+
+    def test_delay(self):
+        scheduler = PollScheduler(self.performAll)
+        scheduler.add(lambda: FakeHttp("a"), lambda http, resp: True, 60, 3)
+        scheduler.run()
+        self.assertEqual(self.clock.sleeps, [3.0])
+
+if __name__ == '__main__':
+    unittest.main()
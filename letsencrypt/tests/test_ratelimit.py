@@ -0,0 +1,99 @@
+import shutil
+import tempfile
+import unittest
+from os import path
+from time import time
+
+import config
+from letsencrypt.ratelimit import RateLimitLedger, RateLimitScheduler, isFailedValidation, registeredDomain
+
+LIMITS = {
+    "certificatesPerDomain" : (2, 3600),
+    "duplicateCertificate" : (5, 3600),
+    "failedValidation" : (2, 600),
+    "newOrders" : (300, 3600),
+}
+
+class TestRateLimit(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = path.join(self.directory, "rl", "ledger.json")
+        self.ledger = RateLimitLedger(self.filename)
+        self.limiter = RateLimitScheduler(self.ledger, LIMITS)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_registered_domain(self):
+        self.assertEqual(registeredDomain("www.Example.com."), "example.com")
+        self.assertEqual(registeredDomain("*.example.com"), "example.com")
+
+    def test_failed_validation(self):
+        self.assertTrue(isFailedValidation({"type" : "urn:ietf:params:acme:error:connection"}))
+        self.assertTrue(isFailedValidation({"type" : "urn:acme:error:unauthorized"}))
+        self.assertFalse(isFailedValidation({"type" : "urn:ietf:params:acme:error:rateLimited"}))
+        self.assertFalse(isFailedValidation({}))
+        self.assertFalse(isFailedValidation(None))
+
+    def test_window_expiry(self):
+        now = time()
+        self.ledger.record("newOrders", "acct", now - 7200)
+        self.ledger.record("newOrders", "acct", now - 60)
+        self.assertEqual(len(self.ledger.events("newOrders", "acct", 3600)), 1)
+        self.assertEqual(len(self.ledger.events("newOrders", "acct", 86400)), 2)
+        # events older than maxAge are dropped when stored
+        ledger = RateLimitLedger(self.filename, maxAge = 3600)
+        ledger.record("newOrders", "acct")
+        self.assertEqual(len(RateLimitLedger(self.filename).events("newOrders", "acct", 86400)), 2)
+
+    def test_deferral(self):
+        self.assertEqual(self.limiter.acquire(["a.example.com"], "acct"), 0)
+        self.limiter.issued(["a.example.com"], "acct")
+        # jobs not finished do not count for the certificates
+        self.assertEqual(self.limiter.acquire(["b.example.com"], "acct"), 0)
+        self.assertEqual(self.limiter.acquire(["b.example.com"], "acct"), 0)
+        self.limiter.issued(["b.example.com"], "acct")
+        wait = self.limiter.acquire(["c.example.com"], "acct")
+        self.assertTrue(3590 < wait <= 3600)
+        self.assertEqual(self.limiter.acquire(["c.example.org"], "acct"), 0)
+        self.assertEqual(len(self.ledger.events("newOrders", "acct", 3600)), 4)
+
+    def test_reserve_shared_file(self):
+        other = RateLimitScheduler(RateLimitLedger(self.filename), dict(LIMITS, newOrders = (2, 3600)))
+        self.assertEqual(self.limiter.acquire(["a.example.com"], "acct"), 0)
+        self.assertEqual(other.acquire(["b.example.com"], "acct"), 0)
+        self.assertTrue(RateLimitScheduler(self.ledger, dict(LIMITS, newOrders = (2, 3600))).acquire(["c.example.com"], "acct") > 0)
+
+    def test_failed_deferral(self):
+        names = ["a.example.com"]
+        self.limiter.failed(names, "acct")
+        self.assertEqual(self.limiter.delay(names, "acct"), 0)
+        self.limiter.failed(names, "acct")
+        self.assertTrue(self.limiter.delay(names, "acct") > 590)
+        self.assertEqual(self.limiter.delay(names, "other"), 0)
+
+    def test_backoff(self):
+        self.limiter.backoff(["a.example.com"], "acct", 100, "too many certificates for example.com")
+        self.assertTrue(self.limiter.delay(["www.example.com"], "other") > 90)
+        self.assertEqual(self.limiter.delay(["a.example.org"], "acct"), 0)
+        self.limiter.backoff(["a.example.org"], "acct", 100)
+        self.assertTrue(self.limiter.delay(["b.example.net"], "acct") > 90)
+
+    def test_same_time(self):
+        now = time()
+        other = RateLimitLedger(self.filename)
+        self.ledger.record("newOrders", "acct", now)
+        other.record("newOrders", "acct", now)
+        self.ledger.record("newOrders", "acct", now)
+        self.assertEqual(self.ledger.events("newOrders", "acct", 3600), [now] * 3)
+
+    def test_shared_file(self):
+        other = RateLimitLedger(self.filename)
+        self.ledger.record("newOrders", "acct")
+        other.record("newOrders", "acct")
+        self.ledger.record("newOrders", "acct")
+        self.assertEqual(len(other.events("newOrders", "acct", 3600)), 3)
+        self.assertEqual(len(RateLimitLedger(self.filename).events("newOrders", "acct", 3600)), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,22 @@
+import unittest
+
+import config
+from letsencrypt import NewAuthzResponse, AuthzResponse
+
+CHALLENGES = [{"type" : "dns-01", "token" : "a"}, {"type" : "http-01", "token" : "b"}]
+
+class TestAuthzResponses(unittest.TestCase):
+    def test_v1_combinations(self):
+        authz = NewAuthzResponse(201, {"challenges" : CHALLENGES, "combinations" : [[1], [0, 1]]}, "authz/1")
+        self.assertEqual(authz.combinations, [[1], [0, 1]])
+
+    def test_without_combinations(self):
+        structure = {"identifier" : {"type" : "dns", "value" : "a.example.com"}, "status" : "pending",
+                     "challenges" : CHALLENGES, "expires" : "2030-01-01T00:00:00Z"}
+        authz = NewAuthzResponse(200, structure, "authz/1")
+        self.assertEqual(authz.combinations, [[0], [1]])
+        self.assertEqual(authz.authzStatus, "pending")
+        self.assertEqual(AuthzResponse(200, structure, "authz/1").challanges, CHALLENGES)
+
+if __name__ == '__main__':
+    unittest.main()
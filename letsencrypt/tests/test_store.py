@@ -0,0 +1,100 @@
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from os import path
+from time import time
+
+import config
+from letsencrypt.store import StateStore
+
+class TestStateStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = path.join(self.directory, "state", "state.db")
+        self.store = StateStore(self.filename)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def test_account(self):
+        self.assertTrue(self.store.getAccount("thumb", "base") is None)
+        self.store.putAccount("thumb", "base", "acct/1")
+        self.store.putAccount("thumb", "base", "acct/2")
+        self.assertEqual(self.store.getAccount("thumb", "base"), "acct/2")
+        self.assertTrue(self.store.getAccount("thumb", "other") is None)
+
+    def test_authz(self):
+        identifier = {"type" : "dns", "value" : "a.example.com"}
+        self.store.put("thumb", "base", identifier, "authz/1", time() + 7 * 86400)
+        self.store.put("thumb", "base", {"type" : "dns", "value" : "b.example.com"}, "authz/2", time() + 3600)
+        self.assertEqual(self.store.get("thumb", "base", identifier), "authz/1")
+        self.assertTrue(self.store.get("other", "base", identifier) is None)
+        # valid shorter than the margin
+        self.assertTrue(self.store.get("thumb", "base", {"type" : "dns", "value" : "b.example.com"}) is None)
+        self.store.remove("thumb", "base", identifier)
+        self.assertTrue(self.store.get("thumb", "base", identifier) is None)
+
+    def test_authz_per_service(self):
+        identifier = {"type" : "dns", "value" : "a.example.com"}
+        self.store.put("thumb", "staging", identifier, "authz/1", time() + 7 * 86400)
+        self.assertTrue(self.store.get("thumb", "production", identifier) is None)
+        self.store.put("thumb", "production", identifier, "authz/2", time() + 7 * 86400)
+        self.store.remove("thumb", "staging", identifier)
+        self.assertEqual(self.store.get("thumb", "production", identifier), "authz/2")
+
+    def test_drop_authzs_without_service(self):
+        self.store.close()
+        db = sqlite3.connect(self.filename)
+        db.execute("DROP TABLE authzs")
+        db.execute("CREATE TABLE authzs (thumbprint TEXT, type TEXT, value TEXT, uri TEXT, expires REAL)")
+        db.execute("INSERT INTO authzs VALUES ('thumb', 'dns', 'a.example.com', 'authz/1', ?)", (time() + 7 * 86400,))
+        db.commit()
+        db.close()
+        self.store = StateStore(self.filename)
+        identifier = {"type" : "dns", "value" : "a.example.com"}
+        self.assertTrue(self.store.get("thumb", "base", identifier) is None)
+        self.store.put("thumb", "base", identifier, "authz/2", time() + 7 * 86400)
+        self.assertEqual(self.store.get("thumb", "base", identifier), "authz/2")
+
+    def test_certificates(self):
+        self.store.putCertificate("a.crt", 1.0, 2000.0, ["a.example.com", "www.example.com"])
+        self.store.putCertificate("b.crt", 1.0, 1000.0, ["www.example.com"])
+        self.assertEqual(tuple(self.store.getCertificate("a.crt")), (1.0, 2000.0))
+        self.assertEqual([tuple(x) for x in self.store.expiring(3000.0)], [("b.crt", 1000.0), ("a.crt", 2000.0)])
+        self.assertEqual(sorted([x[0] for x in self.store.findCertificates("www.example.com")]), ["a.crt", "b.crt"])
+        self.store.removeCertificate("a.crt")
+        self.assertTrue(self.store.getCertificate("a.crt") is None)
+        self.assertEqual([x[0] for x in self.store.findCertificates("a.example.com")], [])
+
+    def test_jobs(self):
+        jobId = self.store.startJob("a.crt")
+        self.store.finishJob(jobId, "failed", "boom", "acct/1")
+        history = self.store.jobHistory("a.crt")
+        self.assertEqual(len(history), 1)
+        self.assertEqual(tuple(history[0][2:]), ("failed", "boom"))
+
+    def test_reopen(self):
+        identifier = {"type" : "dns", "value" : "a.example.com"}
+        self.store.putAccount("thumb", "base", "acct/1")
+        self.store.put("thumb", "base", identifier, "authz/1", time() + 7 * 86400)
+        self.store.putCertificate("a.crt", 1.0, 2000.0, ["a.example.com"])
+        # the changes are still in the write-ahead log
+        self.assertTrue(path.exists(self.filename + "-wal"))
+        other = StateStore(self.filename)
+        try:
+            self.assertEqual(other.getAccount("thumb", "base"), "acct/1")
+            self.assertEqual(other.get("thumb", "base", identifier), "authz/1")
+            other.putAccount("thumb", "other", "acct/2")
+        finally:
+            other.close()
+        self.assertEqual(self.store.getAccount("thumb", "other"), "acct/2")
+        self.store.close()
+        self.store = StateStore(self.filename)
+        self.assertEqual(self.store.getAccount("thumb", "base"), "acct/1")
+        self.assertEqual(self.store.get("thumb", "base", identifier), "authz/1")
+        self.assertEqual(tuple(self.store.getCertificate("a.crt")), (1.0, 2000.0))
+
+if __name__ == '__main__':
+    unittest.main()
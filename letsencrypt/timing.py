@@ -0,0 +1,107 @@
+# yalec - Yet Another Let's Encrypt Client
+# Copyright (C) 2016 Falk Garbsch
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+from threading import Lock
+
+import logging
+
+class TimingCollector(object):
+    """
+    Observer for the LeService collecting the latency breakdown of each
+    request per ACME operation.
+    
+    The points in time reported by the HTTP provider are converted into the
+    duration of each phase: name lookup, TCP connect, TLS handshake, server
+    processing (until the first byte) and transfer of the response.
+    """
+    PHASES = ["dns", "connect", "tls", "server", "transfer", "total"]
+
+    def __init__(self, log = True):
+        """
+        Constructor.
+        
+        @param log: If True, the breakdown of each request is logged.
+        """
+        self.__log = log
+        self.__lock = Lock()
+        self.__operations = {}
+
+    def requestDone(self, operation, url, status, timings):
+        """
+        Records the timings of a finished request.
+        
+        @param operation: Name of the ACME operation.
+        @param url: The url requested.
+        @param status: The HTTP status-code.
+        @param timings: Dict of timings as returned by the HTTP provider.
+        """
+        phases = TimingCollector.breakdown(timings)
+        if self.__log:
+            logging.info("%s %s %s: %s", operation, status, url,
+                         " ".join(["%s=%.3f" % (x, phases[x]) for x in self.PHASES if x in phases]))
+        with self.__lock:
+            entry = self.__operations.setdefault(operation, {"count" : 0, "timed" : 0, "uploaded" : 0, "downloaded" : 0})
+            entry["count"] += 1
+            if phases.has_key("server"):
+                entry["timed"] += 1
+            entry["uploaded"] += timings.get("uploaded", 0)
+            entry["downloaded"] += timings.get("downloaded", 0)
+            for phase, value in phases.items():
+                entry[phase] = entry.get(phase, 0.0) + value
+
+    def summary(self):
+        """
+        Returns the collected values per operation. The phase durations are
+        summed up over all requests of an operation.
+        
+        @return: Dict mapping operation names to dicts of summed values.
+        """
+        with self.__lock:
+            return dict((k, dict(v)) for k, v in self.__operations.items())
+
+    def logSummary(self):
+        """
+        Logs the average breakdown per operation at debug level. This is
+        called by LeService.close.
+        """
+        for operation, entry in sorted(self.summary().items()):
+            values = []
+            for phase in self.PHASES:
+                count = entry["count"] if phase == "total" else entry["timed"]
+                if phase in entry and count > 0:
+                    values.append("%s=%.3f" % (phase, entry[phase] / count))
+            logging.debug("%s: %d requests, %s", operation, entry["count"], " ".join(values))
+
+    @staticmethod
+    def breakdown(timings):
+        """
+        Converts the points in time reported by the HTTP provider into the
+        duration of each phase.
+        
+        @param timings: Dict of timings as returned by the HTTP provider.
+        @return: Dict of phase durations in seconds.
+        """
+        if not timings.has_key("ttfb"):
+            return dict((k, v) for k, v in timings.items() if k == "total")
+        dns = timings["dns"]
+        connect = max(timings["connect"], dns)
+        tls = max(timings["tls"], connect)
+        ttfb = max(timings["ttfb"], tls)
+        total = max(timings["total"], ttfb)
+        return {"dns" : dns, "connect" : connect - dns, "tls" : tls - connect,
+                "server" : ttfb - tls, "transfer" : total - ttfb, "total" : total}
@@ -0,0 +1,345 @@
+# yalec - Yet Another Let's Encrypt Client
+# Copyright (C) 2016 Falk Garbsch
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+from functools import wraps
+from os import urandom
+from threading import Lock, local
+from time import time
+import json
+
+# attributes passed on from a span to its children, so each span names the
+# account and the domains it has been working for
+INHERITED = ["acme.account", "acme.account.url", "acme.domains"]
+
+# span kinds and status codes as defined by OTLP
+KIND_INTERNAL = 1
+KIND_CLIENT = 3
+STATUS_ERROR = 2
+
+# the tracer used by span, record and traced, None disables tracing
+_tracer = None
+
+def setTracer(tracer):
+    """
+    Sets the tracer used by all instrumented code.
+
+    @param tracer: The Tracer or None to disable tracing.
+    """
+    global _tracer
+    _tracer = tracer
+
+def getTracer():
+    """
+    Returns the tracer used by all instrumented code.
+
+    @return: The Tracer or None, if tracing is disabled.
+    """
+    return _tracer
+
+def span(name, attributes = None, kind = KIND_INTERNAL):
+    """
+    Creates a span to be used as context manager. The span becomes the
+    parent of all spans created by the same thread until it is left.
+
+    @param name: The name of the operation.
+    @param attributes: Dict of attributes. Optional.
+    @param kind: The span kind. Optional.
+    @return: The Span or a no-op span, if tracing is disabled.
+    """
+    if _tracer is None:
+        return NOOP_SPAN
+    return _tracer.span(name, attributes, kind)
+
+def current():
+    """
+    Returns the span active within the current thread.
+
+    @return: The Span or a no-op span, if there is none.
+    """
+    if _tracer is None:
+        return NOOP_SPAN
+    return _tracer.current() or NOOP_SPAN
+
+def record(name, start, end, attributes = None, kind = KIND_INTERNAL):
+    """
+    Records a span that already finished as child of the active span, e.g.
+    a HTTP transfer performed concurrently with others.
+
+    @param name: The name of the operation.
+    @param start: Unix timestamp of the start.
+    @param end: Unix timestamp of the end.
+    @param attributes: Dict of attributes. Optional.
+    @param kind: The span kind. Optional.
+    """
+    if _tracer is not None:
+        _tracer.record(name, start, end, attributes, kind)
+
+def traced(name):
+    """
+    Decorator wrapping each call of a function into a span.
+
+    @param name: The name of the span.
+    @return: The decorator.
+    """
+    def decorate(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return function(*args, **kwargs)
+            with _tracer.span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+class _NoopSpan(object):
+    """
+    Span doing nothing, used while tracing is disabled.
+    """
+    def setAttribute(self, key, value):
+        pass
+
+    def setError(self, message):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        return False
+
+NOOP_SPAN = _NoopSpan()
+
+class Span(object):
+    """
+    A timed operation within a trace. Spans are created by the Tracer and
+    exported, when they end.
+    """
+    def __init__(self, tracer, name, parent, attributes, kind, start = None):
+        """
+        Constructor.
+
+        @param tracer: The Tracer exporting the span.
+        @param name: The name of the operation.
+        @param parent: The parent Span or None for a new trace.
+        @param attributes: Dict of attributes or None.
+        @param kind: The span kind.
+        @param start: Unix timestamp of the start. Defaults to now.
+        """
+        self.tracer = tracer
+        self.name = name
+        self.kind = kind
+        self.traceId = parent.traceId if parent is not None else urandom(16).encode("hex")
+        self.spanId = urandom(8).encode("hex")
+        self.parentSpanId = parent.spanId if parent is not None else None
+        self.attributes = {}
+        if parent is not None:
+            for key in INHERITED:
+                if key in parent.attributes:
+                    self.attributes[key] = parent.attributes[key]
+        self.attributes.update(attributes or {})
+        self.start = start or time()
+        self.end = None
+        self.error = None
+
+    def setAttribute(self, key, value):
+        """
+        Sets an attribute. Spans created later inherit the attributes listed
+        in INHERITED.
+
+        @param key: The name of the attribute.
+        @param value: A string, number, bool or list of those.
+        """
+        self.attributes[key] = value
+
+    def setError(self, message):
+        """
+        Marks the operation as failed.
+
+        @param message: The error message.
+        """
+        self.error = message
+
+    def finish(self, end = None):
+        """
+        Ends the span and exports it.
+
+        @param end: Unix timestamp of the end. Defaults to now.
+        """
+        self.end = end or time()
+        self.tracer.export(self)
+
+    def __enter__(self):
+        self.tracer.push(self)
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        if excValue is not None and self.error is None:
+            self.setError(str(getattr(excValue, "msg", excValue)))
+        self.tracer.pop(self)
+        self.finish()
+        return False
+
+class Tracer(object):
+    """
+    Creates spans and passes the finished ones to an exporter. The active
+    span is kept per thread, so spans of concurrent workers form separate
+    trees.
+    """
+    def __init__(self, exporter):
+        """
+        Constructor.
+
+        @param exporter: Object providing export(span), e.g. a
+            JsonLinesExporter.
+        """
+        self.__exporter = exporter
+        self.__local = local()
+
+    def span(self, name, attributes = None, kind = KIND_INTERNAL):
+        """
+        Creates a span as child of the active span of the thread.
+
+        @param name: The name of the operation.
+        @param attributes: Dict of attributes or None.
+        @param kind: The span kind.
+        @return: The Span to be used as context manager.
+        """
+        return Span(self, name, self.current(), attributes, kind)
+
+    def record(self, name, start, end, attributes = None, kind = KIND_INTERNAL):
+        """
+        Exports a span that already finished as child of the active span.
+
+        @param name: The name of the operation.
+        @param start: Unix timestamp of the start.
+        @param end: Unix timestamp of the end.
+        @param attributes: Dict of attributes or None.
+        @param kind: The span kind.
+        """
+        Span(self, name, self.current(), attributes, kind, start).finish(end)
+
+    def current(self):
+        """
+        Returns the active span of the thread.
+
+        @return: The Span or None.
+        """
+        stack = getattr(self.__local, "stack", None)
+        return stack[-1] if stack else None
+
+    def push(self, span):
+        """
+        Makes a span the active span of the thread.
+
+        @param span: The Span.
+        """
+        if not hasattr(self.__local, "stack"):
+            self.__local.stack = []
+        self.__local.stack.append(span)
+
+    def pop(self, span):
+        """
+        Leaves the given span and all spans it contains.
+
+        @param span: The Span.
+        """
+        stack = getattr(self.__local, "stack", [])
+        if span in stack:
+            del stack[stack.index(span):]
+
+    def export(self, span):
+        """
+        Passes a finished span to the exporter.
+
+        @param span: The Span.
+        """
+        self.__exporter.export(span)
+
+class JsonLinesExporter(object):
+    """
+    Writes each finished span as a line of JSON shaped like an OTLP
+    ExportTraceServiceRequest, as read by the otlpjsonfile receiver of the
+    OpenTelemetry collector.
+    """
+    def __init__(self, filename, serviceName = "yalec"):
+        """
+        Constructor.
+
+        @param filename: The file the spans are appended to.
+        @param serviceName: Value of the service.name resource attribute.
+        """
+        self.__fp = open(filename, "a")
+        self.__serviceName = serviceName
+        self.__lock = Lock()
+
+    def export(self, span):
+        """
+        Writes a span.
+
+        @param span: The finished Span.
+        """
+        otlp = {"traceId" : span.traceId, "spanId" : span.spanId, "name" : span.name, "kind" : span.kind,
+                "startTimeUnixNano" : str(int(span.start * 1e9)), "endTimeUnixNano" : str(int(span.end * 1e9)),
+                "attributes" : JsonLinesExporter.attributes(span.attributes)}
+        if span.parentSpanId is not None:
+            otlp["parentSpanId"] = span.parentSpanId
+        if span.error is not None:
+            otlp["status"] = {"code" : STATUS_ERROR, "message" : span.error}
+        request = {"resourceSpans" : [{
+            "resource" : {"attributes" : JsonLinesExporter.attributes({"service.name" : self.__serviceName})},
+            "scopeSpans" : [{"scope" : {"name" : "yalec"}, "spans" : [otlp]}]}]}
+        line = json.dumps(request) + "\n"
+        with self.__lock:
+            self.__fp.write(line)
+            self.__fp.flush()
+
+    def close(self):
+        """
+        Closes the file.
+        """
+        with self.__lock:
+            self.__fp.close()
+
+    @staticmethod
+    def attributes(attributes):
+        """
+        Converts a dict of attributes into the list of key-value pairs of
+        OTLP.
+
+        @param attributes: Dict of attributes.
+        @return: List of OTLP key-value pairs.
+        """
+        return [{"key" : k, "value" : JsonLinesExporter.value(v)} for k, v in sorted(attributes.items())]
+
+    @staticmethod
+    def value(value):
+        """
+        Converts an attribute value into an OTLP AnyValue.
+
+        @param value: A string, number, bool or list of those.
+        @return: Dict of the OTLP AnyValue.
+        """
+        if isinstance(value, bool):
+            return {"boolValue" : value}
+        if isinstance(value, (int, long)):
+            return {"intValue" : str(value)}
+        if isinstance(value, float):
+            return {"doubleValue" : value}
+        if isinstance(value, (list, tuple)):
+            return {"arrayValue" : {"values" : [JsonLinesExporter.value(x) for x in value]}}
+        return {"stringValue" : unicode(value)}
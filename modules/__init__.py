@@ -17,6 +17,25 @@
 #
 
 import getopt
+import config
+
+from letsencrypt import LeService
+from letsencrypt.cache import DirectoryCache, AuthzCache
+from letsencrypt.timing import TimingCollector
+from letsencrypt.ratelimit import RateLimitLedger, RateLimitScheduler
+from letsencrypt.accounts import AccountPool
+from letsencrypt.store import StateStore
+from letsencrypt.journal import IssuanceJournal, journalFile
+from letsencrypt.tracing import Tracer, JsonLinesExporter, getTracer, setTracer
+from letsencrypt.metrics import MetricsCollector, writeTextfile
+from os import path
+
+import logging
+
+# StateStore shared by all services, opened on first use
+_stateStore = None
+# MetricsCollector shared by all services, created on first use
+_metrics = None
 
 def getOpts(argv, shortopts, longopts, mandatory = [], optsMap = {}):
     """
@@ -48,3 +67,137 @@ def getOpts(argv, shortopts, longopts, mandatory = [], optsMap = {}):
         print "error: %s" % (e.msg)
         valid = False
     return valid, optsMap
+
+def createService(base, userKey, webdir = None, loadDirectory = True):
+    """
+    Helper function to create a LeService for the given base address using
+    the classes and settings defined in config.py. The directory of the
+    service is loaded before the service is returned.
+    
+    @param base: The base address of the ACME service.
+    @param userKey: The user-key to be used for all transactions.
+    @param webdir: The directory for http-based challenges. Optional.
+    @param loadDirectory: If False, the directory is not loaded, so the
+        caller must call updateDirectory before using the service.
+    @return: The LeService.
+    """
+    setupTracing()
+    le = LeService(base, config.HttpProvider, config.Authenticators, config.Certificate)
+    le.setUserKey(userKey)
+    if webdir is not None:
+        le.setConfigEntry("WEBDIR", webdir)
+    le.setKeyIdSigning(config.KEY_ID_SIGNING)
+    if config.LOG_TIMINGS:
+        le.addObserver(TimingCollector())
+    metrics = createMetrics()
+    if metrics is not None:
+        le.addObserver(metrics)
+    if config.CACHEDIR is not None:
+        le.setDirectoryCache(DirectoryCache(config.CACHEDIR, config.DIRECTORY_TTL))
+        le.setAuthzCache(AuthzCache(config.CACHEDIR))
+    store = createStateStore()
+    if store is not None:
+        le.setStateStore(store)
+    if loadDirectory:
+        le.updateDirectory()
+    return le
+
+def createAccountPool(base, userKeyFiles, webdir = None, loadDirectory = True):
+    """
+    Helper function to create an AccountPool with one LeService for each
+    user-key given. The absolute paths of the key files are used as labels
+    of the accounts.
+    
+    @param base: The base address of the ACME service.
+    @param userKeyFiles: List of files containing the user-keys.
+    @param webdir: The directory for http-based challenges. Optional.
+    @param loadDirectory: If False, the directories are not loaded, so the
+        caller must call updateDirectory of the pool. Optional.
+    @return: The AccountPool.
+    """
+    accounts = AccountPool()
+    for userKeyFile in userKeyFiles:
+        userKey = config.KeyPair()
+        fp = open(userKeyFile, "r")
+        try:
+            userKey.load(fp)
+        finally:
+            fp.close()
+        accounts.add(path.abspath(userKeyFile), createService(base, userKey, webdir, loadDirectory))
+    return accounts
+
+def createRateLimiter():
+    """
+    Helper function to create a RateLimitScheduler as defined in config.py.
+    The ledger is kept within the cache directory, so it is shared by all
+    runs.
+    
+    @return: The RateLimitScheduler or None, if rate limiting is disabled.
+    """
+    if config.RATE_LIMITS is None:
+        return None
+    filename = None
+    if config.CACHEDIR is not None:
+        filename = path.join(config.CACHEDIR, "ratelimit.json")
+    return RateLimitScheduler(RateLimitLedger(filename), config.RATE_LIMITS)
+
+def createMetrics():
+    """
+    Helper function to create the MetricsCollector, if metrics are enabled
+    in config.py. The collector is shared by all services of the process.
+    
+    @return: The MetricsCollector or None, if metrics are disabled.
+    """
+    global _metrics
+    if config.METRICS_FILE is None and config.METRICS_PORT is None:
+        return None
+    if _metrics is None:
+        _metrics = MetricsCollector()
+    return _metrics
+
+def writeMetrics():
+    """
+    Helper function to write the metrics to the file defined in config.py,
+    if any.
+    """
+    if config.METRICS_FILE is None or _metrics is None:
+        return
+    try:
+        writeTextfile(config.METRICS_FILE, _metrics.render())
+    except (IOError, OSError) as e:
+        logging.warning("cannot write metrics: %s", e)
+
+def setupTracing():
+    """
+    Helper function to enable tracing into the file defined in config.py.
+    The tracer is set up once and shared by all services of the process.
+    """
+    if config.TRACE_FILE is not None and getTracer() is None:
+        setTracer(Tracer(JsonLinesExporter(config.TRACE_FILE)))
+
+def createJournal(csr):
+    """
+    Helper function to open the journal of the issuance of a CSR within the
+    journal directory defined in config.py. The journal must be removed once
+    the certificate has been stored.
+    
+    @param csr: The CSR to be signed.
+    @return: The IssuanceJournal or None, if journaling is disabled.
+    """
+    if config.JOURNALDIR is None:
+        return None
+    return IssuanceJournal(journalFile(config.JOURNALDIR, csr))
+
+def createStateStore():
+    """
+    Helper function to open the StateStore defined in config.py. The store
+    is opened once and shared by all services of the process.
+    
+    @return: The StateStore or None, if the store is disabled.
+    """
+    global _stateStore
+    if config.STATE_DB is None:
+        return None
+    if _stateStore is None:
+        _stateStore = StateStore(config.STATE_DB)
+    return _stateStore
@@ -0,0 +1,342 @@
+# yalec - Yet Another Let's Encrypt Client
+# Copyright (C) 2016 Falk Garbsch
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+from modules import getOpts, createAccountPool, createRateLimiter, createStateStore, createMetrics, writeMetrics
+from letsencrypt.metrics import MetricsServer
+from modules.renew import findCertificates, getNotAfter, renewAll
+import config
+from os import path, stat
+from heapq import heappush, heappop
+from threading import Event
+from random import uniform
+from time import time
+import signal
+
+import logging
+
+class RenewalDaemon(object):
+    """
+    Keeps all certificates of a directory tree in a min-heap ordered by the
+    time their renewal is due and renews them when they become due.
+
+    The due time is the begin of the renewal window plus a random offset of
+    up to jitter seconds, so certificates issued together are not renewed in
+    a burst. The directory tree is scanned regularly, so new, replaced and
+    removed certificates are picked up without restarting.
+    """
+    def __init__(self, accounts, certDir, days, workers, jitter = 3600, rescan = 300, retry = 3600, limiter = None,
+                 store = None, report = None):
+        """
+        Constructor.
+
+        @param accounts: The AccountPool used for all renewals.
+        @param certDir: The directory tree containing the certificates.
+        @param days: Certificates are renewed this number of days before
+            they expire.
+        @param workers: Maximum number of certificates renewed concurrently.
+        @param jitter: Maximum number of seconds the renewal is delayed to
+            spread the load.
+        @param rescan: Number of seconds between two scans of the tree.
+        @param retry: Number of seconds to wait before a failed renewal is
+            retried.
+        @param limiter: A RateLimitScheduler deferring renewals that would
+            exceed the rate limits of the ACME server. Optional.
+        @param store: A StateStore keeping the certificates and the renewal
+            history. Optional.
+        @param report: Function called after each cycle of the daemon, e.g.
+            to write metrics. Optional.
+        """
+        self.__accounts = accounts
+        self.__certDir = certDir
+        self.__window = days * 86400
+        self.__workers = workers
+        self.__jitter = jitter
+        self.__rescan = rescan
+        self.__retry = retry
+        self.__limiter = limiter
+        self.__store = store
+        self.__report = report
+        self.__heap = []
+        self.__entries = {}
+        self.__seq = 0
+        self.__stop = Event()
+
+    def scan(self):
+        """
+        Scans the directory tree. Certificates added or replaced since the
+        last scan are (re)scheduled, removed certificates are dropped.
+        """
+        found = {}
+        for crtFile, csrFile in findCertificates(self.__certDir):
+            try:
+                found[crtFile] = (csrFile, stat(crtFile).st_mtime)
+            except OSError:
+                continue
+        for crtFile in self.__entries.keys():
+            if crtFile not in found:
+                logging.info("certificate %s removed", crtFile)
+                del self.__entries[crtFile]
+                if self.__store is not None:
+                    self.__store.removeCertificate(crtFile)
+        for crtFile, (csrFile, mtime) in found.items():
+            entry = self.__entries.get(crtFile)
+            if entry is not None and entry["mtime"] == mtime:
+                continue
+            try:
+                notAfter = getNotAfter(crtFile, self.__store)
+            except Exception as e:
+                # not scheduled until the file is replaced
+                logging.warning("cannot read %s: %s", crtFile, e)
+                self.__entries[crtFile] = {"csr" : csrFile, "mtime" : mtime, "seq" : None}
+                continue
+            due = max(time(), notAfter - self.__window) + uniform(0, self.__jitter)
+            logging.debug("schedule renewal of %s in %d seconds", crtFile, due - time())
+            self.__schedule(crtFile, csrFile, mtime, due)
+
+    def pending(self):
+        """
+        Returns the number of certificates scheduled for renewal.
+
+        @return: Number of certificates.
+        """
+        return len([x for x in self.__entries.values() if x["seq"] is not None])
+
+    def nextDue(self):
+        """
+        Returns the time the next renewal is due.
+
+        @return: Unix timestamp or None, if no certificate is managed.
+        """
+        self.__dropStale()
+        if len(self.__heap) == 0:
+            return None
+        return self.__heap[0][0]
+
+    def renewDue(self):
+        """
+        Renews all certificates being due. Failed renewals are retried after
+        the retry delay, deferred renewals when the rate limits allow. The
+        certificates are rescheduled even if the renewal raises.
+
+        @return: Number of certificates renewed.
+        """
+        jobs = []
+        now = time()
+        while self.nextDue() is not None and self.nextDue() <= now:
+            due, seq, crtFile = heappop(self.__heap)
+            jobs.append((crtFile, self.__entries[crtFile]["csr"]))
+        if len(jobs) == 0:
+            return 0
+        logging.info("renew %d certificates", len(jobs))
+        failed, deferred = None, {}
+        try:
+            failed, deferred = renewAll(self.__accounts, jobs, self.__workers, self.__limiter, self.__store)
+        finally:
+            # if renewAll raised, all jobs are retried, the files replaced
+            # meanwhile are rescheduled by the next scan anyway
+            for crtFile, csrFile in jobs:
+                entry = self.__entries.get(crtFile)
+                if entry is None:
+                    continue
+                if crtFile in deferred:
+                    self.__schedule(crtFile, csrFile, entry["mtime"], deferred[crtFile] + uniform(0, self.__jitter))
+                elif failed is None or crtFile in failed:
+                    self.__schedule(crtFile, csrFile, entry["mtime"], time() + self.__retry)
+                else:
+                    # the replaced file is picked up by the next scan
+                    entry["mtime"] = None
+        self.scan()
+        return len(jobs) - len(failed) - len(deferred)
+
+    def run(self):
+        """
+        Runs the daemon until stop is called.
+
+        Errors of a cycle, e.g. the ACME server being unreachable, do not
+        stop the daemon. The failed step is retried after the retry delay,
+        while the directory and the schedule of the last successful scan are
+        kept. The directory is loaded by the first cycle, so the daemon starts
+        even if the server is unreachable. No certificate is renewed until the
+        directory has been loaded once.
+        """
+        nextScan = 0
+        loaded = False
+        while not self.__stop.is_set():
+            wakeup = None
+            if time() >= nextScan:
+                try:
+                    self.scan()
+                    self.__accounts.updateDirectory()
+                    loaded = True
+                    nextScan = time() + self.__rescan
+                except Exception as e:
+                    logging.error("scan failed, retry in %d seconds: %s", self.__retry, getattr(e, "msg", e))
+                    nextScan = time() + self.__retry
+                logging.info("managing %d certificates", self.pending())
+            try:
+                if loaded:
+                    self.renewDue()
+            except Exception as e:
+                logging.error("renewal failed, retry in %d seconds: %s", self.__retry, getattr(e, "msg", e))
+                wakeup = time() + self.__retry
+            if self.__report is not None:
+                self.__report()
+            if wakeup is None:
+                wakeup = nextScan
+                due = self.nextDue()
+                if due is not None:
+                    wakeup = min(wakeup, due)
+            self.__stop.wait(max(0, min(wakeup, nextScan) - time()))
+
+    def stop(self):
+        """
+        Stops the daemon after the renewals currently running.
+        """
+        self.__stop.set()
+
+    def __schedule(self, crtFile, csrFile, mtime, due):
+        """
+        Schedules the renewal of a certificate. A former schedule of the
+        certificate is superseded.
+
+        @param crtFile: The certificate file.
+        @param csrFile: The CSR file.
+        @param mtime: Modification time of the certificate file.
+        @param due: Unix timestamp the renewal is due.
+        """
+        self.__seq += 1
+        self.__entries[crtFile] = {"csr" : csrFile, "mtime" : mtime, "seq" : self.__seq}
+        heappush(self.__heap, (due, self.__seq, crtFile))
+
+    def __dropStale(self):
+        """
+        Drops heap entries of removed or rescheduled certificates.
+        """
+        while len(self.__heap) > 0:
+            due, seq, crtFile = self.__heap[0]
+            entry = self.__entries.get(crtFile)
+            if entry is not None and entry["seq"] == seq:
+                return
+            heappop(self.__heap)
+
+class DaemonModule(object):
+    """
+    This module runs as daemon renewing all certificates of a directory tree
+    when they are due.
+    """
+    def __init__(self, argv):
+        """
+        Constructor.
+        """
+        if len(argv) < 1:
+            raise Exception("No module defined.")
+        self.__name = argv[0]
+        self.__argv = argv[1:]
+
+        if self.__name != "daemon":
+            raise Exception("unknown module name %s" % (self.__name))
+
+        shortopts = ["h"]
+        longopts = ["help", "userkey=", "certdir=", "base=", "webdir=", "days=", "workers=", "jitter=", "rescan="]
+        mandatory = ["--userkey", "--certdir"]
+        defaults = {"--base" : [config.BASE], "--webdir" : [config.WEBDIR], "--days" : [str(config.RENEW_DAYS)],
+                    "--workers" : [str(config.RENEW_WORKERS)], "--jitter" : [str(config.DAEMON_JITTER)],
+                    "--rescan" : [str(config.DAEMON_RESCAN)]}
+        self.__valid, self.__optsMap = getOpts(argv[1:], shortopts, longopts, mandatory, defaults)
+
+    def execute(self):
+        """
+        Executes the module.
+        """
+        if not self.__valid or any(x[0] in ["h", "help"] for x in self.__optsMap.keys()):
+            DaemonModule.printHelp(self.__name)
+            return 1
+
+        userKeyFiles = self.__optsMap["--userkey"]
+        for userKeyFile in userKeyFiles:
+            if not path.exists(userKeyFile) or not path.isfile(userKeyFile):
+                print "cannot open %s for reading" % (userKeyFile)
+                DaemonModule.printHelp(self.__name)
+                return 1
+
+        certDir = self.__optsMap["--certdir"][:1][0]
+        if not path.isdir(certDir):
+            print "cannot open directory %s" % (certDir)
+            DaemonModule.printHelp(self.__name)
+            return 1
+
+        base = self.__optsMap["--base"][-1]
+        webdir = self.__optsMap["--webdir"][-1]
+        days = int(self.__optsMap["--days"][-1])
+        workers = int(self.__optsMap["--workers"][-1])
+        jitter = int(self.__optsMap["--jitter"][-1])
+        rescan = int(self.__optsMap["--rescan"][-1])
+
+        # the directory is loaded by the daemon, which retries on errors
+        accounts = createAccountPool(base, userKeyFiles, webdir, False)
+        daemon = RenewalDaemon(accounts, certDir, days, workers, jitter, rescan, limiter = createRateLimiter(),
+                               store = createStateStore(), report = writeMetrics)
+        server = None
+        if config.METRICS_PORT is not None:
+            server = MetricsServer(createMetrics(), config.METRICS_PORT)
+            server.start()
+            print "serving metrics on http://127.0.0.1:%d/metrics" % (server.getPort())
+        signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+        print "renewal daemon started for %s" % (certDir)
+        try:
+            daemon.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            accounts.close()
+            if server is not None:
+                server.stop()
+        print "renewal daemon stopped"
+        return 0
+
+    @staticmethod
+    def describe(name):
+        """
+        Returns a short description of the module.
+        """
+        if name == "daemon":
+            return "daemon renewing all certificates of a directory when due"
+        raise Exception("unknown module name %s" % (name))
+
+    @staticmethod
+    def printHelp(name):
+        """
+        Shows the modules help.
+        """
+        print """module {0}
+parameters:
+    --help           - show help and exit
+    --userkey=<file> - the key of a user registered for ACME actions [mandatory]
+                       Note: give several keys to shard the certificates
+                       across several accounts by domain.
+    --certdir=<dir>  - directory tree containing the certificates [mandatory]
+                       Note: each certificate <name>.crt needs the CSR it has
+                       been issued for as <name>.csr in the same directory.
+    --days=<days>    - renew certificates this number of days before they
+                       expire [optional]
+    --workers=<n>    - number of certificates renewed concurrently [optional]
+    --jitter=<s>     - maximum delay added to spread renewals [optional]
+    --rescan=<s>     - seconds between two scans of the directory [optional]
+    --webdir=<dir>   - directory for http-based challenge [optional]
+    --base=<base>    - base address of the let's encrypt service [optional]
+                       Note: default values taken from config.py""".format(name)
@@ -16,12 +16,11 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
 #
 
-from modules import getOpts
+from modules import getOpts, createService, writeMetrics
 import config
 from os import path
 
-from config import KeyPair, HttpProvider, Authenticators, Certificate
-from letsencrypt import LeService
+from config import KeyPair
 
 class RegisterModule(object):
     """
@@ -54,27 +53,63 @@ class RegisterModule(object):
             RegisterModule.printHelp(self.__name)
             return 1
         
-        userKeyFile = self.__optsMap["--userkey"][:1][0]
-        if not path.exists(userKeyFile) or not path.isfile(userKeyFile):
-            print "cannot open %s for reading" % (userKeyFile)
-            RegisterModule.printHelp(self.__name)
-            return 1
+        userKeyFiles = self.__optsMap["--userkey"]
+        for userKeyFile in userKeyFiles:
+            if not path.exists(userKeyFile) or not path.isfile(userKeyFile):
+                print "cannot open %s for reading" % (userKeyFile)
+                RegisterModule.printHelp(self.__name)
+                return 1
         
         base = self.__optsMap["--base"][:1][0]
         terms = self.__optsMap["--terms"][:1][0]
         mail = self.__optsMap["--mail"][:1][0]
+        # terms given on the commandline follow the default
+        agreed = self.__optsMap["--terms"][1:]
+        
+        for userKeyFile in userKeyFiles:
+            if len(userKeyFiles) > 1:
+                print "register %s" % (userKeyFile)
+            userKey = KeyPair()
+            userKey.load(open(userKeyFile, "r"))
+            le = createService(base, userKey)
+            try:
+                registered = self.__register(le, mail, terms, agreed)
+            finally:
+                le.close()
+                writeMetrics()
+            if not registered:
+                return 1
+
+    def __register(self, le, mail, terms, agreed):
+        """
+        Registers the user-key of the service given.
+        
+        On ACME v2 the terms of service named by the directory must be agreed
+        explicitly by giving their url with --terms. Otherwise the url is
+        printed and the registration is refused.
         
-        userKey = KeyPair()
-        userKey.load(open(userKeyFile, "r"))
-        le = LeService(base, HttpProvider, Authenticators, Certificate)
-        le.setUserKey(userKey)
-        le.updateDirectory()
-        regResp = le.newReg(le.createMailContact(mail), terms)
+        @param le: The LeService using the user-key to be registered.
+        @param mail: The mail address of the contact.
+        @param terms: The terms to be agreed on ACME v1.
+        @param agreed: List of the terms given on the commandline.
+        @return: True, if the registration has been performed.
+        """
+        if le.isV2():
+            tos = le.getTermsOfService()
+            if tos is not None and tos not in agreed:
+                print "the ACME service requires to agree to the terms of service at"
+                print "    %s" % (tos)
+                print "pass --terms=%s to agree" % (tos)
+                return False
+            regResp = le.newAccount(le.createMailContact(mail), tos is not None)
+        else:
+            regResp = le.newReg(le.createMailContact(mail), terms)
         if not regResp.success:
             print "user seems already been known to the ACME service"
         else:
             print "registered now user to ACME service"
         print "profile address: %s" % (regResp.location)
+        return True
 
         
     @staticmethod
@@ -95,8 +130,10 @@ class RegisterModule(object):
 parameters:
     --help           - show help and exit
     --userkey=<file> - the key to be registered for ACME [mandatory]
+                       Note: give several keys to register a pool of accounts
     --mail=<mail>    - mailaddress to associate with the key [mandatory]
     --base=<base>    - base address of the let's encrypt service [optional
                        Note: default value taken from config.py
     --terms=<terms>  - url of the terms and conditions to agree [optional]
-                       Note: default value taken from config.py""".format(name)
+                       Note: default value taken from config.py for ACME v1,
+                       ACME v2 requires the url named by the service""".format(name)
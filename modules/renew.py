@@ -0,0 +1,339 @@
+# yalec - Yet Another Let's Encrypt Client
+# Copyright (C) 2016 Falk Garbsch
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+from modules import getOpts, createAccountPool, createRateLimiter, createStateStore, createJournal, writeMetrics
+import config
+from os import path, walk, fdopen, chmod, rename, remove, stat
+from tempfile import mkstemp
+from threading import Thread
+from Queue import Queue, Empty
+from time import time, ctime
+
+import logging
+
+from config import Certificate, CertificateSigningRequest
+from letsencrypt import LeException, LeRateLimitException
+from letsencrypt.ratelimit import isFailedValidation
+from letsencrypt.tracing import span
+
+def findCertificates(directory):
+    """
+    Scans the given directory tree for certificates to be renewed. Each
+    certificate <name>.crt needs the CSR it was issued for as <name>.csr
+    within the same directory.
+
+    @param directory: The root of the directory tree.
+    @return: List of pairs of certificate and CSR file names.
+    """
+    rc = []
+    for dirpath, dirnames, filenames in walk(directory):
+        for filename in sorted(filenames):
+            if not filename.endswith(".crt"):
+                continue
+            crtFile = path.join(dirpath, filename)
+            csrFile = crtFile[:-4] + ".csr"
+            if not path.isfile(csrFile):
+                logging.warning("no CSR found for %s, skip it", crtFile)
+                continue
+            rc.append((crtFile, csrFile))
+    return rc
+
+def getNotAfter(crtFile, store = None):
+    """
+    Reads the end of the validity of a certificate file.
+
+    If a StateStore is given, the date stored for the file is used as long
+    as the file has not been modified, so unchanged certificates are not
+    parsed again on each run. Otherwise the file is parsed and stored.
+
+    @param crtFile: The certificate file in PEM format.
+    @param store: A StateStore or None. Optional.
+    @return: The notAfter date as unix timestamp.
+    @raise Exception: If the certificate cannot be read.
+    """
+    mtime = stat(crtFile).st_mtime
+    if store is not None:
+        stored = store.getCertificate(crtFile)
+        if stored is not None and stored[0] == mtime:
+            return stored[1]
+    cert = Certificate()
+    fp = open(crtFile, "r")
+    try:
+        cert.load(fp)
+    finally:
+        fp.close()
+    notAfter = cert.getNotAfter()
+    if store is not None:
+        store.putCertificate(crtFile, mtime, notAfter, cert.getDnsNames())
+    return notAfter
+
+def loadCsr(csrFile):
+    """
+    Reads a CSR file.
+
+    @param csrFile: The CSR file in PEM format.
+    @return: The CSR.
+    @raise Exception: If the CSR cannot be read.
+    """
+    csr = CertificateSigningRequest()
+    fp = open(csrFile, "r")
+    try:
+        csr.load(fp)
+    finally:
+        fp.close()
+    return csr
+
+def renewCertificate(le, crtFile, csr):
+    """
+    Requests a new certificate for the CSR and replaces the certificate file
+    atomically, so the old certificate stays in place on any error. The new
+    file keeps the permissions of the old one. The issuance is journaled, so
+    a renewal interrupted is resumed next time.
+
+    @param le: The LeService to be used.
+    @param crtFile: The certificate file to be replaced.
+    @param csr: The CSR the certificate is issued for.
+    @raise Exception: Raises an exception on each error.
+    """
+    identifiers = [le.createDnsAuth(x) for x in csr.getDnsNames()]
+    journal = createJournal(csr)
+    if le.isV2():
+        cert = le.orderCert(identifiers, csr, journal)
+    else:
+        le.multiAuthz(identifiers, journal)
+        cert = le.newCert(csr, journal)
+    fd, tmpName = mkstemp(dir = path.dirname(crtFile))
+    try:
+        fp = fdopen(fd, "w")
+        cert.toPem(fp)
+        fp.close()
+        # mkstemp creates the file readable by the owner only
+        chmod(tmpName, stat(crtFile).st_mode & 0777)
+        rename(tmpName, crtFile)
+    except:
+        remove(tmpName)
+        raise
+    if journal is not None:
+        journal.remove()
+
+def renewAll(accounts, jobs, workers, limiter = None, store = None):
+    """
+    Renews the given certificates using a bounded number of worker threads
+    sharing the LeService instances, their directory, nonces and
+    connections. Each certificate is requested by the account its domain is
+    sharded to.
+
+    If a RateLimitScheduler is given, certificates that would exceed a rate
+    limit of the ACME server are deferred instead of being requested. If a
+    StateStore is given, each renewal is recorded as job and the data stored
+    for the renewed certificates is dropped.
+
+    @param accounts: The AccountPool to be used.
+    @param jobs: List of pairs of certificate and CSR file names.
+    @param workers: Maximum number of certificates renewed concurrently.
+    @param limiter: A RateLimitScheduler or None. Optional.
+    @param store: A StateStore or None. Optional.
+    @return: Pair of the list of certificate files that could not be
+        renewed and a dict mapping the certificate files deferred to the
+        unix timestamp they may be renewed.
+    """
+    queue = Queue()
+    for job in jobs:
+        queue.put(job)
+    failed = []
+    deferred = {}
+
+    def work():
+        while True:
+            try:
+                crtFile, csrFile = queue.get_nowait()
+            except Empty:
+                return
+            with span("renew", {"cert.file" : crtFile}) as job:
+                renewJob(job, crtFile, csrFile)
+
+    def renewJob(job, crtFile, csrFile):
+        names = []
+        account = None
+        jobId = None
+        if store is not None:
+            jobId = store.startJob(crtFile)
+        status, detail = "done", None
+        try:
+            csr = loadCsr(csrFile)
+            names = csr.getDnsNames()
+            account, le = accounts.select(names)
+            job.setAttribute("acme.domains", names)
+            job.setAttribute("acme.account", account)
+            if limiter is not None:
+                wait = limiter.acquire(names, account)
+                if wait > 0:
+                    logging.info("defer renewal of %s by %d seconds", crtFile, wait)
+                    deferred[crtFile] = time() + wait
+                    status, detail = "deferred", "rate limits exceeded"
+                    return
+            logging.info("renew %s using account %s", crtFile, account)
+            renewCertificate(le, crtFile, csr)
+            if limiter is not None:
+                limiter.issued(names, account)
+            if store is not None:
+                # stored again by the next getNotAfter
+                store.removeCertificate(crtFile)
+        except LeRateLimitException as e:
+            logging.warning("renewal of %s rate limited: %s", crtFile, e.msg)
+            status, detail = "deferred", e.msg
+            deferred[crtFile] = time() + (e.retryAfter or 0)
+            if limiter is not None:
+                deferred[crtFile] = limiter.backoff(names, account, e.retryAfter, e.data.get("detail", ""))
+        except Exception as e:
+            logging.error("renewal of %s failed: %s", crtFile, getattr(e, "msg", e))
+            status, detail = "failed", str(getattr(e, "msg", e))
+            failed.append(crtFile)
+            if limiter is not None and isinstance(e, LeException) and isFailedValidation(e.data):
+                limiter.failed(names, account)
+        finally:
+            job.setAttribute("renew.status", status)
+            if status == "failed":
+                job.setError(detail)
+            if jobId is not None:
+                store.finishJob(jobId, status, detail, account)
+
+    threads = [Thread(target = work) for I in range(min(workers, len(jobs)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return failed, deferred
+
+class RenewModule(object):
+    """
+    This module renews all certificates of a directory tree that expire
+    within a given number of days.
+    """
+    def __init__(self, argv):
+        """
+        Constructor.
+        """
+        if len(argv) < 1:
+            raise Exception("No module defined.")
+        self.__name = argv[0]
+        self.__argv = argv[1:]
+
+        if self.__name != "renew":
+            raise Exception("unknown module name %s" % (self.__name))
+
+        shortopts = ["h"]
+        longopts = ["help", "userkey=", "certdir=", "base=", "webdir=", "days=", "workers=", "dry-run"]
+        mandatory = ["--userkey", "--certdir"]
+        defaults = {"--base" : [config.BASE], "--webdir" : [config.WEBDIR], "--days" : [str(config.RENEW_DAYS)],
+                    "--workers" : [str(config.RENEW_WORKERS)]}
+        self.__valid, self.__optsMap = getOpts(argv[1:], shortopts, longopts, mandatory, defaults)
+
+    def execute(self):
+        """
+        Executes the module.
+        """
+        if not self.__valid or any(x[0] in ["h", "help"] for x in self.__optsMap.keys()):
+            RenewModule.printHelp(self.__name)
+            return 1
+
+        userKeyFiles = self.__optsMap["--userkey"]
+        for userKeyFile in userKeyFiles:
+            if not path.exists(userKeyFile) or not path.isfile(userKeyFile):
+                print "cannot open %s for reading" % (userKeyFile)
+                RenewModule.printHelp(self.__name)
+                return 1
+
+        certDir = self.__optsMap["--certdir"][:1][0]
+        if not path.isdir(certDir):
+            print "cannot open directory %s" % (certDir)
+            RenewModule.printHelp(self.__name)
+            return 1
+
+        base = self.__optsMap["--base"][-1]
+        webdir = self.__optsMap["--webdir"][-1]
+        days = int(self.__optsMap["--days"][-1])
+        workers = int(self.__optsMap["--workers"][-1])
+
+        store = createStateStore()
+        limit = time() + days * 86400
+        jobs = []
+        for crtFile, csrFile in findCertificates(certDir):
+            try:
+                notAfter = getNotAfter(crtFile, store)
+            except Exception as e:
+                print "cannot read %s: %s" % (crtFile, e)
+                continue
+            if notAfter < limit:
+                jobs.append((crtFile, csrFile))
+        print "%d certificates to be renewed" % (len(jobs))
+        if "--dry-run" in self.__optsMap or len(jobs) == 0:
+            for crtFile, csrFile in jobs:
+                print "    %s" % (crtFile)
+            return 0
+
+        accounts = createAccountPool(base, userKeyFiles, webdir)
+        try:
+            failed, deferred = renewAll(accounts, jobs, workers, createRateLimiter(), store)
+        finally:
+            accounts.close()
+            writeMetrics()
+        print "renewed %d certificates" % (len(jobs) - len(failed) - len(deferred))
+        if len(deferred) > 0:
+            print "deferred because of rate limits:"
+            for crtFile, notBefore in sorted(deferred.items()):
+                print "    %s until %s" % (crtFile, ctime(notBefore))
+        if len(failed) > 0:
+            print "failed to renew:"
+            for crtFile in failed:
+                print "    %s" % (crtFile)
+            return 1
+        return 0
+
+    @staticmethod
+    def describe(name):
+        """
+        Returns a short description of the module.
+        """
+        if name == "renew":
+            return "renews all certificates of a directory that expire soon"
+        raise Exception("unknown module name %s" % (name))
+
+    @staticmethod
+    def printHelp(name):
+        """
+        Shows the modules help.
+        """
+        print """module {0}
+parameters:
+    --help           - show help and exit
+    --userkey=<file> - the key of a user registered for ACME actions [mandatory]
+                       Note: give several keys to shard the certificates
+                       across several accounts by domain.
+    --certdir=<dir>  - directory tree containing the certificates [mandatory]
+                       Note: each certificate <name>.crt needs the CSR it has
+                       been issued for as <name>.csr in the same directory.
+    --days=<days>    - renew certificates expiring within these days [optional]
+                       Note: default value taken from config.py
+    --workers=<n>    - number of certificates renewed concurrently [optional]
+                       Note: default value taken from config.py
+    --dry-run        - only list the certificates to be renewed [optional]
+    --webdir=<dir>   - directory for http-based challenge [optional]
+                       Note: default value taken from config.py
+    --base=<base>    - base address of the let's encrypt service [optional
+                       Note: default value taken from config.py""".format(name)
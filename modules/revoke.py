@@ -16,12 +16,11 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
 #
 
-from modules import getOpts
+from modules import getOpts, createService, writeMetrics
 import config
 from os import path
 
-from config import KeyPair, HttpProvider, Authenticators, Certificate, CertificateSigningRequest
-from letsencrypt import LeService
+from config import KeyPair, Certificate
 
 class RevokeModule(object):
     """
@@ -73,10 +72,12 @@ class RevokeModule(object):
         cert.load(open(certFile, "r"))
 
         print "revoke certificate"
-        le = LeService(base, HttpProvider, Authenticators, Certificate)
-        le.setUserKey(userKey)
-        le.updateDirectory()
-        le.revokeCert(cert)
+        le = createService(base, userKey)
+        try:
+            le.revokeCert(cert)
+        finally:
+            le.close()
+            writeMetrics()
         print "done"
 
     @staticmethod
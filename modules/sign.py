@@ -16,12 +16,11 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
 #
 
-from modules import getOpts
+from modules import getOpts, createService, createJournal, writeMetrics
 import config
 from os import path
 
-from config import KeyPair, HttpProvider, Authenticators, Certificate, CertificateSigningRequest
-from letsencrypt import LeService
+from config import KeyPair, CertificateSigningRequest
 
 class SignModule(object):
     """
@@ -77,21 +76,29 @@ class SignModule(object):
         csr = CertificateSigningRequest()
         csr.load(open(csrFile, "r"))
 
-        le = LeService(base, HttpProvider, Authenticators, Certificate)
-        le.setUserKey(userKey)
-        le.setConfigEntry("WEBDIR", webdir)
-        le.updateDirectory()
+        le = createService(base, userKey, webdir)
+        journal = createJournal(csr)
         
-        for domain in self.__optsMap["--domain"]:
-            print "perform authentication for domain %s" % (domain)
-            le.simpleAuthz(le.createDnsAuth(domain))
-        print "request certificate for csr"
-        cert = le.newCert(csr)
+        domains = self.__optsMap["--domain"]
+        try:
+            if le.isV2():
+                print "order certificate for domains %s" % (", ".join(domains))
+                cert = le.orderCert([le.createDnsAuth(x) for x in domains], csr, journal)
+            else:
+                print "perform authentication for domains %s" % (", ".join(domains))
+                le.multiAuthz([le.createDnsAuth(x) for x in domains], journal)
+                print "request certificate for csr"
+                cert = le.newCert(csr, journal)
+        finally:
+            le.close()
+            writeMetrics()
         
         print "save certificate to %s" % (certout)
         cert.toPem(fp)
         fp.flush()
         fp.close()
+        if journal is not None:
+            journal.remove()
         print "done"
         
     @staticmethod
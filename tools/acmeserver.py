@@ -0,0 +1,571 @@
+# yalec - Yet Another Let's Encrypt Client
+# Copyright (C) 2016 Falk Garbsch
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+# A local stand-in for an ACME server speaking the protocol implemented by the
+# LeService. ACME v1 is served at /directory, ACME v2 (RFC 8555) at
+# /v2/directory. It does not validate any challenge and issues throwaway
+# certificates, so it must only be used for testing and load measurements.
+
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from base64 import urlsafe_b64decode, b64encode
+from hashlib import sha256
+from threading import Lock
+from sys import argv, exit
+from time import time, sleep, gmtime, strftime
+import getopt
+import json
+import os
+import random
+import re
+
+try:
+    from OpenSSL import crypto
+except ImportError:
+    crypto = None
+
+def jwsDecode(data):
+    """
+    Decodes a part of a JWS encoded as urlsafe base64 without padding.
+
+    @param data: The encoded data.
+    @return: The decoded data.
+    """
+    data = str(data)
+    return urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+class AcmeState(object):
+    """
+    Keeps the state of the stand-in server: issued nonces, registrations,
+    authorizations and certificates.
+    """
+    def __init__(self, options):
+        """
+        Constructor.
+
+        @param options: Dict of server options as created by parseOptions.
+        """
+        self.options = options
+        self.lock = Lock()
+        self.nonces = set()
+        self.nonceCounter = 0
+        self.regs = {}
+        self.authzs = {}
+        self.orders = {}
+        self.certs = {}
+        self.issued = []
+        self.ca = None
+        if crypto is not None:
+            self.ca = crypto.PKey()
+            self.ca.generate_key(crypto.TYPE_RSA, 2048)
+
+    def newNonce(self):
+        """
+        Creates a new nonce.
+
+        @return: The nonce.
+        """
+        with self.lock:
+            self.nonceCounter += 1
+            nonce = sha256("%d-%f" % (self.nonceCounter, random.random())).hexdigest()[:32]
+            self.nonces.add(nonce)
+            return nonce
+
+    def useNonce(self, nonce):
+        """
+        Consumes a nonce.
+
+        @param nonce: The nonce provided by the client.
+        @return: True, if the nonce has been issued and was not used before.
+        """
+        with self.lock:
+            if nonce not in self.nonces:
+                return False
+            self.nonces.remove(nonce)
+            return True
+
+    def rateLimited(self):
+        """
+        Checks and counts the certificate rate limit.
+
+        @return: Number of seconds until the next certificate can be issued or
+            0, if issuance is allowed.
+        """
+        limit = self.options["rate-limit"]
+        window = self.options["rate-window"]
+        if limit <= 0:
+            return 0
+        now = time()
+        with self.lock:
+            self.issued = [x for x in self.issued if x > now - window]
+            if len(self.issued) >= limit:
+                return int(self.issued[0] + window - now) + 1
+            self.issued.append(now)
+        return 0
+
+    def createCert(self, csrDer):
+        """
+        Creates a throwaway certificate for the given CSR.
+
+        Without pyopenssl, the CSR itself is returned as certificate data.
+
+        @param csrDer: The CSR in DER format.
+        @return: The certificate in DER format.
+        """
+        if crypto is None:
+            return csrDer
+        req = crypto.load_certificate_request(crypto.FILETYPE_ASN1, csrDer)
+        cert = crypto.X509()
+        cert.set_version(2)
+        cert.set_serial_number(random.getrandbits(63))
+        cert.get_subject().CN = req.get_subject().CN or "yalec test"
+        cert.get_issuer().CN = "yalec acmeserver fake CA"
+        cert.gmtime_adj_notBefore(0)
+        cert.gmtime_adj_notAfter(self.options["validity"] * 86400)
+        cert.set_pubkey(req.get_pubkey())
+        cert.add_extensions(req.get_extensions())
+        cert.sign(self.ca, "sha256")
+        return crypto.dump_certificate(crypto.FILETYPE_ASN1, cert)
+
+    def newAuthz(self, identifier, base, v2 = False):
+        """
+        Creates a new pending authorization with a http-01 challenge.
+
+        @param identifier: The identifier to be authorized.
+        @param base: Base address of the server as seen by the client.
+        @param v2: Create an ACME v2 authorization.
+        @return: The internal authorization.
+        """
+        with self.lock:
+            authzId = len(self.authzs) + 1
+            token = b64encode(os.urandom(32)).replace("+", "-").replace("/", "_").rstrip("=")
+            challenge = {"type" : "http-01", "status" : "pending", "token" : token}
+            if v2:
+                challenge["url"] = "%s/challenge/%d" % (base, authzId)
+            else:
+                challenge["uri"] = "%s/acme/challenge/%d/0" % (base, authzId)
+            authz = {"id" : authzId, "identifier" : identifier, "status" : "pending",
+                     "triggered" : False, "polls" : 0,
+                     "expires" : strftime("%Y-%m-%dT%H:%M:%SZ", gmtime(time() + 7 * 86400)),
+                     "challenges" : [challenge]}
+            self.authzs[authzId] = authz
+        return authz
+
+    def pollAuthz(self, authz):
+        """
+        Counts a poll on a triggered authorization. The authorization becomes
+        valid after the configured number of polls.
+
+        @param authz: The internal authorization.
+        """
+        with self.lock:
+            if authz["triggered"] and authz["status"] == "pending":
+                authz["polls"] += 1
+                if authz["polls"] > self.options["pending-polls"]:
+                    authz["status"] = "valid"
+                    authz["challenges"][0]["status"] = "valid"
+
+class AcmeHandler(BaseHTTPRequestHandler):
+    """
+    Request handler of the stand-in server.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        """
+        Answers HEAD requests with a fresh nonce.
+        """
+        self.__delay()
+        self.__send(200, None)
+
+    def do_GET(self):
+        """
+        Handles GET requests.
+        """
+        self.__delay()
+        state = self.server.state
+        path = self.path
+        if path == "/v2/directory":
+            base = self.__base() + "/v2"
+            directory = json.dumps({"newNonce" : base + "/new-nonce", "newAccount" : base + "/new-account",
+                                    "newOrder" : base + "/new-order", "revokeCert" : base + "/revoke-cert",
+                                    "meta" : {"termsOfService" : base + "/terms"}})
+            self.__send(200, directory, [("Content-Type", "application/json")])
+            return
+        if path == "/directory":
+            base = self.__base()
+            directory = json.dumps({"new-reg" : base + "/acme/new-reg", "new-authz" : base + "/acme/new-authz",
+                                    "new-cert" : base + "/acme/new-cert", "revoke-cert" : base + "/acme/revoke-cert"})
+            etag = '"%s"' % (sha256(directory).hexdigest()[:16])
+            if self.headers.getheader("If-None-Match") == etag:
+                self.__send(304, None, [("ETag", etag)])
+                return
+            self.__send(200, directory, [("ETag", etag), ("Content-Type", "application/json")])
+            return
+        m = re.match("^/acme/(authz|challenge)/([0-9]+)(/0)?$", path)
+        if m and int(m.group(2)) in state.authzs:
+            authz = state.authzs[int(m.group(2))]
+            state.pollAuthz(authz)
+            retry = [("Retry-After", str(state.options["retry-after"]))] if authz["status"] == "pending" else []
+            if m.group(1) == "authz":
+                self.__send(200, self.__authzStructure(authz), retry)
+            else:
+                self.__send(200, authz["challenges"][0], retry)
+            return
+        m = re.match("^/acme/cert/([0-9]+)$", path)
+        if m and int(m.group(1)) in state.certs:
+            cert = state.certs[int(m.group(1))]
+            with state.lock:
+                cert["polls"] += 1
+                ready = cert["polls"] > state.options["cert-polls"]
+            if not ready:
+                self.__send(202, None, [("Retry-After", str(state.options["retry-after"]))])
+                return
+            self.__send(200, cert["der"], [("Content-Type", "application/pkix-cert")])
+            return
+        self.__problem(404, "malformed", "unknown resource %s" % (path))
+
+    def do_POST(self):
+        """
+        Handles POST requests. All POST requests need to be signed and carry a
+        valid nonce.
+        """
+        self.__delay()
+        state = self.server.state
+        length = int(self.headers.getheader("Content-Length", 0))
+        body = self.rfile.read(length)
+        try:
+            protected, payload = self.__parseJws(body)
+        except Exception as e:
+            self.__problem(400, "malformed", "cannot parse JWS: %s" % (e))
+            return
+        if not state.useNonce(protected.get("nonce")) or random.random() < state.options["bad-nonce-rate"]:
+            self.__problem(400, "badNonce", "JWS has invalid anti-replay nonce")
+            return
+        if random.random() < state.options["error-rate"]:
+            self.__problem(500, "serverInternal", "injected error")
+            return
+        if self.path.startswith("/v2/"):
+            self.__postV2(protected, payload)
+            return
+        resource = payload.get("resource")
+        base = self.__base()
+        if self.path == "/acme/new-reg" and resource == "new-reg":
+            thumbprint = sha256(json.dumps(protected.get("jwk"), sort_keys = True)).hexdigest()
+            with state.lock:
+                known = thumbprint in state.regs
+                if not known:
+                    state.regs[thumbprint] = len(state.regs) + 1
+                regId = state.regs[thumbprint]
+            location = [("Location", "%s/acme/reg/%d" % (base, regId))]
+            if known:
+                self.__problem(409, "malformed", "registration key is already in use", location)
+                return
+            self.__send(201, {"id" : regId, "contact" : payload.get("contact", []), "agreement" : payload.get("agreement")}, location)
+            return
+        if self.path == "/acme/new-authz" and resource == "new-authz":
+            authz = state.newAuthz(payload["identifier"], base)
+            self.__send(201, self.__authzStructure(authz), [("Location", "%s/acme/authz/%d" % (base, authz["id"]))])
+            return
+        m = re.match("^/acme/challenge/([0-9]+)/0$", self.path)
+        if m and resource == "challenge" and int(m.group(1)) in state.authzs:
+            authz = state.authzs[int(m.group(1))]
+            with state.lock:
+                authz["triggered"] = True
+                authz["challenges"][0]["keyAuthorization"] = payload.get("keyAuthorization")
+            self.__send(202, authz["challenges"][0])
+            return
+        if self.path == "/acme/new-cert" and resource == "new-cert":
+            retry = state.rateLimited()
+            if retry > 0:
+                self.__problem(429, "rateLimited", "too many certificates issued recently", [("Retry-After", str(retry))])
+                return
+            der = state.createCert(jwsDecode(payload["csr"]))
+            with state.lock:
+                certId = len(state.certs) + 1
+                state.certs[certId] = {"der" : der, "polls" : 0}
+            self.__send(201, der, [("Location", "%s/acme/cert/%d" % (base, certId)), ("Content-Type", "application/pkix-cert")])
+            return
+        if self.path == "/acme/revoke-cert" and resource == "revoke-cert":
+            self.__send(200, None)
+            return
+        self.__problem(404, "malformed", "unknown resource %s" % (self.path))
+
+    def __postV2(self, protected, payload):
+        """
+        Handles ACME v2 POST and POST-as-GET requests. Except for
+        newAccount, requests must carry the account url as key id.
+
+        @param protected: The protected header of the JWS.
+        @param payload: The payload of the JWS, None for POST-as-GET.
+        """
+        state = self.server.state
+        base = self.__base() + "/v2"
+        if self.path == "/v2/new-account":
+            thumbprint = sha256(json.dumps(protected.get("jwk"), sort_keys = True)).hexdigest()
+            with state.lock:
+                known = thumbprint in state.regs
+                if not known and not payload.get("onlyReturnExisting", False):
+                    state.regs[thumbprint] = len(state.regs) + 1
+                regId = state.regs.get(thumbprint)
+            if regId is None:
+                self.__problem(400, "accountDoesNotExist", "no account for this key")
+                return
+            account = {"status" : "valid", "contact" : payload.get("contact", [])}
+            self.__send(200 if known else 201, account, [("Location", "%s/account/%d" % (base, regId))])
+            return
+        m = re.match("^%s/account/([0-9]+)$" % (re.escape(base)), protected.get("kid", ""))
+        if not m or int(m.group(1)) not in state.regs.values():
+            self.__problem(400, "accountDoesNotExist", "unknown key id")
+            return
+        if self.path == "/v2/new-order":
+            authzs = [state.newAuthz(x, base, True) for x in payload["identifiers"]]
+            with state.lock:
+                orderId = len(state.orders) + 1
+                order = {"status" : "pending", "identifiers" : payload["identifiers"], "polls" : 0,
+                         "authzs" : authzs, "finalize" : "%s/finalize/%d" % (base, orderId)}
+                state.orders[orderId] = order
+            self.__send(201, self.__orderStructure(order, base, orderId), [("Location", "%s/order/%d" % (base, orderId))])
+            return
+        m = re.match("^/v2/(authz|challenge)/([0-9]+)$", self.path)
+        if m and int(m.group(2)) in state.authzs:
+            authz = state.authzs[int(m.group(2))]
+            if m.group(1) == "challenge":
+                with state.lock:
+                    authz["triggered"] = True
+                self.__send(200, authz["challenges"][0])
+                return
+            state.pollAuthz(authz)
+            retry = [("Retry-After", str(state.options["retry-after"]))] if authz["status"] == "pending" else []
+            self.__send(200, {"identifier" : authz["identifier"], "status" : authz["status"],
+                              "expires" : authz["expires"], "challenges" : authz["challenges"]}, retry)
+            return
+        m = re.match("^/v2/(order|finalize|cert)/([0-9]+)$", self.path)
+        if m and int(m.group(2)) in state.orders:
+            orderId = int(m.group(2))
+            order = state.orders[orderId]
+            with state.lock:
+                if order["status"] == "pending" and all(x["status"] == "valid" for x in order["authzs"]):
+                    order["status"] = "ready"
+            if m.group(1) == "finalize":
+                if order["status"] != "ready":
+                    self.__problem(403, "orderNotReady", "order is %s" % (order["status"]))
+                    return
+                retry = state.rateLimited()
+                if retry > 0:
+                    self.__problem(429, "rateLimited", "too many certificates issued recently", [("Retry-After", str(retry))])
+                    return
+                order["der"] = state.createCert(jwsDecode(payload["csr"]))
+                order["status"] = "processing"
+            elif m.group(1) == "order":
+                with state.lock:
+                    if order["status"] == "processing":
+                        order["polls"] += 1
+                        if order["polls"] > state.options["cert-polls"]:
+                            order["status"] = "valid"
+            elif order["status"] == "valid":
+                pem = "\n".join(re.findall(".{1,64}", b64encode(order["der"])))
+                pem = "-----BEGIN CERTIFICATE-----\n%s\n-----END CERTIFICATE-----\n" % (pem)
+                self.__send(200, pem, [("Content-Type", "application/pem-certificate-chain")])
+                return
+            retry = [("Retry-After", str(state.options["retry-after"]))] if order["status"] == "processing" else []
+            self.__send(200, self.__orderStructure(order, base, orderId), [("Location", "%s/order/%d" % (base, orderId))] + retry)
+            return
+        if self.path == "/v2/revoke-cert":
+            self.__send(200, None)
+            return
+        self.__problem(404, "malformed", "unknown resource %s" % (self.path))
+
+    def log_message(self, fmt, *args):
+        """
+        Only logs requests if the server runs verbosely.
+        """
+        if self.server.state.options["verbose"]:
+            BaseHTTPRequestHandler.log_message(self, fmt, *args)
+
+    def __parseJws(self, body):
+        """
+        Parses a JWS in compact or flattened JSON serialization. The signature
+        is not verified.
+
+        @param body: The request body.
+        @return: Pair of protected header and payload.
+        """
+        if body.startswith("{"):
+            structure = json.loads(body)
+            parts = [structure["protected"], structure["payload"]]
+        else:
+            parts = body.split(".")[:2]
+        protected = json.loads(jwsDecode(parts[0]))
+        payload = json.loads(jwsDecode(parts[1])) if len(parts[1]) > 0 else None
+        return protected, payload
+
+    def __authzStructure(self, authz):
+        """
+        Returns the public structure of an authorization.
+
+        @param authz: The internal authorization.
+        @return: Structure to be sent to the client.
+        """
+        return {"identifier" : authz["identifier"], "status" : authz["status"], "expires" : authz["expires"],
+                "challenges" : authz["challenges"], "combinations" : [[0]]}
+
+    def __orderStructure(self, order, base, orderId):
+        """
+        Returns the public structure of an ACME v2 order.
+
+        @param order: The internal order.
+        @param base: Base address of the ACME v2 resources.
+        @param orderId: The id of the order.
+        @return: Structure to be sent to the client.
+        """
+        structure = {"status" : order["status"], "identifiers" : order["identifiers"], "finalize" : order["finalize"],
+                     "authorizations" : ["%s/authz/%d" % (base, x["id"]) for x in order["authzs"]]}
+        if order["status"] == "valid":
+            structure["certificate"] = "%s/cert/%d" % (base, orderId)
+        return structure
+
+    def __base(self):
+        """
+        Returns the base address of the server as seen by the client.
+
+        @return: Base address.
+        """
+        return "http://%s" % (self.headers.getheader("Host", "localhost:%d" % (self.server.server_port)))
+
+    def __delay(self):
+        """
+        Delays the request by the configured latency.
+        """
+        options = self.server.state.options
+        latency = options["latency"] + random.uniform(0, options["jitter"])
+        if latency > 0:
+            sleep(latency / 1000.0)
+
+    def __problem(self, code, errorType, detail, moreHeader = []):
+        """
+        Sends an ACME problem document.
+
+        @param code: The HTTP status-code.
+        @param errorType: The ACME error type without namespace.
+        @param detail: The error message.
+        @param moreHeader: Additional headers as list of pairs.
+        """
+        namespace = "urn:ietf:params:acme:error" if self.path.startswith("/v2/") else "urn:acme:error"
+        problem = {"type" : "%s:%s" % (namespace, errorType), "detail" : detail, "status" : code}
+        self.__send(code, problem, [("Content-Type", "application/problem+json")] + moreHeader)
+
+    def __send(self, code, data, moreHeader = []):
+        """
+        Sends a response including a fresh nonce.
+
+        @param code: The HTTP status-code.
+        @param data: Structure to be sent as JSON, raw data or None.
+        @param moreHeader: Additional headers as list of pairs.
+        """
+        header = dict(moreHeader)
+        if data is None:
+            data = ""
+        elif not isinstance(data, str):
+            data = json.dumps(data)
+            header.setdefault("Content-Type", "application/json")
+        self.send_response(code)
+        self.send_header("Replay-Nonce", self.server.state.newNonce())
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in header.items():
+            self.send_header(k, v)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+class AcmeServer(ThreadingMixIn, HTTPServer):
+    """
+    Threaded HTTP server carrying the ACME state.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, options):
+        """
+        Constructor.
+
+        @param address: Pair of address and port to listen on.
+        @param options: Dict of server options as created by parseOptions.
+        """
+        HTTPServer.__init__(self, address, AcmeHandler)
+        self.state = AcmeState(options)
+
+OPTIONS = {"port" : ("4000", int), "bind" : ("127.0.0.1", str), "latency" : ("0", float), "jitter" : ("0", float),
+           "retry-after" : ("1", int), "pending-polls" : ("1", int), "cert-polls" : ("0", int),
+           "error-rate" : ("0", float), "bad-nonce-rate" : ("0", float), "rate-limit" : ("0", int),
+           "rate-window" : ("3600", int), "validity" : ("90", int)}
+
+def parseOptions(args):
+    """
+    Parses the commandline options.
+
+    @param args: The commandline arguments excluding the program name.
+    @return: Dict of options.
+    """
+    opts, rest = getopt.getopt(args, "hv", ["help", "verbose"] + ["%s=" % (x) for x in OPTIONS.keys()])
+    options = dict((k, t(v)) for k, (v, t) in OPTIONS.items())
+    options["verbose"] = False
+    for c, a in opts:
+        if c in ["-h", "--help"]:
+            printHelp()
+            exit(0)
+        if c in ["-v", "--verbose"]:
+            options["verbose"] = True
+            continue
+        options[c[2:]] = OPTIONS[c[2:]][1](a)
+    return options
+
+def printHelp():
+    """
+    Shows the help.
+    """
+    print """usage: {0} [options]
+
+Local ACME stand-in server for testing and load measurements. Challenges are
+not validated and certificates are issued by a throwaway CA (pyopenssl needed).
+
+options:
+    --port=<port>          - port to listen on (default 4000)
+    --bind=<address>       - address to listen on (default 127.0.0.1)
+    --latency=<ms>         - delay added to each request
+    --jitter=<ms>          - random delay added on top of the latency
+    --retry-after=<s>      - Retry-After sent while pending
+    --pending-polls=<n>    - polls an authz stays pending after the trigger
+    --cert-polls=<n>       - polls a certificate stays in processing
+    --error-rate=<p>       - probability of a serverInternal error
+    --bad-nonce-rate=<p>   - probability of a badNonce error
+    --rate-limit=<n>       - certificates allowed per rate window, 0 disables
+    --rate-window=<s>      - length of the rate window
+    --validity=<days>      - validity of issued certificates
+    --verbose              - log each request""".format(argv[0])
+
+def main(args):
+    options = parseOptions(args)
+    server = AcmeServer((options["bind"], options["port"]), options)
+    print "ACME stand-in listening on http://%s:%d/directory and /v2/directory" % (options["bind"], options["port"])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main(argv[1:])
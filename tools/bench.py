@@ -0,0 +1,377 @@
+# yalec - Yet Another Let's Encrypt Client
+# Copyright (C) 2016 Falk Garbsch
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+# Micro-benchmarks of the crypto, JWS and encoding code run for each ACME
+# request. The benchmarks work offline. Each one is timed in several rounds
+# and reported by median and interquartile range, so a single disturbed round
+# does not skew the result. Results are written as JSON and can be compared
+# against an earlier run to detect regressions.
+
+from cStringIO import StringIO
+from os import path
+from sys import argv, exit, version
+from time import time
+from timeit import Timer, default_timer
+import getopt
+import json
+import platform
+import re
+import sys
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+# payload and header of a typical ACME request
+PAYLOAD = {"resource" : "new-authz", "identifier" : {"type" : "dns", "value" : "www.example.com"}}
+HEADER = {"typ" : "JWT", "nonce" : "oFvnlFP1wIhRlYS2jTaXbA"}
+CERT_BEGIN = "-----BEGIN CERTIFICATE-----"
+CERT_END = "-----END CERTIFICATE-----"
+
+def encodingBenchmarks():
+    """
+    Benchmarks of the helpers of letsencrypt.encoding.
+
+    @return: List of pairs of benchmark name and setup function returning the
+        function to be timed.
+    """
+    def setup(name):
+        from letsencrypt import encoding
+        der = "".join([chr((i * 7) % 256) for i in range(1400)])
+        pem = "%s\n%s%s\n" % (CERT_BEGIN, encoding.toPem(der), CERT_END)
+        modulus = int("c3" * 256, 16)
+        dump = der * 3
+        return {"toPem" : lambda: encoding.toPem(der),
+                "fromPem" : lambda: encoding.fromPem(StringIO(pem), CERT_BEGIN, CERT_END),
+                "numberToBase64[2048]" : lambda: encoding.numberToBase64(modulus),
+                "dataToJwsBase64[32]" : lambda: encoding.dataToJwsBase64(der[:32]),
+                "dataToJwsBase64[1400]" : lambda: encoding.dataToJwsBase64(der),
+                "consoleCleanBinary" : lambda: encoding.consoleCleanBinary(dump),
+                "consoleCleanBinary[limit]" : lambda: encoding.consoleCleanBinary(dump, 512)}[name]
+    names = ["toPem", "fromPem", "numberToBase64[2048]", "dataToJwsBase64[32]", "dataToJwsBase64[1400]",
+             "consoleCleanBinary", "consoleCleanBinary[limit]"]
+    return [("encoding.%s" % (x), lambda x = x: setup(x)) for x in names]
+
+def headerBenchmarks():
+    """
+    Benchmarks of jws.header.process as run for each signature.
+
+    @return: List of pairs of benchmark name and setup function.
+    """
+    def setup(step):
+        import jws.header
+        header = dict(HEADER, alg = "HS256")
+        return lambda: jws.header.process({"header" : header, "key" : None, "signer" : None, "verifier" : None}, step)
+    return [("jws.header.process[%s]" % (x), lambda x = x: setup(x)) for x in ("sign", "verify")]
+
+def algorithmNames():
+    """
+    Lists the names of all algorithms routed by jws.algos.DEFAULT, e.g. HS256.
+
+    @return: List of algorithm names.
+    """
+    import jws.algos
+    rc = []
+    for route, endpoint in jws.algos.DEFAULT:
+        prefix = re.match(r"^\^(\w+)\(", route).group(1)
+        rc += ["%s%d" % (prefix, bits) for bits in endpoint.supported_bits]
+    return rc
+
+def jwsKeys(alg, rsaKey):
+    """
+    Returns the keys needed by an algorithm.
+
+    @param alg: The algorithm name, e.g. RS256.
+    @param rsaKey: Function returning the RSA key of 2048 bits.
+    @return: Pair of the signing and the verifying key.
+    """
+    prefix, bits = alg[:2], int(alg[2:])
+    if prefix == "HS":
+        return ("secret", "secret")
+    if prefix in ("RS", "PS"):
+        return (rsaKey(), rsaKey().publickey())
+    if prefix == "ES":
+        import ecdsa
+        curves = {256 : ecdsa.NIST256p, 384 : ecdsa.NIST384p, 512 : ecdsa.NIST521p}
+        key = ecdsa.SigningKey.generate(curves[bits])
+        return (key, key.get_verifying_key())
+    raise ValueError("unknown algorithm %s" % (alg))
+
+def jwsBenchmarks(rsaKey):
+    """
+    Benchmarks of jws.sign and jws.verify for each algorithm of
+    jws.algos.DEFAULT.
+
+    @param rsaKey: Function returning the RSA key of 2048 bits.
+    @return: List of pairs of benchmark name and setup function.
+    """
+    def setup(alg, step):
+        import jws
+        signingKey, verifyingKey = jwsKeys(alg, rsaKey)
+        header = dict(HEADER, alg = alg)
+        if step == "sign":
+            return lambda: jws.sign(header, PAYLOAD, signingKey)
+        signature = jws.sign(header, PAYLOAD, signingKey)
+        return lambda: jws.verify(header, PAYLOAD, signature, verifyingKey)
+    return [("jws.%s[%s]" % (step, alg), lambda alg = alg, step = step: setup(alg, step))
+            for alg in algorithmNames() for step in ("sign", "verify")]
+
+def keyPairBenchmarks(rsaKeys):
+    """
+    Benchmarks of the RsaKeyPair. The JWK and the thumbprint are computed
+    once per key, so the uncached variants drop them before each call.
+
+    @param rsaKeys: Dict mapping the key sizes to functions returning the RSA
+        keys.
+    @return: List of pairs of benchmark name and setup function.
+    """
+    kid = "https://acme.example.com/acme/acct/1"
+    url = "https://acme.example.com/acme/new-order"
+    def uncached(pair, method):
+        pair._RsaKeyPair__jwk = None
+        pair._RsaKeyPair__thumbprint = None
+        return method()
+    def setup(bits, name):
+        from letsencrypt.cert import RsaKeyPair
+        pair = RsaKeyPair()
+        pair.load(rsaKeys[bits]().exportKey())
+        return {"getJwk" : lambda: uncached(pair, pair.getJwk),
+                "getJwk[cached]" : pair.getJwk,
+                "getJwkThumbprint" : lambda: uncached(pair, pair.getJwkThumbprint),
+                "getJwkThumbprint[cached]" : pair.getJwkThumbprint,
+                "signJsonArray[%d]" % (bits) : lambda: pair.signJsonArray(PAYLOAD, "nonce"),
+                "signJsonArray[%d,kid]" % (bits) : lambda: pair.signJsonArray(PAYLOAD, "nonce", kid),
+                "signJws[%d]" % (bits) : lambda: pair.signJws(PAYLOAD, "nonce", url, kid)}[name]
+    rc = [(2048, x) for x in ("getJwk", "getJwk[cached]", "getJwkThumbprint", "getJwkThumbprint[cached]")]
+    for bits in sorted(rsaKeys.keys()):
+        rc += [(bits, x % (bits)) for x in ("signJsonArray[%d]", "signJsonArray[%d,kid]", "signJws[%d]")]
+    return [("RsaKeyPair.%s" % (name), lambda bits = bits, name = name: setup(bits, name)) for bits, name in rc]
+
+def rsaKeyFactory(bits):
+    """
+    Returns a function generating a RSA key on first use, as generating keys
+    of 4096 bits takes a while.
+
+    @param bits: The key size.
+    @return: Function returning the key.
+    """
+    keys = []
+    def getKey():
+        if len(keys) == 0:
+            from Crypto.PublicKey import RSA
+            keys.append(RSA.generate(bits))
+        return keys[0]
+    return getKey
+
+def collectBenchmarks():
+    """
+    Collects all benchmarks. The setup of a benchmark imports the modules
+    needed and creates its keys, so it is only run for benchmarks selected.
+
+    @return: List of pairs of benchmark name and setup function returning the
+        function to be timed.
+    """
+    rsaKeys = {2048 : rsaKeyFactory(2048), 4096 : rsaKeyFactory(4096)}
+    return encodingBenchmarks() + headerBenchmarks() + jwsBenchmarks(rsaKeys[2048]) + keyPairBenchmarks(rsaKeys)
+
+def calibrate(function, minTime):
+    """
+    Determines the number of calls per round, so a round takes at least
+    the given time and the resolution of the timer does not matter.
+
+    @param function: The function to be called.
+    @param minTime: Minimum duration of a round in seconds.
+    @return: The number of calls.
+    """
+    timer = Timer(function)
+    number = 1
+    while True:
+        if timer.timeit(number) >= minTime:
+            return number
+        number *= 10 if number < 1000000 else 2
+
+def quantile(values, q):
+    """
+    Returns a quantile of sorted values with linear interpolation.
+
+    @param values: Sorted list of values.
+    @param q: The quantile between 0 and 1.
+    @return: The quantile.
+    """
+    pos = (len(values) - 1) * q
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+def summarize(times):
+    """
+    Computes the statistics of the rounds of a benchmark.
+
+    @param times: List of seconds per call, one per round.
+    @return: Dict of the statistics.
+    """
+    times = sorted(times)
+    mean = sum(times) / len(times)
+    variance = sum([(x - mean) ** 2 for x in times]) / max(len(times) - 1, 1)
+    return {"median" : quantile(times, 0.5), "q1" : quantile(times, 0.25), "q3" : quantile(times, 0.75),
+            "iqr" : quantile(times, 0.75) - quantile(times, 0.25), "min" : times[0], "max" : times[-1],
+            "mean" : mean, "stdev" : variance ** 0.5}
+
+def runBenchmark(function, repeat, minTime):
+    """
+    Times a benchmark.
+
+    @param function: The function to be timed.
+    @param repeat: The number of rounds.
+    @param minTime: Minimum duration of a round in seconds.
+    @return: Dict of the statistics, the number of calls per round and the
+        number of rounds.
+    """
+    number = calibrate(function, minTime)
+    times = [x / number for x in Timer(function).repeat(repeat, number)]
+    result = summarize(times)
+    result["number"] = number
+    result["repeat"] = repeat
+    return result
+
+def compare(results, baseline, threshold):
+    """
+    Compares results against a baseline. A benchmark regressed, if its
+    median grew by more than the threshold and the interquartile ranges of
+    both runs do not overlap, so noise alone does not flag a regression.
+
+    @param results: Dict of results of this run.
+    @param baseline: Dict of results of the baseline run.
+    @param threshold: Relative growth of the median tolerated, e.g. 0.1.
+    @return: List of tuples of name, baseline median, median, ratio and the
+        verdict: "regression", "improvement" or "ok".
+    """
+    rc = []
+    for name in sorted(results.keys()):
+        if name not in baseline:
+            continue
+        old = baseline[name]
+        new = results[name]
+        ratio = new["median"] / old["median"]
+        verdict = "ok"
+        if ratio > 1 + threshold and new["q1"] > old["q3"]:
+            verdict = "regression"
+        elif ratio < 1 / (1 + threshold) and new["q3"] < old["q1"]:
+            verdict = "improvement"
+        rc.append((name, old["median"], new["median"], ratio, verdict))
+    return rc
+
+def formatTime(seconds):
+    """
+    Formats a duration with a unit matching its magnitude.
+
+    @param seconds: The duration.
+    @return: The formatted duration.
+    """
+    for unit, factor in (("s", 1), ("ms", 1e3), ("us", 1e6)):
+        if seconds >= 1 / factor:
+            return "%.3f %s" % (seconds * factor, unit)
+    return "%.1f ns" % (seconds * 1e9)
+
+OPTIONS = {"repeat" : ("15", int), "min-time" : ("0.05", float), "filter" : ("", str), "output" : ("", str),
+           "compare" : ("", str), "threshold" : ("0.1", float)}
+
+def parseOptions(args):
+    """
+    Parses the commandline options.
+
+    @param args: The commandline arguments excluding the program name.
+    @return: Dict of options.
+    """
+    opts, rest = getopt.getopt(args, "hl", ["help", "list"] + ["%s=" % (x) for x in OPTIONS.keys()])
+    options = dict((k, t(v)) for k, (v, t) in OPTIONS.items())
+    options["list"] = False
+    for c, a in opts:
+        if c in ["-h", "--help"]:
+            printHelp()
+            exit(0)
+        if c in ["-l", "--list"]:
+            options["list"] = True
+            continue
+        options[c[2:]] = OPTIONS[c[2:]][1](a)
+    return options
+
+def printHelp():
+    """
+    Shows the help.
+    """
+    print """usage: {0} [options]
+
+Micro-benchmarks of the crypto, JWS and encoding code. Each benchmark is run
+in several rounds, reported is the median time per call and the interquartile
+range. Benchmarks depending on a missing module (pycrypto, ecdsa, pycurl) are
+skipped.
+
+options:
+    --repeat=<n>           - rounds per benchmark (default 15)
+    --min-time=<s>         - minimum duration of a round (default 0.05)
+    --filter=<regex>       - run only the benchmarks matching
+    --output=<file>        - write the results as JSON
+    --compare=<file>       - compare with the JSON results of an earlier run,
+                             exits with 1 if a benchmark regressed
+    --threshold=<ratio>    - growth of the median tolerated (default 0.1)
+    --list                 - list the benchmarks only""".format(argv[0])
+
+def main(args):
+    options = parseOptions(args)
+    baseline = None
+    if len(options["compare"]) > 0:
+        with open(options["compare"], "r") as fp:
+            baseline = json.load(fp)["results"]
+    benchmarks = [(n, f) for n, f in collectBenchmarks() if re.search(options["filter"], n)]
+    if options["list"]:
+        for name, setup in benchmarks:
+            print name
+        return 0
+    results = {}
+    missing = {}
+    for name, setup in benchmarks:
+        try:
+            function = setup()
+        except ImportError as e:
+            missing.setdefault(str(e), []).append(name)
+            continue
+        results[name] = runBenchmark(function, options["repeat"], options["min-time"])
+        print "%-40s %12s  iqr %12s  (%d x %d)" % (name, formatTime(results[name]["median"]),
+                                                   formatTime(results[name]["iqr"]), results[name]["repeat"],
+                                                   results[name]["number"])
+    for error, names in sorted(missing.items()):
+        sys.stderr.write("skipped %d benchmark(s), %s: %s\n" % (len(names), error, ", ".join(names)))
+    if len(options["output"]) > 0:
+        report = {"created" : time(), "python" : version.split()[0], "platform" : platform.platform(),
+                  "timer" : default_timer.__name__, "results" : results}
+        with open(options["output"], "w") as fp:
+            json.dump(report, fp, indent = 2, sort_keys = True)
+    if baseline is None:
+        return 0
+    regressions = 0
+    print
+    for name, old, new, ratio, verdict in compare(results, baseline, options["threshold"]):
+        print "%-40s %12s -> %12s  %+7.1f%%  %s" % (name, formatTime(old), formatTime(new), (ratio - 1) * 100, verdict)
+        if verdict == "regression":
+            regressions += 1
+    if regressions > 0:
+        print "%d benchmark(s) regressed" % (regressions)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    exit(main(argv[1:]))
@@ -22,9 +22,11 @@ from modules.key import KeyModule
 from modules.register import RegisterModule
 from modules.sign import SignModule
 from modules.revoke import RevokeModule
+from modules.renew import RenewModule
+from modules.daemon import DaemonModule
 from letsencrypt import LeException
 
-modules = {"userkey" : KeyModule, "serverkey": KeyModule, "register" : RegisterModule, "sign" : SignModule, "revoke" : RevokeModule }
+modules = {"userkey" : KeyModule, "serverkey": KeyModule, "register" : RegisterModule, "sign" : SignModule, "revoke" : RevokeModule, "renew" : RenewModule, "daemon" : DaemonModule }
 
 def printHelp(argv):
     global modules